@@ -0,0 +1,46 @@
+"""Compare two pipeline benchmark results, stage by stage.
+
+Usage: python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+
+def load(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as results:
+        return json.load(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    print(f"before: {before['commit'][:10]}  {before['rows']}")
+    print(f"after:  {after['commit'][:10]}  {after['rows']}")
+
+    before_stages = {stage["name"]: stage for stage in before["stages"]}
+    print(f"{'stage':>24} {'before':>10} {'after':>10} {'change':>8} {'peak RSS':>18}")
+    for stage in after["stages"]:
+        previous = before_stages.get(stage["name"])
+        if previous is None:
+            continue
+
+        change = stage["seconds"] / previous["seconds"] if previous["seconds"] else 0.0
+        print(
+            f"{stage['name']:>24} {previous['seconds']:>9.3f}s {stage['seconds']:>9.3f}s"
+            f" {change:>7.2f}x {previous['peak_rss_mib']:>7.1f} -> {stage['peak_rss_mib']:>6.1f}"
+        )
+
+    print(
+        f"{'total':>24} {before['total_seconds']:>9.3f}s {after['total_seconds']:>9.3f}s"
+        f" {after['total_seconds'] / before['total_seconds']:>7.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Compare the heatmaps and exports of every downsampling mode with those of every position.
+
+Usage: python benchmarks/downsampling.py --synthetic-users 200 --position-log-freq 0.5
+
+For every mode: the positions kept, the time taken to downsample them and to draw the
+perspective heatmaps, the memory of the positions table, the size of a Parquet export,
+and the error of the (dwell weighted) grid density against the one of every position,
+as the fraction of the density that moved and as the largest difference relative to
+the peak density.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from density import grid_density  # noqa: E402
+from downsample import DOWNSAMPLE_MODES, downsample_store  # noqa: E402
+from export import export_sessions  # noqa: E402
+from models import Userdata  # noqa: E402
+from process import (  # noqa: E402
+    HEATMAP_BACKENDS,
+    MAP_EXTENT,
+    associate_perspectives,
+    generate_heatmaps,
+    parse_sessions,
+)
+from store import SessionStore  # noqa: E402
+from study import Study  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# Every generated session is analysed, with the bananas placed in the game
+SYNTHETIC_STUDY = Study(name="synthetic")
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def positions_size(store: SessionStore) -> int:
+    return sum(column.nbytes for column in store.positions.columns.values())
+
+
+def density(store: SessionStore, user_indices: np.ndarray) -> np.ndarray:
+    positions = store.positions
+    rows = positions.rows_for_users(user_indices)
+    return grid_density(
+        positions["position"][rows][:, [0, 2]],
+        MAP_EXTENT,
+        weights=positions["dwell"][rows] if "dwell" in positions.columns else None,
+        frequency_weights=True,
+    )
+
+
+def measure(
+    store: SessionStore,
+    user_indices: np.ndarray,
+    scratch: Path,
+    name: str,
+    backend: str,
+    background: np.ndarray,
+) -> dict:
+    start = time.perf_counter()
+    positions_per_perspective = associate_perspectives(store, user_indices)
+    dwell_per_perspective = None
+    if "dwell" in store.positions.columns:
+        dwell_per_perspective = associate_perspectives(
+            store, user_indices, column="dwell"
+        )
+    generate_heatmaps(
+        positions_per_perspective,
+        backend=backend,
+        output_path=scratch / f"heatmaps-{name}.png",
+        background_image=background,
+        dwell_per_perspective=dwell_per_perspective,
+    )
+    heatmap_seconds = time.perf_counter() - start
+
+    export_sessions(store, [], scratch / f"export-{name}", "parquet")
+
+    return {
+        "positions": len(store.positions),
+        "heatmap_seconds": heatmap_seconds,
+        "memory": positions_size(store),
+        "export": directory_size(scratch / f"export-{name}"),
+        "density": density(store, user_indices),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=Path.cwd().parent.joinpath("server-assets", "db.db"),
+    )
+    parser.add_argument(
+        "--synthetic-users",
+        type=int,
+        default=None,
+        help="benchmark on a generated database with this many users instead of --db",
+    )
+    parser.add_argument(
+        "--position-log-freq",
+        type=float,
+        default=2.5,
+        help="seconds between the generated position logs",
+    )
+    parser.add_argument("--heatmap-backend", choices=HEATMAP_BACKENDS, default="grid")
+    parser.add_argument("--tolerance", type=float, default=None)
+    parser.add_argument("--bucket-seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+        if args.synthetic_users is not None:
+            args.db = generate_database(
+                scratch / "synthetic.db",
+                users=args.synthetic_users,
+                position_log_freq=args.position_log_freq,
+            )
+
+        engine = create_engine(f"sqlite:///{args.db.resolve()}", echo=False)
+        with Session(engine) as session:
+            users = (
+                session.execute(select(Userdata).order_by(Userdata.id)).scalars().all()
+            )
+            store = parse_sessions(session, users, SYNTHETIC_STUDY, stream=True)
+
+        user_indices = np.arange(len(store))
+        background = np.full((200, 200, 3), 0.8)
+
+        full = measure(
+            store, user_indices, scratch, "full", args.heatmap_backend, background
+        )
+        print(
+            f"{'every position':>16}: {full['positions']:8d} positions, "
+            f"heatmaps {full['heatmap_seconds']:6.2f}s, "
+            f"{full['memory'] / 2**20:6.1f} MiB in memory, "
+            f"export {full['export'] / 2**20:6.2f} MiB"
+        )
+
+        for mode in DOWNSAMPLE_MODES:
+            start = time.perf_counter()
+            downsampled = downsample_store(
+                store,
+                mode,
+                tolerance=args.tolerance,
+                bucket_seconds=args.bucket_seconds,
+            )
+            downsample_seconds = time.perf_counter() - start
+
+            result = measure(
+                downsampled,
+                user_indices,
+                scratch,
+                mode,
+                args.heatmap_backend,
+                background,
+            )
+            difference = np.abs(result["density"] - full["density"])
+            print(
+                f"{mode:>16}: {result['positions']:8d} positions "
+                f"(x{full['positions'] / max(result['positions'], 1):.1f}, "
+                f"in {downsample_seconds:.3f}s), "
+                f"heatmaps {result['heatmap_seconds']:6.2f}s, "
+                f"{result['memory'] / 2**20:6.1f} MiB in memory, "
+                f"export {result['export'] / 2**20:6.2f} MiB, "
+                f"density moved {difference.sum() / full['density'].sum():.2%}, "
+                f"largest difference {difference.max() / full['density'].max():.2%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Time importer.py on a MariaDB dump generated from an analytics database.
+
+Usage: python benchmarks/import_dump.py --synthetic-users 2000 [--gzip] [--csv]
+
+The dump is written like phpMyAdmin does (the production schema plus the perspective and
+params columns, timestamp(3) values, multi-row INSERTs), imported again, and the imported
+tables are compared with the source ones.
+"""
+
+import argparse
+import csv
+import gzip
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from importer import import_rows, read_csv_export, read_sql_dump  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# Rows per INSERT statement, phpMyAdmin's default
+ROWS_PER_INSERT = 1000
+
+DUMP_HEADER = """-- phpMyAdmin SQL Dump
+SET SQL_MODE = "NO_AUTO_VALUE_ON_ZERO";
+SET AUTOCOMMIT = 0;
+START TRANSACTION;
+SET time_zone = "+00:00";
+
+CREATE TABLE `timeseries` (
+  `id` int(11) NOT NULL,
+  `userdata_id` int(11) NOT NULL,
+  `timestamp` timestamp(3) NULL DEFAULT NULL,
+  `logtype` varchar(45) COLLATE utf8_unicode_ci NOT NULL,
+  `logline` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+CREATE TABLE `userdata` (
+  `id` int(11) NOT NULL,
+  `user` varchar(45) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `perspective` varchar(45) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `ipaddr` varchar(45) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `starttime` timestamp NULL DEFAULT NULL,
+  `endtime` timestamp NULL DEFAULT NULL,
+  `params` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+"""
+
+TABLE_QUERIES = {
+    "userdata": "SELECT id, user, perspective, ipaddr, starttime, endtime, params "
+    "FROM userdata ORDER BY id",
+    "timeseries": "SELECT id, CAST(userdata_id AS INTEGER) AS userdata_id, timestamp, "
+    "logtype, logline FROM timeseries ORDER BY id",
+}
+
+
+def _sql_value(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    escaped = (
+        value.replace("\\", "\\\\")
+        .replace("'", "\\'")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+    return f"'{escaped}'"
+
+
+def write_sql_dump(db_path: Path, dump_path: Path):
+    """Dump the analytics tables the way phpMyAdmin dumps the production database."""
+    connection = sqlite3.connect(db_path)
+    opener = gzip.open if dump_path.suffix == ".gz" else open
+    with opener(dump_path, "wt", encoding="utf-8") as dump:
+        dump.write(DUMP_HEADER)
+        for table, query in TABLE_QUERIES.items():
+            cursor = connection.execute(query)
+            columns = ", ".join(f"`{column[0]}`" for column in cursor.description)
+            while rows := cursor.fetchmany(ROWS_PER_INSERT):
+                if table == "timeseries":
+                    # Logs are stored with milliseconds in MariaDB
+                    rows = [(*row[:2], f"{row[2]}.000", *row[3:]) for row in rows]
+                dump.write(f"INSERT INTO `{table}` ({columns}) VALUES\n")
+                dump.write(
+                    ",\n".join(f"({', '.join(map(_sql_value, row))})" for row in rows)
+                )
+                dump.write(";\n\n")
+        dump.write("COMMIT;\n")
+    connection.close()
+
+
+def write_csv_export(db_path: Path, directory: Path):
+    """One <table>.csv per table, with a header row and \\N for NULL."""
+    directory.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    for table, query in TABLE_QUERIES.items():
+        cursor = connection.execute(query)
+        with open(directory / f"{table}.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(column[0] for column in cursor.description)
+            for row in cursor:
+                writer.writerow("\\N" if value is None else value for value in row)
+    connection.close()
+
+
+def tables_match(source_path: Path, imported_path: Path) -> bool:
+    source = sqlite3.connect(source_path)
+    imported = sqlite3.connect(imported_path)
+    try:
+        return all(
+            source.execute(query).fetchall() == imported.execute(query).fetchall()
+            for query in TABLE_QUERIES.values()
+        )
+    finally:
+        source.close()
+        imported.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=Path.cwd().parent.joinpath("server-assets", "db.db"),
+    )
+    parser.add_argument(
+        "--synthetic-users",
+        type=int,
+        default=None,
+        help="dump a generated database with this many users instead of --db",
+    )
+    parser.add_argument("--gzip", action="store_true", help="gzip the dump")
+    parser.add_argument(
+        "--csv", action="store_true", help="import a CSV export instead of a dump"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+        if args.synthetic_users is not None:
+            args.db = generate_database(
+                scratch / "synthetic.db", users=args.synthetic_users
+            )
+
+        if args.csv:
+            source = scratch / "export"
+            write_csv_export(args.db, source)
+            size = sum(path.stat().st_size for path in source.iterdir())
+        else:
+            source = scratch / ("dump.sql.gz" if args.gzip else "dump.sql")
+            write_sql_dump(args.db, source)
+            size = source.stat().st_size
+
+        start = time.perf_counter()
+        batches = read_csv_export(source) if args.csv else read_sql_dump(source)
+        counts = import_rows(batches, scratch / "imported.db")
+        seconds = time.perf_counter() - start
+
+        rows = sum(counts.values())
+        print(
+            f"Imported {rows} rows ({size / 2**20:.1f} MiB) in {seconds:.2f}s: "
+            f"{rows / seconds:,.0f} rows/s, {size / 2**20 / seconds:.1f} MiB/s"
+        )
+        if not tables_match(args.db, scratch / "imported.db"):
+            raise SystemExit("The imported tables differ from the source ones")
+        print("The imported tables match the source ones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Load the ingest server with simulated players and report its throughput and latency.
+
+Usage: python benchmarks/ingest_load.py --players 200 --posts 20 --post-interval 0.2
+
+Every player opens a session, posts a batch of POSLOG rows every --post-interval
+seconds on a kept-alive connection (the game posts every 5 seconds, a shorter interval
+stands in for more players), and ends its session. A post due while the previous one
+is still unanswered is sent as soon as it is answered. The server runs in its own
+process on an empty database, once with group commits and once committing every post
+on its own (as the PHP endpoint does), and the committed row count is checked.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC))
+
+from ingest import (  # noqa: E402
+    DEFAULT_FLUSH_INTERVAL_SECONDS,
+    DEFAULT_FLUSH_ROWS,
+    REPLY_POSTED,
+)
+
+
+class Connection:
+    """A kept-alive HTTP/1.1 connection to the ingest server."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, port: int) -> "Connection":
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def post(self, path: str, payload: Union[dict, bytes]) -> str:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: localhost\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await self.writer.drain()
+
+        status = await self.reader.readline()
+        length = 0
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        reply = (await self.reader.readexactly(length)).decode("utf-8")
+        if b" 200 " not in status:
+            raise RuntimeError(f"{path}: {status!r} {reply}")
+        return reply
+
+    def close(self):
+        self.writer.close()
+
+
+def poslog_rows(user_id: int, start: float, count: int, rng) -> List[dict]:
+    """Rows like the game's position logs, one per second."""
+    positions = rng.uniform(-100, 100, size=(count, 3)).round(2)
+    return [
+        {
+            "userdata_id": user_id,
+            "timestamp": str(int(start) + i),
+            "logtype": "POSLOG",
+            "logline": f"({x:.2f}, {y:.2f}, {z:.2f})|(0.0, {i % 360}.0, 0.0)|RUN",
+        }
+        for i, (x, y, z) in enumerate(positions)
+    ]
+
+
+async def play(
+    port: int,
+    posts: int,
+    rows_per_post: int,
+    interval: float,
+    seed: int,
+    started: asyncio.Barrier,
+    latencies: List[float],
+):
+    rng = np.random.default_rng(seed)
+    connection = await Connection.open(port)
+    try:
+        session = json.loads(
+            await connection.post(
+                "/session/postnew",
+                {
+                    "parameters": "load",
+                    "timestamp": str(int(time.time())),
+                    "perspective": ("FIRSTPERSON", "THIRDPERSON")[seed % 2],
+                },
+            )
+        )
+
+        # Encoded beforehand, so the load generator spends its time posting
+        start = time.time()
+        bodies = [
+            json.dumps(
+                {
+                    "id": session["id"],
+                    "user": session["user"],
+                    "postdata": poslog_rows(
+                        session["id"], start + post * rows_per_post, rows_per_post, rng
+                    ),
+                }
+            ).encode()
+            for post in range(posts)
+        ]
+        await started.wait()
+
+        # Players do not post in step
+        due = time.perf_counter() + rng.uniform(0, interval)
+        for body in bodies:
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            due += interval
+
+            posted = time.perf_counter()
+            reply = await connection.post("/timeseries/post", body)
+            latencies.append(time.perf_counter() - posted)
+            if reply != REPLY_POSTED:
+                raise RuntimeError(f"Unexpected reply {reply!r}")
+
+        await connection.post(
+            "/session/postend",
+            {
+                "id": session["id"],
+                "user": session["user"],
+                "timestamp": str(int(time.time())),
+            },
+        )
+    finally:
+        connection.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _wait_until_listening(port: int, server: subprocess.Popen):
+    for _ in range(200):
+        if server.poll() is not None:
+            raise SystemExit("The ingest server exited before listening")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.05)
+            continue
+        writer.close()
+        return
+    raise SystemExit("The ingest server is not listening")
+
+
+async def run_load(args: argparse.Namespace, db_path: Path, server_args: List[str]):
+    port = _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            str(SRC / "ingest.py"),
+            "--db",
+            str(db_path),
+            "--port",
+            str(port),
+            *server_args,
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        await _wait_until_listening(port, server)
+
+        latencies: List[float] = []
+        started = asyncio.Barrier(args.players + 1)
+        players = asyncio.gather(
+            *(
+                play(
+                    port,
+                    args.posts,
+                    args.rows_per_post,
+                    args.post_interval,
+                    seed,
+                    started,
+                    latencies,
+                )
+                for seed in range(args.players)
+            )
+        )
+        await started.wait()
+        start = time.perf_counter()
+        await players
+        seconds = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    expected = args.players * args.posts * args.rows_per_post
+    with sqlite3.connect(db_path) as connection:
+        (committed,) = connection.execute("SELECT COUNT(*) FROM timeseries").fetchone()
+    if committed != expected:
+        raise SystemExit(f"{committed} rows committed, {expected} posted")
+
+    return expected / seconds, np.percentile(np.array(latencies) * 1000, [50, 99])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=20, help="posts per player")
+    parser.add_argument("--rows-per-post", type=int, default=50)
+    parser.add_argument(
+        "--post-interval", type=float, default=0.2, help="seconds between posts"
+    )
+    parser.add_argument("--flush-rows", type=int, default=DEFAULT_FLUSH_ROWS)
+    parser.add_argument(
+        "--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL_SECONDS
+    )
+    args = parser.parse_args(argv)
+
+    configurations = {
+        "group commit": [
+            "--flush-rows",
+            str(args.flush_rows),
+            "--flush-interval",
+            str(args.flush_interval),
+        ],
+        "commit per post": ["--flush-rows", "1", "--flush-interval", "0"],
+    }
+
+    print(
+        f"{args.players} players x {args.posts} posts x {args.rows_per_post} rows, "
+        f"every {args.post_interval}s"
+    )
+    with tempfile.TemporaryDirectory() as scratch:
+        for i, (name, server_args) in enumerate(configurations.items()):
+            rows_per_second, (p50, p99) = asyncio.run(
+                run_load(args, Path(scratch, f"ingest-{i}.db"), server_args)
+            )
+            print(
+                f"{name:>16}: {rows_per_second:9.0f} rows/s, "
+                f"latency p50 {p50:6.1f}ms p99 {p99:6.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Time every stage of the analytics pipeline on a synthetic (or given) database.
+
+Usage: python benchmarks/pipeline.py --users 200 --session-minutes 15 --output bench.json
+"""
+
+import argparse
+import datetime
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import matplotlib.pyplot as plt  # noqa: E402
+from sqlalchemy import create_engine, func, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from instrument import PipelineReport  # noqa: E402
+from metrics import trajectory_metrics  # noqa: E402
+from models import Timeseries, Userdata  # noqa: E402
+from process import (  # noqa: E402
+    HEATMAP_BACKENDS,
+    MAP_EXTENT,
+    aggregate_sessions,
+    associate_perspectives,
+    generate_heatmaps,
+    parse_sessions,
+    write_stats,
+)
+from study import Study  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# Every generated session is analysed, with the bananas placed in the game
+SYNTHETIC_STUDY = Study(name="synthetic")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db", type=Path, default=None, help="existing database, skips generation"
+    )
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--session-minutes", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--heatmap-backend", choices=HEATMAP_BACKENDS, default="grid")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+        report = PipelineReport(verbose=True)
+
+        db_path = args.db
+        if db_path is None:
+            with report.stage("generate"):
+                db_path = generate_database(
+                    scratch / "synthetic.db",
+                    users=args.users,
+                    session_minutes=args.session_minutes,
+                    seed=args.seed,
+                )
+
+        # Blank stand-in for data/map.jpeg so the rendering cost is still measured
+        background_path = scratch / "map.png"
+        plt.imsave(background_path, np.full((512, 512, 3), 0.8))
+
+        engine = create_engine(f"sqlite:///{db_path.resolve()}", echo=False)
+        with Session(engine) as session:
+            timeseries_rows = session.execute(
+                select(func.count()).select_from(Timeseries)
+            ).scalar_one()
+
+            with report.stage("query"):
+                users = (
+                    session.execute(select(Userdata).order_by(Userdata.id))
+                    .scalars()
+                    .all()
+                )
+
+            with report.stage("parse_userdata"):
+                store = parse_sessions(
+                    session,
+                    users,
+                    SYNTHETIC_STUDY,
+                    stream=args.stream,
+                    workers=args.workers,
+                )
+
+            with report.stage("trajectory_metrics"):
+                metrics = trajectory_metrics(store.positions, len(store), MAP_EXTENT)
+
+            with report.stage("aggregate"):
+                global_stats, user_stats = aggregate_sessions(store, metrics)
+
+            with report.stage("associate_perspectives"):
+                positions_per_perspective = associate_perspectives(
+                    store, store.user_indices([stats.user_id for stats in user_stats])
+                )
+
+            with report.stage("generate_heatmaps"):
+                generate_heatmaps(
+                    positions_per_perspective,
+                    backend=args.heatmap_backend,
+                    background_path=background_path,
+                    output_path=scratch / "heatmaps.png",
+                )
+
+            with report.stage("write_stats"):
+                write_stats(global_stats, user_stats, scratch, verbose=False)
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "db": str(args.db) if args.db is not None else None,
+            "users": len(users),
+            "session_minutes": args.session_minutes,
+            "seed": args.seed,
+            "workers": args.workers,
+            "stream": args.stream,
+            "heatmap_backend": args.heatmap_backend,
+        },
+        "rows": {
+            "timeseries": timeseries_rows,
+            "positions": len(store.positions),
+            "banana_pickups": len(store.banana_pickups),
+            "roi_visits": len(store.roi_visits),
+            "curiosity": len(store.curiosity),
+        },
+        "stages": report.stages,
+        "total_seconds": sum(
+            stage["seconds"] for stage in report.stages if stage["name"] != "generate"
+        ),
+    }
+
+    print(f"{'total':>24}: {results['total_seconds']:8.3f}s")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Time PositionIndex queries against brute-force filtering of every position.
+
+Usage: python benchmarks/position_queries.py --synthetic-users 500 --queries 200
+
+Every query is also checked to return the same rows as the brute-force filter.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from models import Userdata  # noqa: E402
+from process import MAP_EXTENT, parse_sessions  # noqa: E402
+from spatial import DEFAULT_CELL_SIZE, PositionIndex  # noqa: E402
+from store import SessionStore  # noqa: E402
+from study import Study  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# Every generated session is analysed, with the bananas placed in the game
+SYNTHETIC_STUDY = Study(name="synthetic")
+
+
+def brute_force(
+    store: SessionStore,
+    center=None,
+    radius=None,
+    box=None,
+    start=None,
+    end=None,
+    since_start=False,
+) -> np.ndarray:
+    positions = store.positions
+    keep = np.ones(len(positions), dtype=bool)
+    x, z = positions["position"][:, 0], positions["position"][:, 2]
+
+    if center is not None:
+        keep &= (x - center[0]) ** 2 + (z - center[2]) ** 2 <= radius**2
+    if box is not None:
+        keep &= (x >= box[0]) & (x <= box[1]) & (z >= box[2]) & (z <= box[3])
+
+    times = positions["timestamp"]
+    if since_start:
+        times = times - store.starttime[positions["user_index"]]
+    if start is not None:
+        keep &= times >= start
+    if end is not None:
+        keep &= times < end
+
+    return np.flatnonzero(keep)
+
+
+def random_queries(store: SessionStore, count: int, rng: np.random.Generator) -> list:
+    """A mix of radius (around the bananas), box and time window queries."""
+    bananas = list(SYNTHETIC_STUDY.bananas.values())
+    x_min, x_max, z_min, z_max = MAP_EXTENT
+
+    queries = []
+    for i in range(count):
+        start = float(rng.uniform(0, 10 * 60))
+        window = {"start": start, "end": start + 3 * 60, "since_start": True}
+        if i % 3 == 0:
+            banana = bananas[i % len(bananas)]
+            queries.append({"center": banana.pos, "radius": 10.0, **window})
+        elif i % 3 == 1:
+            x, z = rng.uniform(x_min, x_max), rng.uniform(z_min, z_max)
+            queries.append({"box": (x, x + 20, z, z + 20)})
+        else:
+            queries.append(window)
+    return queries
+
+
+def run_query(index: PositionIndex, query: dict) -> np.ndarray:
+    window = {
+        name: query[name] for name in ("start", "end", "since_start") if name in query
+    }
+    if "center" in query:
+        return index.within(query["center"], query["radius"], **window)
+    if "box" in query:
+        return index.in_box(*query["box"], **window)
+    return index.during(**window)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=Path.cwd().parent.joinpath("server-assets", "db.db"),
+    )
+    parser.add_argument(
+        "--synthetic-users",
+        type=int,
+        default=None,
+        help="benchmark on a generated database with this many users instead of --db",
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--cell-size", type=float, default=DEFAULT_CELL_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.synthetic_users is not None:
+            args.db = generate_database(
+                Path(scratch, "synthetic.db"), users=args.synthetic_users
+            )
+
+        engine = create_engine(f"sqlite:///{args.db.resolve()}", echo=False)
+        with Session(engine) as session:
+            users = (
+                session.execute(select(Userdata).order_by(Userdata.id)).scalars().all()
+            )
+            store = parse_sessions(session, users, SYNTHETIC_STUDY, stream=True)
+
+    start = time.perf_counter()
+    index = PositionIndex(store, cell_size=args.cell_size)
+    build_seconds = time.perf_counter() - start
+    print(
+        f"Indexed {len(store.positions)} positions of {len(store)} users "
+        f"in {build_seconds:.3f}s"
+    )
+
+    queries = random_queries(store, args.queries, np.random.default_rng(0))
+
+    start = time.perf_counter()
+    expected = [brute_force(store, **query) for query in queries]
+    brute_force_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [run_query(index, query) for query in queries]
+    index_seconds = time.perf_counter() - start
+
+    for query, rows, expected_rows in zip(queries, results, expected):
+        if not np.array_equal(rows, expected_rows):
+            raise SystemExit(f"The index and brute force differ on {query}")
+
+    print(
+        f"{len(queries)} queries: brute force {brute_force_seconds:.3f}s, "
+        f"index {index_seconds:.3f}s "
+        f"(x{brute_force_seconds / index_seconds:.1f}), same rows"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Generate synthetic Shinobi Valley databases for benchmarking the analytics.
+
+Usage: python benchmarks/synthetic.py data/synthetic.db --users 200 --session-minutes 15
+"""
+
+import argparse
+import datetime
+import sqlite3
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from collectibles import BANANA_OFFSETS, place_bananas  # noqa: E402
+from decoders import USER_TIMESTAMP_FORMAT  # noqa: E402
+from process import MAP_EXTENT  # noqa: E402
+
+# The schema the PHP endpoint creates, which is what the analytics read from
+SCHEMA_PATH = Path(__file__).resolve().parents[2] / "server-assets" / "schema.sql"
+
+ROI_NAMES = [
+    "Obstruction_Forest_A",
+    "Obstruction_Forest_B",
+    "Obstruction_GroundFog",
+    "OufofPlace_StoneStack_A",
+    "OufofPlace_StoneStack_B",
+    "OufofPlace_StoneSpiral",
+    "Connections_HillPath",
+    "Connections_MountainCave",
+    "Connections_CliffCave",
+    "Extreme_Mountain_A",
+    "Extreme_Mountain_B",
+    "Extreme_Mountain_C",
+]
+
+PERSPECTIVES = ["FIRSTPERSON", "THIRDPERSON"]
+
+STUDY_START = datetime.datetime(2024, 12, 3, 9, 0, 0)
+
+
+def _format_poslog(
+    position: np.ndarray,
+    rotation: np.ndarray,
+    euler: np.ndarray,
+    pos_delta: float,
+    rot_delta: float,
+    path_distance: float,
+    jumping: bool,
+    running: bool,
+    comma_decimal: bool,
+) -> str:
+    # Same layout as GameCTRL.PostPosition; players with a ',' decimal locale get it
+    # in every value that is not formatted through Vector3/Quaternion.ToString
+    def number(value: float, digits: int) -> str:
+        text = f"{value:.{digits}f}"
+        return text.replace(".", ",") if comma_decimal else text
+
+    return (
+        f"({position[0]:.3f}, {position[1]:.3f}, {position[2]:.3f})"
+        f"_({rotation[0]:.5f}, {rotation[1]:.5f}, {rotation[2]:.5f}, {rotation[3]:.5f})"
+        f"_{number(euler[0], 3)},{number(euler[1], 3)}"
+        f"_POSDELTA:{number(pos_delta, 4)}"
+        f"_ROTDELTA:{number(rot_delta, 4)}"
+        f"_PD:{number(path_distance, 3)}"
+        f"_JMP:{int(jumping)}"
+        f"_RUN:{int(running)}"
+    )
+
+
+def _session_rows(
+    rng: np.random.Generator,
+    userdata_id: int,
+    starttime: datetime.datetime,
+    session_seconds: float,
+    position_log_freq: float,
+    comma_decimal: bool,
+) -> list:
+    """(userdata_id, timestamp, logtype, logline) rows of one play session, in log order."""
+    poslog_times = np.arange(0.0, session_seconds, position_log_freq)
+    n = len(poslog_times)
+
+    # Random walk over the map, players stand still about a third of the time
+    x_min, x_max, z_min, z_max = MAP_EXTENT
+    steps = rng.normal(0.0, 4.0, size=(n, 3)) * (rng.random((n, 1)) > 0.33)
+    steps[:, 1] *= 0.1
+    positions = np.cumsum(steps, axis=0) + [
+        rng.uniform(x_min / 2, x_max / 2),
+        rng.uniform(0.0, 40.0),
+        rng.uniform(z_min / 2, z_max / 2),
+    ]
+    positions[:, 0] = np.clip(positions[:, 0], x_min, x_max)
+    positions[:, 2] = np.clip(positions[:, 2], z_min, z_max)
+
+    # Walk to some of the bananas and pick them up
+    banana_positions = np.array(
+        [banana.pos for banana in place_bananas(BANANA_OFFSETS).values()]
+    )
+    pickup_count = rng.integers(0, len(banana_positions) + 1)
+    pickup_rows = np.sort(rng.choice(n, size=min(pickup_count, n), replace=False))
+    picked = rng.choice(len(banana_positions), size=len(pickup_rows), replace=False)
+    positions[pickup_rows] = banana_positions[picked] + rng.normal(
+        0.0, 0.5, size=(len(pickup_rows), 3)
+    )
+
+    rotations = rng.normal(size=(n, 4))
+    rotations /= np.linalg.norm(rotations, axis=1, keepdims=True)
+    eulers = rng.uniform(0.0, 360.0, size=(n, 2))
+    pos_deltas = np.linalg.norm(
+        np.diff(positions, axis=0, prepend=positions[:1]), axis=1
+    )
+    rot_deltas = rng.uniform(0.0, 45.0, size=n)
+    path_distances = rng.uniform(0.0, 5.0, size=n)
+    jumping = rng.random(n) < 0.05
+    running = rng.random(n) < 0.4
+
+    # (seconds since start, order within the same second, logtype, logline)
+    events = [(0.0, 0, "INFO", "START POSLOG")]
+    for row in range(n):
+        events.append(
+            (
+                poslog_times[row],
+                1,
+                "POSLOG",
+                _format_poslog(
+                    positions[row],
+                    rotations[row],
+                    eulers[row],
+                    pos_deltas[row],
+                    rot_deltas[row],
+                    path_distances[row],
+                    jumping[row],
+                    running[row],
+                    comma_decimal,
+                ),
+            )
+        )
+    for row in pickup_rows:
+        events.append((poslog_times[row], 2, "TRIGGER_ROI_ENTER", "Foraging_Banana"))
+
+    for visit_time in np.sort(
+        rng.uniform(0.0, session_seconds, size=rng.integers(3, 15))
+    ):
+        roi_name = ROI_NAMES[rng.integers(len(ROI_NAMES))]
+        events.append((visit_time, 2, "TRIGGER_ROI_ENTER", roi_name))
+        events.append((visit_time + 5.0, 2, "TRIGGER_ROI_EXIT", roi_name))
+
+    for feedback_time in np.arange(60.0, session_seconds, 90.0):
+        curiosity = f"{rng.uniform(0.0, 1.0):.2f}"
+        events.append(
+            (
+                feedback_time,
+                2,
+                "FEEDBACK",
+                curiosity.replace(".", ",") if comma_decimal else curiosity,
+            )
+        )
+    events.append((session_seconds, 3, "INFO", "STOP POSLOG"))
+
+    events.sort(key=lambda event: (event[0], event[1]))
+    return [
+        (
+            str(userdata_id),
+            (starttime + datetime.timedelta(seconds=seconds)).strftime(
+                USER_TIMESTAMP_FORMAT
+            ),
+            logtype,
+            logline,
+        )
+        for seconds, _, logtype, logline in events
+    ]
+
+
+def generate_database(
+    path: Path,
+    users: int = 100,
+    session_minutes: float = 10.0,
+    position_log_freq: float = 2.5,
+    comma_decimal_fraction: float = 0.4,
+    missing_endtime_fraction: float = 0.3,
+    seed: int = 0,
+) -> Path:
+    """Create (or replace) a SQLite database at `path` filled with synthetic sessions."""
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    rng = np.random.default_rng(seed)
+
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+
+    with connection:
+        for userdata_id in range(1, users + 1):
+            starttime = STUDY_START + datetime.timedelta(minutes=17 * userdata_id)
+            # Sessions vary around the requested length, some are too short to count
+            session_seconds = max(
+                rng.normal(session_minutes, session_minutes / 4) * 60, 30.0
+            )
+            endtime = starttime + datetime.timedelta(seconds=session_seconds)
+
+            connection.execute(
+                "INSERT INTO userdata (id, user, perspective, ipaddr, starttime, endtime, params) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    userdata_id,
+                    f"{rng.integers(0, 2**32):X}",
+                    PERSPECTIVES[userdata_id % len(PERSPECTIVES)],
+                    "127.0.0.1",
+                    starttime.strftime(USER_TIMESTAMP_FORMAT),
+                    (
+                        None
+                        if rng.random() < missing_endtime_fraction
+                        else endtime.strftime(USER_TIMESTAMP_FORMAT)
+                    ),
+                    "NINJA_PAT:true_A2B_TXT:true_WEBGLPLAYER",
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO timeseries (userdata_id, timestamp, logtype, logline) "
+                "VALUES (?, ?, ?, ?)",
+                _session_rows(
+                    rng,
+                    userdata_id,
+                    starttime,
+                    session_seconds,
+                    position_log_freq,
+                    rng.random() < comma_decimal_fraction,
+                ),
+            )
+
+    connection.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--session-minutes", type=float, default=10.0)
+    parser.add_argument("--position-log-freq", type=float, default=2.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_database(
+        args.path,
+        users=args.users,
+        session_minutes=args.session_minutes,
+        position_log_freq=args.position_log_freq,
+        seed=args.seed,
+    )
+    print(f"Synthetic database written to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Time parse_sessions with an increasing number of worker processes.
+
+Usage: python benchmarks/worker_scaling.py --synthetic-users 500 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from models import Userdata  # noqa: E402
+from process import parse_sessions  # noqa: E402
+from study import Study  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# Every generated session is analysed, with the bananas placed in the game
+SYNTHETIC_STUDY = Study(name="synthetic")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=Path.cwd().parent.joinpath("server-assets", "db.db"),
+    )
+    parser.add_argument(
+        "--synthetic-users",
+        type=int,
+        default=None,
+        help="benchmark on a generated database with this many users instead of --db",
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.synthetic_users is not None:
+            args.db = generate_database(
+                Path(scratch, "synthetic.db"), users=args.synthetic_users
+            )
+
+        results = run(args)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=4)
+
+
+def run(args: argparse.Namespace) -> list:
+    engine = create_engine(f"sqlite:///{args.db.resolve()}", echo=False)
+
+    results = []
+    for workers in args.workers:
+        timings = []
+        for _ in range(args.repeat):
+            with Session(engine) as session:
+                users = (
+                    session.execute(select(Userdata).order_by(Userdata.id))
+                    .scalars()
+                    .all()
+                )
+
+                start = time.perf_counter()
+                store = parse_sessions(
+                    session, users, SYNTHETIC_STUDY, stream=args.stream, workers=workers
+                )
+                timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        results.append(
+            {
+                "workers": workers,
+                "users": len(store),
+                "positions": len(store.positions),
+                "best_seconds": best,
+                "speedup": results[0]["best_seconds"] / best if results else 1.0,
+            }
+        )
+        print(
+            f"{workers:>3} workers: {best:8.3f}s  speedup x{results[-1]['speedup']:.2f}"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
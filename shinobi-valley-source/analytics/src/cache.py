@@ -0,0 +1,112 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from store import TABLE_SCHEMAS
+
+# Bump whenever the parsing or the cached layout changes
+CACHE_VERSION = 3
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+class SessionCache:
+    """Per-user checkpoint of parsed sessions, so reruns only parse new or growing sessions.
+
+    Every cached user is stored under a key (e.g. the max timeseries id seen for that user);
+    a user whose current key differs from the cached one must be parsed again. The whole
+    cache is discarded when its fingerprint (parsing inputs shared by every user) changes.
+    """
+
+    def __init__(self, directory: Path, fingerprint: str):
+        self.directory = Path(directory)
+        self.fingerprint = fingerprint
+        self._entries: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, directory: Path, fingerprint: str) -> "SessionCache":
+        cache = cls(directory, fingerprint)
+        manifest_path = cache.directory / MANIFEST_FILENAME
+
+        if not manifest_path.exists():
+            return cache
+
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        if (
+            manifest.get("version") != CACHE_VERSION
+            or manifest.get("fingerprint") != fingerprint
+        ):
+            print("Analytics cache is outdated, all sessions will be parsed again")
+            return cache
+
+        cache._entries = manifest["users"]
+        return cache
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _user_path(self, user_id: int) -> Path:
+        return self.directory / "users" / f"{user_id}.npz"
+
+    def is_fresh(self, user_id: int, key: list) -> bool:
+        entry = self._entries.get(str(user_id))
+        return (
+            entry is not None
+            and entry["key"] == key
+            and self._user_path(user_id).exists()
+        )
+
+    def load_user(
+        self, user_id: int
+    ) -> Tuple[Optional[str], Dict[str, Dict[str, np.ndarray]]]:
+        """The cached session end time and per-table columns of a user."""
+        endtime = self._entries[str(user_id)]["endtime"]
+
+        tables: Dict[str, Dict[str, np.ndarray]] = {
+            table: {} for table in TABLE_SCHEMAS
+        }
+        with np.load(self._user_path(user_id), allow_pickle=False) as arrays:
+            for table, schema in TABLE_SCHEMAS.items():
+                for name, (dtype, _) in schema.items():
+                    tables[table][name] = arrays[f"{table}__{name}"].astype(dtype)
+
+        return endtime, tables
+
+    def store_user(
+        self,
+        user_id: int,
+        key: list,
+        endtime: Optional[str],
+        tables: Dict[str, Dict[str, np.ndarray]],
+    ):
+        arrays = {}
+        for table, schema in TABLE_SCHEMAS.items():
+            for name, (dtype, _) in schema.items():
+                column = tables[table][name]
+                # Strings are stored as fixed-width unicode so no pickling is needed
+                arrays[f"{table}__{name}"] = (
+                    column.astype(str) if dtype is object else column
+                )
+
+        user_path = self._user_path(user_id)
+        user_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(user_path, **arrays)
+
+        self._entries[str(user_id)] = {"key": key, "endtime": endtime}
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        manifest = {
+            "version": CACHE_VERSION,
+            "fingerprint": self.fingerprint,
+            "users": self._entries,
+        }
+        with open(
+            self.directory / MANIFEST_FILENAME, "w", encoding="utf-8"
+        ) as manifest_file:
+            json.dump(manifest, manifest_file)
@@ -0,0 +1,127 @@
+import math
+from itertools import combinations
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+# Where the bananas are placed in the game, as offsets from Banana.BASE_POSITION
+BANANA_OFFSETS: Tuple[Tuple[float, float, float], ...] = (
+    (87.01, -5.39, 43.25),
+    (50.45, 1.81, 18.4),
+    (46.93, 0.69, -90.28),
+    (102, 29, -20.21),
+    (27.65, -8.286, 79.57),
+    (-32.08, -1.49, 63.04),
+    (-20.13, -8.96, -0.81),
+    (-53.55, 34.85, 98.91),
+    (-66.786, -4.873, 23.983),
+)
+
+
+class Banana:
+
+    BASE_POSITION: tuple[float, float, float] = (-20.03064, 36.94436, -6.575068)
+
+    def __init__(self, index: int, pos: tuple[float, float, float]):
+        self.index = index
+
+        self.pos = tuple(
+            base + offset for base, offset in zip(Banana.BASE_POSITION, pos)
+        )
+
+    def __str__(self):
+        return f"Banana {self.index} at {self.pos}"
+
+    def __repr__(self):
+        return f"Banana {self.index} at {self.pos}"
+
+    def dist_squared(self, other_pos: tuple[float, float, float]) -> float:
+        dx = self.pos[0] - other_pos[0]
+        dy = self.pos[1] - other_pos[1]
+        dz = self.pos[2] - other_pos[2]
+        return dx * dx + dy * dy + dz * dz
+
+    def close(
+        self, other_pos: tuple[float, float, float], max_distance_sq: float
+    ) -> bool:
+        """Whether `other_pos` is close to the banana, the distance being bounded by its
+        square (as allowed_distance_squared returns it)."""
+        return self.dist_squared(other_pos) <= max_distance_sq
+
+
+def place_bananas(offsets: Sequence[Sequence[float]]) -> Dict[int, Banana]:
+    """Bananas at the given offsets from Banana.BASE_POSITION, numbered from 1."""
+    return {
+        index: Banana(index, tuple(offset))
+        for index, offset in enumerate(offsets, start=1)
+    }
+
+
+def allowed_distance_squared(_bananas: Dict[int, Banana]) -> float:
+    """How far (squared) from a banana a pickup is still attributed to it."""
+    # Determine the minimum allowed distance squared between any two bananas
+    distance_squared = math.inf
+    for banana1, banana2 in combinations(_bananas.values(), 2):
+        distance_squared = min(banana1.dist_squared(banana2.pos), distance_squared)
+
+    # Equivalent to halving the "normal" distance, since we are always working with squared distances
+    return distance_squared * 0.25
+
+
+class BananaIndex:
+    """KD-tree over the banana positions, to attribute many positions to bananas at once.
+
+    The tree (and scipy) is only loaded once a position is attributed.
+    """
+
+    # allowed_distance_squared is at most a quarter of the smallest squared distance between
+    # two bananas, so at most two bananas (on an exact tie) can be close to a position
+    CANDIDATES: int = 2
+
+    def __init__(self, _bananas: Dict[int, Banana]):
+        self.banana_ids = np.array(list(_bananas), dtype=np.int64)
+        self.positions = np.array(
+            [banana.pos for banana in _bananas.values()], dtype=np.float64
+        ).reshape(-1, 3)
+        self._tree = None
+        self.allowed_distance_squared = allowed_distance_squared(_bananas)
+
+    def tree(self):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+
+            self._tree = cKDTree(self.positions)
+        return self._tree
+
+    def close(self, positions: np.ndarray) -> np.ndarray:
+        """Id of the first banana (in dict order) close to each position, -1 where there is none."""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        banana_ids = np.full(len(positions), -1, dtype=np.int64)
+
+        if len(self.positions) == 0 or len(positions) == 0:
+            return banana_ids
+
+        # The tree only narrows down the candidates, closeness is decided on the exact
+        # squared distance so it matches Banana.close(position, allowed_distance_squared)
+        radius = math.sqrt(self.allowed_distance_squared) * (1 + 1e-9)
+        _, candidates = self.tree().query(
+            positions, k=self.CANDIDATES, distance_upper_bound=radius
+        )
+
+        found = candidates < len(self.positions)
+        candidates = np.where(found, candidates, 0)
+
+        deltas = self.positions[candidates] - positions[:, np.newaxis, :]
+        dist_squared = (
+            deltas[..., 0] * deltas[..., 0]
+            + deltas[..., 1] * deltas[..., 1]
+            + deltas[..., 2] * deltas[..., 2]
+        )
+        is_close = found & (dist_squared <= self.allowed_distance_squared)
+
+        # Bananas are stored in dict order, so the lowest close row is the first match
+        first_close = np.where(is_close, candidates, len(self.positions)).min(axis=1)
+        has_close = first_close < len(self.positions)
+        banana_ids[has_close] = self.banana_ids[first_close[has_close]]
+
+        return banana_ids
@@ -0,0 +1,222 @@
+"""Bootstrap confidence intervals and permutation tests of per-group ratio metrics.
+
+Every metric is a ratio of per-user sums, sum(numerators) / sum(denominators) over the
+users of a group (a mean when the denominators are ones). All the metrics are the
+columns of two (users, metrics) matrices, so a batch of resamples is reduced for every
+metric at once: each resample is turned into per-user weights (how many times a user
+was drawn, or whether it was assigned to the first group) and multiplied with both
+matrices. Resamples are drawn and reduced in chunks of a fixed size, each chunk from
+its own random stream, so memory is bounded, the chunks are spread over the workers and
+the results do not depend on the number of workers.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_CONFIDENCE = 0.95
+
+# Upper bound on the number of (resample, user) weights held by a chunk
+CHUNK_WEIGHTS = 1 << 22
+# Upper bound on the resamples of a chunk, so that even a few users give the workers
+# several chunks to share
+CHUNK_RESAMPLES = 1024
+
+
+def _ratios(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return numerators / denominators
+
+
+def _chunk_sizes(resamples: int, user_count: int) -> List[int]:
+    chunk = min(max(CHUNK_WEIGHTS // max(user_count, 1), 1), CHUNK_RESAMPLES)
+    return [min(chunk, resamples - start) for start in range(0, resamples, chunk)]
+
+
+def _reduce_in_chunks(
+    draw_weights: Callable[[np.random.Generator, int], np.ndarray],
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    resamples: int,
+    seed: np.random.SeedSequence,
+    workers: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(resamples, metrics) weighted sums of the numerators and of the denominators."""
+    sizes = _chunk_sizes(resamples, len(numerators))
+    streams = seed.spawn(len(sizes))
+    # Side by side, so a chunk is reduced with a single matrix product
+    terms = np.hstack([numerators, denominators])
+
+    def reduce_chunk(stream: np.random.SeedSequence, size: int) -> np.ndarray:
+        weights = draw_weights(np.random.default_rng(stream), size)
+        return weights.astype(np.float64, copy=False) @ terms
+
+    # NumPy releases the GIL while drawing and multiplying, threads are enough
+    if workers > 1 and len(sizes) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(reduce_chunk, streams, sizes))
+    else:
+        chunks = [reduce_chunk(stream, size) for stream, size in zip(streams, sizes)]
+
+    sums = np.concatenate(chunks)
+    return sums[:, : numerators.shape[1]], sums[:, numerators.shape[1] :]
+
+
+def bootstrap_ratios(
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    resamples: int,
+    seed: np.random.SeedSequence,
+    workers: int = 1,
+) -> np.ndarray:
+    """(resamples, metrics) ratios of bootstrap resamples of the users (the rows)."""
+    user_count = len(numerators)
+
+    def draw_weights(rng: np.random.Generator, size: int) -> np.ndarray:
+        # One row of user indices per resample, counted into per-user weights
+        indices = rng.integers(0, user_count, size=(size, user_count))
+        flat = (np.arange(size)[:, np.newaxis] * user_count + indices).ravel()
+        return np.bincount(flat, minlength=size * user_count).reshape(size, user_count)
+
+    return _ratios(
+        *_reduce_in_chunks(
+            draw_weights, numerators, denominators, resamples, seed, workers
+        )
+    )
+
+
+def permutation_differences(
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    in_first: np.ndarray,
+    resamples: int,
+    seed: np.random.SeedSequence,
+    workers: int = 1,
+) -> np.ndarray:
+    """(resamples, metrics) differences first - second group of the ratios, with the
+    users' group labels shuffled."""
+    labels = np.asarray(in_first, dtype=bool)
+
+    def draw_weights(rng: np.random.Generator, size: int) -> np.ndarray:
+        return rng.permuted(np.broadcast_to(labels, (size, len(labels))), axis=1)
+
+    first_numerators, first_denominators = _reduce_in_chunks(
+        draw_weights, numerators, denominators, resamples, seed, workers
+    )
+    return _ratios(first_numerators, first_denominators) - _ratios(
+        numerators.sum(axis=0) - first_numerators,
+        denominators.sum(axis=0) - first_denominators,
+    )
+
+
+def _json_number(value: float) -> Optional[float]:
+    # Undefined ratios (no user of a group has a denominator) are written as null
+    return float(value) if np.isfinite(value) else None
+
+
+def _interval(samples: np.ndarray, confidence: float) -> List[list]:
+    """Percentile interval of every column, ignoring the undefined resamples."""
+    tail = (1 - confidence) / 2 * 100
+    with np.errstate(all="ignore"):
+        bounds = np.full((2, samples.shape[1]), np.nan)
+        defined = ~np.all(np.isnan(samples), axis=0)
+        bounds[:, defined] = np.nanpercentile(
+            samples[:, defined], [tail, 100 - tail], axis=0
+        )
+    return [[_json_number(low), _json_number(high)] for low, high in bounds.T]
+
+
+def compare_groups(
+    metric_names: Sequence[str],
+    numerators: np.ndarray,
+    denominators: np.ndarray,
+    groups: np.ndarray,
+    compared: Tuple[str, str],
+    resamples: int,
+    seed: int = 0,
+    confidence: float = DEFAULT_CONFIDENCE,
+    workers: int = 1,
+) -> dict:
+    """Estimate, bootstrap interval and, between the two `compared` groups, difference
+    with its bootstrap interval and two-sided permutation p-value, of every metric.
+
+    `numerators` and `denominators` are (users, metrics), `groups` the users' labels.
+    """
+    numerators = np.asarray(numerators, dtype=np.float64)
+    denominators = np.asarray(denominators, dtype=np.float64)
+    first, second = compared
+
+    bootstrap_seed, permutation_seed = np.random.SeedSequence(seed).spawn(2)
+    group_names = [first, second] + sorted(
+        set(groups.tolist()) - {first, second}, key=str
+    )
+
+    estimates: Dict[str, np.ndarray] = {}
+    resampled: Dict[str, np.ndarray] = {}
+    group_seeds = dict(zip(group_names, bootstrap_seed.spawn(len(group_names))))
+    for group in group_names:
+        rows = groups == group
+        if not np.any(rows):
+            continue
+        estimates[group] = _ratios(
+            numerators[rows].sum(axis=0), denominators[rows].sum(axis=0)
+        )
+        resampled[group] = bootstrap_ratios(
+            numerators[rows],
+            denominators[rows],
+            resamples,
+            group_seeds[group],
+            workers,
+        )
+
+    intervals = {
+        group: _interval(samples, confidence) for group, samples in resampled.items()
+    }
+    metrics = {
+        name: {
+            group: {
+                "value": _json_number(estimates[group][i]),
+                "interval": intervals[group][i],
+            }
+            for group in estimates
+        }
+        for i, name in enumerate(metric_names)
+    }
+
+    if first in estimates and second in estimates:
+        compared_rows = (groups == first) | (groups == second)
+        difference = estimates[first] - estimates[second]
+        differences = permutation_differences(
+            numerators[compared_rows],
+            denominators[compared_rows],
+            groups[compared_rows] == first,
+            resamples,
+            permutation_seed,
+            workers,
+        )
+        # Shuffles at least as extreme as the observed difference, counting the
+        # observed labelling itself; undefined differences are never extreme
+        with np.errstate(invalid="ignore"):
+            extreme = np.abs(differences) >= np.abs(difference) * (1 - 1e-12)
+        p_values = (1 + extreme.sum(axis=0)) / (resamples + 1)
+        difference_intervals = _interval(
+            resampled[first] - resampled[second], confidence
+        )
+
+        for i, name in enumerate(metric_names):
+            metrics[name][f"{first}-{second}"] = {
+                "value": _json_number(difference[i]),
+                "interval": difference_intervals[i],
+                "pValue": (
+                    _json_number(p_values[i]) if np.isfinite(difference[i]) else None
+                ),
+            }
+
+    return {
+        "resamples": resamples,
+        "confidence": confidence,
+        "seed": seed,
+        "groupSizes": {group: int(np.sum(groups == group)) for group in estimates},
+        "metrics": metrics,
+    }
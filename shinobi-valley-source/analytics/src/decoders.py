@@ -0,0 +1,211 @@
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# Timestamps as written by the PHP endpoint (server local time)
+USER_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Epoch seconds of a missing or malformed timestamp, which is also what NaT converts to
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Plain floats, as written by Unity's Vector3/Quaternion ToString
+_FLOAT = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+
+# Some of the logs have a ',' instead of a '.' for floating point values
+_LOCALE_FLOAT = r"[-+]?\d+(?:[.,]\d+)?"
+
+POSLOG_PATTERN = re.compile(
+    rf"^\((?P<x>{_FLOAT}), (?P<y>{_FLOAT}), (?P<z>{_FLOAT})\)"
+    rf"_\((?P<qx>{_FLOAT}), (?P<qy>{_FLOAT}), (?P<qz>{_FLOAT}), (?P<qw>{_FLOAT})\)"
+    rf"_(?P<euler_x>{_LOCALE_FLOAT}),(?P<euler_y>{_LOCALE_FLOAT})"
+    rf"_POSDELTA:(?P<pos_delta>{_LOCALE_FLOAT})"
+    rf"_ROTDELTA:(?P<rot_delta>{_LOCALE_FLOAT})"
+    rf"_PD:(?P<path_distance>{_LOCALE_FLOAT})"
+    rf"_JMP:(?P<jumping>\d+)"
+    rf"_RUN:(?P<running>\d+)"
+)
+
+_POSITION_FIELDS = ["x", "y", "z"]
+_ROTATION_FIELDS = ["qx", "qy", "qz", "qw"]
+_LOCALE_FIELDS = ["euler_x", "euler_y", "pos_delta", "rot_delta", "path_distance"]
+_FLAG_FIELDS = ["jumping", "running"]
+
+
+@dataclass(frozen=True, slots=True)
+class PoslogBatch:
+    """Structured arrays for a column of POSLOG loglines, one row per logline."""
+
+    position: np.ndarray  # (n, 3) float64
+    rotation: np.ndarray  # (n, 4) float64, quaternion
+    rotation_euler: np.ndarray  # (n, 2) float64
+    pos_delta: np.ndarray  # (n,) float64
+    rot_delta: np.ndarray  # (n,) float64
+    path_distance: np.ndarray  # (n,) float64
+    jumping: np.ndarray  # (n,) bool
+    running: np.ndarray  # (n,) bool
+
+    # Rows that could not be decoded; their values are NaN/False and must be ignored
+    rejected: np.ndarray  # (n,) bool
+
+    def __len__(self) -> int:
+        return len(self.rejected)
+
+    def select(self, mask: np.ndarray) -> "PoslogBatch":
+        return PoslogBatch(
+            position=self.position[mask],
+            rotation=self.rotation[mask],
+            rotation_euler=self.rotation_euler[mask],
+            pos_delta=self.pos_delta[mask],
+            rot_delta=self.rot_delta[mask],
+            path_distance=self.path_distance[mask],
+            jumping=self.jumping[mask],
+            running=self.running[mask],
+            rejected=self.rejected[mask],
+        )
+
+
+def _fix_floats(column: pd.Series) -> pd.Series:
+    return column.str.replace(",", ".", regex=False)
+
+
+@dataclass(frozen=True, slots=True)
+class FeedbackBatch:
+    """Curiosity values of a column of FEEDBACK loglines, one row per logline."""
+
+    curiosity: np.ndarray  # (n,) float64
+    rejected: np.ndarray  # (n,) bool, the curiosity is NaN
+
+    def __len__(self) -> int:
+        return len(self.rejected)
+
+
+@dataclass(frozen=True, slots=True)
+class TriggerBatch:
+    """Names of the triggers of a column of TRIGGER_* loglines, one row per logline."""
+
+    name: np.ndarray  # (n,) object
+    rejected: np.ndarray  # (n,) bool, always False
+
+    def __len__(self) -> int:
+        return len(self.rejected)
+
+
+# Batch decoder of every logtype the analytics use. A decoder receives all the loglines
+# of its type in a run of logs at once (in log order) and returns a batch with one row
+# per logline and a `rejected` mask. Logs of any other type are only counted.
+LOG_DECODERS: Dict[str, Callable[[pd.Series], object]] = {}
+
+
+def register_decoder(logtype: str):
+    def register(decoder: Callable[[pd.Series], object]):
+        LOG_DECODERS[logtype] = decoder
+        return decoder
+
+    return register
+
+
+@register_decoder("POSLOG")
+def decode_poslog(loglines: pd.Series) -> PoslogBatch:
+    """Decode a whole column of POSLOG loglines at once."""
+    loglines = pd.Series(loglines, dtype=object).reset_index(drop=True)
+
+    # Rows that do not match the pattern come back as NaN in every field
+    fields = loglines.str.extract(POSLOG_PATTERN)
+    rejected = fields["x"].isna().to_numpy()
+
+    locale_fields = fields[_LOCALE_FIELDS].apply(_fix_floats)
+    flags = fields[_FLAG_FIELDS].fillna("0").to_numpy(dtype=np.int64) != 0
+
+    return PoslogBatch(
+        position=fields[_POSITION_FIELDS].to_numpy(dtype=np.float64),
+        rotation=fields[_ROTATION_FIELDS].to_numpy(dtype=np.float64),
+        rotation_euler=locale_fields[["euler_x", "euler_y"]].to_numpy(dtype=np.float64),
+        pos_delta=locale_fields["pos_delta"].to_numpy(dtype=np.float64),
+        rot_delta=locale_fields["rot_delta"].to_numpy(dtype=np.float64),
+        path_distance=locale_fields["path_distance"].to_numpy(dtype=np.float64),
+        jumping=flags[:, 0],
+        running=flags[:, 1],
+        rejected=rejected,
+    )
+
+
+@register_decoder("FEEDBACK")
+def decode_feedback(loglines: pd.Series) -> FeedbackBatch:
+    """Decode a column of FEEDBACK loglines into curiosity values."""
+    loglines = pd.Series(loglines, dtype=object).reset_index(drop=True)
+
+    values = pd.to_numeric(_fix_floats(loglines.astype(str)), errors="coerce").to_numpy(
+        dtype=np.float64
+    )
+
+    return FeedbackBatch(curiosity=values, rejected=np.isnan(values))
+
+
+@register_decoder("TRIGGER_ROI_ENTER")
+def decode_trigger(loglines: pd.Series) -> TriggerBatch:
+    names = pd.Series(loglines, dtype=object).to_numpy()
+    return TriggerBatch(name=names, rejected=np.zeros(len(names), dtype=bool))
+
+
+@dataclass(frozen=True, slots=True)
+class LogGroup:
+    """The logs of one type in a run of logs."""
+
+    rows: np.ndarray  # (n,) int64, positions in the run, ascending
+    batch: Optional[object]  # what the type's decoder returned, None if it has none
+
+
+def group_logs(logtypes: np.ndarray, loglines: pd.Series) -> Dict[str, LogGroup]:
+    """Group a run of logs by logtype in a single pass and batch-decode every group.
+
+    Every registered logtype gets a group (possibly empty), in registration order,
+    followed by the other logtypes found in the run.
+    """
+    codes, uniques = pd.factorize(
+        np.asarray(logtypes, dtype=object), use_na_sentinel=False
+    )
+    order = np.argsort(codes, kind="stable")
+    ends = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    rows_per_logtype = dict(zip(uniques.tolist(), np.split(order, ends[:-1])))
+
+    loglines = pd.Series(loglines, dtype=object).reset_index(drop=True)
+    groups = {}
+    for logtype, decoder in LOG_DECODERS.items():
+        rows = rows_per_logtype.pop(logtype, np.empty(0, dtype=np.int64))
+        groups[logtype] = LogGroup(rows=rows, batch=decoder(loglines.iloc[rows]))
+    for logtype, rows in rows_per_logtype.items():
+        groups[logtype] = LogGroup(rows=rows, batch=None)
+
+    return groups
+
+
+def decode_timestamps(timestamps) -> np.ndarray:
+    """Convert a column of timestamp strings into int64 seconds since the epoch, at once.
+
+    Missing or malformed timestamps become MISSING_TIMESTAMP.
+    """
+    return (
+        pd.to_datetime(
+            pd.Series(timestamps, dtype=object),
+            format=USER_TIMESTAMP_FORMAT,
+            errors="coerce",
+        )
+        .to_numpy(dtype="datetime64[s]")
+        .astype(np.int64)
+    )
+
+
+def format_timestamp(seconds: int) -> Optional[str]:
+    """Inverse of decode_timestamps for a single value."""
+    if seconds == MISSING_TIMESTAMP:
+        return None
+
+    return (_EPOCH + datetime.timedelta(seconds=int(seconds))).strftime(
+        USER_TIMESTAMP_FORMAT
+    )
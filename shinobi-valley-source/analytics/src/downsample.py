@@ -0,0 +1,198 @@
+"""Level-of-detail downsampling of the parsed positions, for the heatmaps and exports.
+
+Every mode keeps a subset of each user's positions (always the first one) and adds a
+`dwell` column to the positions table: the number of logged samples a kept row stands
+for. Samples are logged at a fixed interval, so this is the time spent there, and
+densities weighted by it are those of every sample.
+
+- "idle" merges the samples within `tolerance` of the previous one, a player standing
+  still, into the first of them. Heatmaps are unchanged with the default tolerance.
+- "time" keeps the first sample of every `bucket_seconds` of each session, counted
+  from its earliest position; positions without a timestamp are merged on their own.
+- "rdp" simplifies every path with Ramer-Douglas-Peucker, keeping both ends: no sample
+  is further than `tolerance` from the simplified path. The dropped samples count
+  towards the nearest kept one in log order.
+
+Downsampling an already downsampled table adds up the dwell of the merged rows.
+"""
+
+from dataclasses import replace
+from typing import Optional, Tuple
+
+import numpy as np
+
+from decoders import MISSING_TIMESTAMP
+from store import ColumnTable, SessionStore
+
+DOWNSAMPLE_MODES = ("idle", "time", "rdp")
+
+# World units. Positions are logged with 3 decimals, standing still repeats them
+DEFAULT_IDLE_TOLERANCE = 0.01
+# About a player's width, the heatmaps are binned on a 1 unit grid
+DEFAULT_RDP_TOLERANCE = 1.0
+DEFAULT_BUCKET_SECONDS = 10
+
+
+def _run_boundaries(positions: ColumnTable, changes: np.ndarray) -> np.ndarray:
+    """First rows of the runs of rows, given where each row differs from the previous."""
+    user_index = positions["user_index"]
+    starts = np.ones(len(user_index), dtype=bool)
+    starts[1:] = changes | (user_index[1:] != user_index[:-1])
+    return np.flatnonzero(starts)
+
+
+def idle_groups(
+    positions: ColumnTable, tolerance: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(kept rows, first rows of the merged groups) of the "idle" mode."""
+    xyz = positions["position"]
+    steps = np.sum(np.square(np.diff(xyz, axis=0)), axis=1)
+    boundaries = _run_boundaries(positions, steps > tolerance * tolerance)
+    return boundaries, boundaries
+
+
+def time_groups(
+    positions: ColumnTable, bucket_seconds: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(kept rows, first rows of the merged groups) of the "time" mode."""
+    if bucket_seconds <= 0:
+        raise ValueError(f"The buckets must last a positive time, got {bucket_seconds}")
+
+    # Buckets start at each user's earliest position. Positions without a timestamp
+    # are a bucket of their own, like the rows before the first bucket
+    timestamps = positions["timestamp"]
+    missing = timestamps == MISSING_TIMESTAMP
+    counts = positions.counts()
+    known = np.where(missing, np.iinfo(np.int64).max, timestamps)
+    first_timestamps = np.repeat(
+        (
+            np.minimum.reduceat(known, positions.offsets[:-1][counts > 0])
+            if len(known) > 0
+            else np.empty(0, dtype=np.int64)
+        ),
+        counts[counts > 0],
+    )
+    buckets = np.floor_divide(
+        np.where(missing, first_timestamps, timestamps) - first_timestamps,
+        bucket_seconds,
+    )
+    buckets[missing] = -1
+
+    boundaries = _run_boundaries(positions, buckets[1:] != buckets[:-1])
+    return boundaries, boundaries
+
+
+def rdp_groups(
+    positions: ColumnTable, tolerance: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(kept rows, first rows of the merged groups) of the "rdp" mode.
+
+    Every pass splits all the segments, of every user, whose furthest sample is further
+    than `tolerance` from them at that sample; there are as many passes as the depth of
+    the recursion of the usual algorithm.
+    """
+    xyz = positions["position"]
+    counts = positions.counts()
+    firsts = positions.offsets[:-1][counts > 0]
+    lasts = positions.offsets[1:][counts > 0] - 1
+
+    kept = np.zeros(len(xyz), dtype=bool)
+    kept[firsts] = True
+    kept[lasts] = True
+
+    segment_starts, segment_ends = firsts, lasts
+    while len(segment_starts) > 0:
+        lengths = segment_ends - segment_starts - 1
+        segment_starts = segment_starts[lengths > 0]
+        segment_ends = segment_ends[lengths > 0]
+        lengths = lengths[lengths > 0]
+        if len(lengths) == 0:
+            break
+
+        # The samples strictly inside every segment, one run per segment
+        run_ends = np.cumsum(lengths)
+        segment = np.repeat(np.arange(len(lengths)), lengths)
+        inside = np.arange(int(run_ends[-1])) + np.repeat(
+            segment_starts + 1 - (run_ends - lengths), lengths
+        )
+
+        # Distance to the segment (not its line, so that loops are simplified too)
+        start = xyz[segment_starts][segment]
+        chord = xyz[segment_ends][segment] - start
+        offset = xyz[inside] - start
+        chord_squared = np.sum(chord * chord, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            along = np.clip(np.sum(offset * chord, axis=1) / chord_squared, 0, 1)
+        along[chord_squared == 0] = 0
+        distances = np.sum(np.square(offset - along[:, np.newaxis] * chord), axis=1)
+
+        # The furthest sample of every segment (the first of them on ties)
+        furthest = np.lexsort((-distances, segment))[
+            np.concatenate([[0], run_ends[:-1]])
+        ]
+        split = distances[furthest] > tolerance * tolerance
+        splits = inside[furthest[split]]
+        kept[splits] = True
+
+        segment_starts, segment_ends = (
+            np.concatenate([segment_starts[split], splits]),
+            np.concatenate([splits, segment_ends[split]]),
+        )
+
+    # The samples between two kept rows count towards the nearest one; a user's first
+    # row directly follows the previous user's last one, so users are never mixed
+    rows = np.flatnonzero(kept)
+    boundaries = np.concatenate([[0], (rows[:-1] + rows[1:]) // 2 + 1])[: len(rows)]
+    return rows, boundaries.astype(np.int64)
+
+
+def downsample_positions(
+    positions: ColumnTable,
+    mode: str,
+    tolerance: Optional[float] = None,
+    bucket_seconds: float = DEFAULT_BUCKET_SECONDS,
+) -> ColumnTable:
+    """The kept rows of the positions table, with their `dwell` (see the module)."""
+    if mode == "idle":
+        rows, boundaries = idle_groups(
+            positions, DEFAULT_IDLE_TOLERANCE if tolerance is None else tolerance
+        )
+    elif mode == "time":
+        rows, boundaries = time_groups(positions, bucket_seconds)
+    elif mode == "rdp":
+        rows, boundaries = rdp_groups(
+            positions, DEFAULT_RDP_TOLERANCE if tolerance is None else tolerance
+        )
+    else:
+        raise ValueError(f"Unknown downsampling mode {mode!r}")
+
+    if "dwell" in positions.columns:
+        dwell = (
+            np.add.reduceat(positions["dwell"], boundaries)
+            if len(boundaries) > 0
+            else np.empty(0, dtype=np.int64)
+        )
+    else:
+        dwell = np.diff(np.append(boundaries, len(positions)))
+
+    columns = {name: column[rows] for name, column in positions.columns.items()}
+    columns["dwell"] = dwell.astype(np.int64)
+    return ColumnTable(
+        columns=columns,
+        offsets=np.searchsorted(rows, positions.offsets).astype(np.int64),
+    )
+
+
+def downsample_store(
+    store: SessionStore,
+    mode: str,
+    tolerance: Optional[float] = None,
+    bucket_seconds: float = DEFAULT_BUCKET_SECONDS,
+) -> SessionStore:
+    """The store with its positions downsampled, the other tables are kept as they are."""
+    return replace(
+        store,
+        positions=downsample_positions(
+            store.positions, mode, tolerance=tolerance, bucket_seconds=bucket_seconds
+        ),
+    )
@@ -0,0 +1,135 @@
+import shutil
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from store import FLAT_COLUMN_NAMES, TABLE_SCHEMAS, SessionStore
+
+EXPORT_FORMATS = ("parquet", "ipc")
+
+# Every per-session table is split in one directory per perspective (hive style,
+# e.g. positions/perspective=FIRSTPERSON/), which is how the heatmaps consume them
+EXPORT_PARTITIONING = ["perspective"]
+
+# Timestamps are logged by the server in its local time, with a 1 second resolution
+EXPORT_TIMESTAMP_TYPE = pa.timestamp("s")
+
+
+def _timestamps(column: np.ndarray) -> pa.Array:
+    # Either epoch seconds (see decoders.decode_timestamps) or timestamp strings
+    return pa.array(
+        np.asarray(column, dtype="datetime64[s]"), type=EXPORT_TIMESTAMP_TYPE
+    )
+
+
+def _strings(column: np.ndarray) -> pa.Array:
+    # Usernames, perspectives and ROI names repeat a lot, dictionary encode them
+    return pa.array(column.tolist(), type=pa.string()).dictionary_encode()
+
+
+def _column(name: str, column: np.ndarray) -> pa.Array:
+    if name in ("timestamp", "starttime", "endtime"):
+        return _timestamps(column)
+    if column.dtype == object:
+        return _strings(column)
+    return pa.array(column)
+
+
+def session_table(store: SessionStore, table: str) -> pa.Table:
+    """One of the store's per-session tables, with the user's id and perspective.
+
+    Downsampled positions also have their `dwell` (see downsample.py).
+    """
+    columns = getattr(store, table)
+    user_indices = columns["user_index"]
+
+    arrays: Dict[str, pa.Array] = {
+        "user_id": pa.array(store.user_id[user_indices].astype(np.int64)),
+        "perspective": _strings(store.perspective[user_indices]),
+    }
+    for name, column in columns.columns.items():
+        if name in ("user_index", "user_id"):
+            continue
+        if column.ndim == 2:
+            for i, flat_name in enumerate(FLAT_COLUMN_NAMES[name]):
+                arrays[flat_name] = pa.array(column[:, i])
+        else:
+            arrays[name] = _column(name, column)
+
+    return pa.table(arrays)
+
+
+def users_table(store: SessionStore) -> pa.Table:
+    return pa.table(
+        {
+            "user_id": pa.array(store.user_id.astype(np.int64)),
+            "user": _strings(store.user),
+            "perspective": _strings(store.perspective),
+            "starttime": _timestamps(store.starttime),
+            "endtime": _timestamps(store.endtime),
+        }
+    )
+
+
+def user_stats_table(user_stats: Sequence) -> pa.Table:
+    """The rows of user_stats.csv, with typed session times and banana pickups as a list."""
+    table = pa.Table.from_pylist([asdict(stat) for stat in user_stats])
+    if table.num_rows == 0:
+        return table
+
+    columns = {
+        "session_starttime": _timestamps(table["session_starttime"].to_numpy()),
+        "session_endtime": _timestamps(table["session_endtime"].to_numpy()),
+        "banana_pickups": table["banana_pickups"].cast(pa.list_(pa.int64())),
+    }
+    for name, column in columns.items():
+        table = table.set_column(table.schema.get_field_index(name), name, column)
+
+    return table
+
+
+def export_sessions(
+    store: SessionStore,
+    user_stats: Sequence,
+    output_directory: Path = Path("data", "export"),
+    file_format: str = "parquet",
+):
+    """Write the parsed sessions as a directory of Parquet or Arrow IPC datasets.
+
+    `positions`, `banana_pickups`, `roi_visits` and `curiosity` are partitioned by
+    perspective; `users` and `user_stats` are single files. Any previous export in
+    `output_directory` is replaced. IPC files can be memory-mapped, e.g. with
+    `pyarrow.dataset.dataset(path, format="ipc", partitioning="hive")`.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {file_format}")
+
+    output_directory = Path(output_directory)
+    if output_directory.exists():
+        shutil.rmtree(output_directory)
+    output_directory.mkdir(parents=True)
+
+    for table in TABLE_SCHEMAS:
+        ds.write_dataset(
+            session_table(store, table),
+            output_directory / table,
+            format=file_format,
+            partitioning=EXPORT_PARTITIONING,
+            partitioning_flavor="hive",
+            basename_template=f"part-{{i}}.{file_format}",
+        )
+
+    for name, table in (
+        ("users", users_table(store)),
+        ("user_stats", user_stats_table(user_stats)),
+    ):
+        ds.write_dataset(
+            table,
+            output_directory / name,
+            format=file_format,
+            basename_template=f"part-{{i}}.{file_format}",
+        )
@@ -0,0 +1,329 @@
+"""Import a MariaDB SQL dump (or CSV export) of the game's tables into an analytics SQLite database.
+
+Usage: python src/importer.py dump.sql[.gz] analytics.db
+       python src/importer.py csv_export_dir/ analytics.db
+
+The dump is streamed statement by statement and its rows are inserted in batches inside
+a single transaction, into a new file that replaces the destination once complete.
+The tables have the column types of server-assets/schema.sql (timeseries.userdata_id is
+TEXT); timestamps keep the analytics' text format (MariaDB's millisecond part is dropped,
+the analytics work at a one second resolution).
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateTable
+
+from migrate import create_indexes
+from models import Timeseries, Userdata
+
+# Rows inserted per executemany call
+IMPORT_BATCH_SIZE = 50_000
+
+# Imported tables, in the order they must be created
+IMPORT_TABLES = (Userdata.__table__, Timeseries.__table__)
+
+# A quoted string, matched as runs of plain characters between escapes
+_STRING = r"'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'"
+# A row of an INSERT's VALUES list, followed by "," or by the ";" ending the statement
+_ROW = re.compile(rf"\s*\(((?:[^'()]+|{_STRING})*)\)\s*([,;])", re.DOTALL)
+# A value of a row: a quoted string (with its quotes), NULL or a number
+_VALUE = re.compile(rf"({_STRING})|(NULL)|([-+.\deE]+)", re.DOTALL)
+_INSERT = re.compile(
+    r"INSERT\s+(?:IGNORE\s+)?INTO\s+`?(\w+)`?\s*(?:\(([^)]*)\))?\s*VALUES\s*",
+    re.IGNORECASE,
+)
+_CREATE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?", re.I)
+_COLUMN = re.compile(r"^\s*`(\w+)`")
+
+# MySQL string escapes, see https://mariadb.com/kb/en/string-literals/
+_ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+_ESCAPE = re.compile(r"\\(.)|''", re.DOTALL)
+
+# Values MariaDB writes for NULL in a CSV export
+CSV_NULLS = ("\\N", "NULL")
+
+
+def _unescape(value: str) -> str:
+    if "\\" not in value and "''" not in value:
+        return value
+    return _ESCAPE.sub(
+        lambda match: (
+            "'"
+            if match.group(1) is None
+            else _ESCAPES.get(match.group(1), match.group(1))
+        ),
+        value,
+    )
+
+
+def parse_values(statement: str, position: int) -> List[tuple]:
+    """The row tuples of an INSERT's VALUES list, starting at `position`.
+
+    Strings are unescaped, NULL becomes None and numbers are kept as their text.
+    Raises ValueError when the statement is malformed or does not end (with ";") yet.
+    """
+    rows = []
+    while True:
+        match = _ROW.match(statement, position)
+        if match is None:
+            raise ValueError(f"Malformed or truncated INSERT at offset {position}")
+        position = match.end()
+
+        rows.append(
+            tuple(
+                _unescape(string[1:-1]) if string else (None if null else number)
+                for string, null, number in _VALUE.findall(match.group(1))
+            )
+        )
+        if match.group(2) == ";":
+            return rows
+
+
+def read_sql_dump(path: Path) -> Iterator[Tuple[str, Sequence[str], List[tuple]]]:
+    """(table, column names, rows) of every INSERT of a mysqldump/phpMyAdmin dump."""
+    table_columns: Dict[str, List[str]] = {}
+
+    opener = gzip.open if Path(path).suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", newline="") as dump:
+        # Only CREATE TABLE and INSERT statements matter, they are read a line at a time
+        lines: List[str] = []
+        for line in dump:
+            if not lines and not line.lstrip().upper().startswith(
+                ("INSERT", "CREATE TABLE")
+            ):
+                continue
+
+            lines.append(line)
+            if not line.rstrip().endswith(";"):
+                continue
+            statement = "".join(lines).lstrip()
+
+            create = _CREATE.match(statement)
+            if create is not None:
+                # Column definitions are on their own lines, starting with `name`
+                table_columns[create.group(1)] = [
+                    match.group(1)
+                    for match in map(_COLUMN.match, statement.splitlines()[1:])
+                    if match is not None
+                ]
+                lines = []
+                continue
+
+            insert = _INSERT.match(statement)
+            if insert is None:
+                raise ValueError(f"{path}: cannot parse {statement[:80]!r}")
+            try:
+                rows = parse_values(statement, insert.end())
+            except ValueError:
+                # A string value can end a line with ";" too, the statement goes on
+                continue
+            lines = []
+
+            table, columns = insert.group(1), insert.group(2)
+            if columns is not None:
+                columns = [column.strip(" `\n") for column in columns.split(",")]
+            elif table in table_columns:
+                columns = table_columns[table]
+            else:
+                raise ValueError(f"{path}: INSERT into {table} without its columns")
+
+            if any(len(row) != len(columns) for row in rows):
+                raise ValueError(f"{path}: INSERT into {table} with malformed rows")
+
+            yield table, columns, rows
+
+        if lines:
+            raise ValueError(f"{path}: truncated statement at the end of the dump")
+
+
+def read_csv_export(
+    directory: Path, batch_size: int = IMPORT_BATCH_SIZE
+) -> Iterator[Tuple[str, Sequence[str], List[tuple]]]:
+    """(table, column names, rows) batches of <table>.csv files with a header row."""
+    for table in IMPORT_TABLES:
+        path = Path(directory) / f"{table.name}.csv"
+        if not path.exists():
+            continue
+
+        with open(path, newline="", encoding="utf-8") as csv_file:
+            reader = csv.reader(csv_file)
+            columns = next(reader)
+            rows = []
+            for row in reader:
+                rows.append(
+                    tuple(None if value in CSV_NULLS else value for value in row)
+                )
+                if len(rows) == batch_size:
+                    yield table.name, columns, rows
+                    rows = []
+            if rows:
+                yield table.name, columns, rows
+
+
+def _timestamp(value) -> Optional[str]:
+    # "2019-10-13 12:34:56.789" to the analytics' "%Y-%m-%d %H:%M:%S"
+    return None if value is None else str(value)[:19]
+
+
+def _integer(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value)
+
+
+# How each analytics column is filled from a row of the dump, by dump column name.
+# The production MariaDB schema has no perspective or params columns, but a direction
+# (which the params of newer sessions embed)
+COLUMN_CONVERTERS: Dict[str, Dict[str, Tuple[Sequence[str], Callable]]] = {
+    "userdata": {
+        "id": (("id",), _integer),
+        "user": (("user",), _text),
+        "perspective": (("perspective",), _text),
+        "ipaddr": (("ipaddr",), _text),
+        "starttime": (("starttime",), lambda value: _text(_timestamp(value))),
+        "endtime": (("endtime",), _timestamp),
+        "params": (("params", "direction"), _text),
+    },
+    "timeseries": {
+        "id": (("id",), _integer),
+        "userdata_id": (("userdata_id",), _integer),
+        "timestamp": (("timestamp",), lambda value: _text(_timestamp(value))),
+        "logtype": (("logtype",), _text),
+        "logline": (("logline",), _text),
+    },
+}
+
+
+def row_converter(table: str, columns: Sequence[str]) -> Callable[[tuple], tuple]:
+    """Turns a dump row (in `columns` order) into an analytics row of `table`."""
+    positions = {column: i for i, column in enumerate(columns)}
+
+    converters = []
+    for names, convert in COLUMN_CONVERTERS[table].values():
+        position = next((positions[name] for name in names if name in positions), None)
+        converters.append((position, convert))
+
+    def convert_row(row: tuple) -> tuple:
+        return tuple(
+            convert(row[position] if position is not None else None)
+            for position, convert in converters
+        )
+
+    return convert_row
+
+
+def import_rows(
+    batches: Iterator[Tuple[str, Sequence[str], List[tuple]]],
+    db_path: Path,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Load the rows into a new SQLite database at `db_path`, replacing any existing one.
+
+    Returns the number of rows imported per table.
+    """
+    db_path = Path(db_path)
+    partial_path = db_path.with_name(f"{db_path.name}.partial")
+    partial_path.unlink(missing_ok=True)
+
+    counts = {table.name: 0 for table in IMPORT_TABLES}
+    connection = sqlite3.connect(partial_path, isolation_level=None)
+    try:
+        # Nothing is worth syncing until the whole import is done, the file is only
+        # renamed into place once complete
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=OFF")
+
+        connection.execute("BEGIN")
+        # Tables only: the indexes are built once, after the rows are in
+        for table in IMPORT_TABLES:
+            connection.execute(
+                str(CreateTable(table).compile(dialect=sqlite.dialect()))
+            )
+
+        inserts = {
+            table: f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+            for table, columns in COLUMN_CONVERTERS.items()
+        }
+        row_converters: Dict[Tuple[str, tuple], Callable] = {}
+        for table, columns, rows in batches:
+            if table not in counts:
+                continue
+
+            key = (table, tuple(columns))
+            if key not in row_converters:
+                row_converters[key] = row_converter(table, columns)
+            convert_row = row_converters[key]
+
+            for start in range(0, len(rows), batch_size):
+                connection.executemany(
+                    inserts[table], map(convert_row, rows[start : start + batch_size])
+                )
+            counts[table] += len(rows)
+
+        connection.execute("COMMIT")
+        connection.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        connection.close()
+
+    create_indexes(create_engine(f"sqlite:///{partial_path.resolve()}", echo=False))
+    os.replace(partial_path, db_path)
+
+    return counts
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "source",
+        type=Path,
+        help="MariaDB SQL dump (.sql or .sql.gz), or a directory of <table>.csv files",
+    )
+    parser.add_argument(
+        "db",
+        type=Path,
+        help="SQLite database to create, replaced once the import is complete",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=IMPORT_BATCH_SIZE,
+        help="number of rows per executemany call",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = parse_args(argv)
+
+    if not args.source.exists():
+        raise SystemExit(f"No dump at {args.source}")
+
+    start = time.perf_counter()
+    if args.source.is_dir():
+        batches = read_csv_export(args.source, args.batch_size)
+    else:
+        batches = read_sql_dump(args.source)
+    counts = import_rows(batches, args.db, args.batch_size)
+
+    print(
+        f"Imported {counts['userdata']} sessions and {counts['timeseries']} logs "
+        f"into {args.db} in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
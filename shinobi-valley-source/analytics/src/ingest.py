@@ -0,0 +1,475 @@
+"""Receive the game's telemetry and group-commit it into the analytics database.
+
+Usage: python src/ingest.py [--db ../server-assets/db.db] [--port 8766] [--flush-rows 5000] [--flush-interval 0.05]
+
+A local stand-in for the PHP endpoint (server-assets/index.php): the game posts to
+/session/postnew, /timeseries/post and /session/postend with the same payloads, and
+gets the same replies. Timeseries rows can also be posted as NDJSON (Content-Type
+application/x-ndjson), one {userdata_id, timestamp, logtype, logline} row per line.
+The request key is not checked.
+
+Posted rows are buffered and written by a single connection, with one executemany per
+flush in its own transaction (WAL mode), once --flush-rows rows are waiting or the
+oldest of them has waited --flush-interval seconds. A post is answered once its rows
+are committed. GET /stats returns the ingest counters.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine
+
+from models import Base, Timeseries, Userdata
+from process import DEFAULT_DB_PATH
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+
+# A flush is started as soon as this many rows are waiting...
+DEFAULT_FLUSH_ROWS = 5000
+# ... or once the oldest waiting row has waited this long
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.05
+
+# Largest request body accepted, a POSLOG row is about 150 bytes
+MAX_BODY_BYTES = 16 * 2**20
+
+# Timestamps are posted as epoch seconds, and stored like the PHP endpoint stores them
+TIMESERIES_INSERT = (
+    "INSERT INTO timeseries (userdata_id, timestamp, logtype, logline) "
+    "VALUES (?, datetime(?, 'unixepoch'), ?, ?)"
+)
+USERDATA_INSERT = (
+    "INSERT INTO userdata (user, perspective, ipaddr, starttime, endtime, params) "
+    "VALUES (?, ?, ?, datetime(?, 'unixepoch'), NULL, ?)"
+)
+USERDATA_END = "UPDATE userdata SET endtime=datetime(?, 'unixepoch') WHERE id=?"
+
+# Replies of the PHP endpoint, which the game logs
+REPLY_POSTED = "SERVER: Timeseries Posted"
+REPLY_SESSION_END = "SERVER: Session End Posted"
+REPLY_NO_USER = "SERVER: ERROR -- No User Found"
+REPLY_MISMATCH = "SERVER: ERROR -- Username Mismatch"
+
+
+class IngestError(ValueError):
+    """A malformed request, answered with 400 Bad Request."""
+
+
+def _timeseries_row(row: dict) -> tuple:
+    try:
+        return (
+            int(row["userdata_id"]),
+            str(row["timestamp"]),
+            str(row["logtype"]),
+            str(row["logline"]),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise IngestError(f"Malformed timeseries row {row!r}") from e
+
+
+def parse_timeseries(body: bytes, ndjson: bool) -> Tuple[Optional[dict], List[tuple]]:
+    """(session fields, rows) of a timeseries post.
+
+    The game posts {"id", "user", "postdata": [rows]}; NDJSON posts only have rows.
+    """
+    try:
+        if ndjson:
+            return None, [
+                _timeseries_row(json.loads(line))
+                for line in body.splitlines()
+                if line.strip()
+            ]
+
+        payload = json.loads(body)
+        return payload, [_timeseries_row(row) for row in payload["postdata"]]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise IngestError("Malformed timeseries post") from e
+
+
+class TelemetryWriter:
+    """Group-commits the posted rows from a single SQLite connection.
+
+    The connection lives in a thread of its own, so the event loop keeps accepting
+    posts while a flush is written; they are committed by the next flush.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        flush_rows: int = DEFAULT_FLUSH_ROWS,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.db_path = Path(db_path)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pending: List[tuple] = []
+        self._waiters: List[asyncio.Future] = []
+        self._oldest_pending: Optional[float] = None
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closed = False
+
+        # Usernames of the known sessions, to check posts like the PHP endpoint does
+        self.users: Dict[int, str] = {}
+
+        self.rows_committed = 0
+        self.posts_committed = 0
+        self.flushes = 0
+        self.largest_flush = 0
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    def _connect(self):
+        # The tables of models.py (typed like server-assets/schema.sql), created if
+        # this is a new database
+        Base.metadata.create_all(
+            create_engine(f"sqlite:///{self.db_path.resolve()}", echo=False),
+            tables=[Userdata.__table__, Timeseries.__table__],
+        )
+
+        self._connection = sqlite3.connect(self.db_path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A commit is durable once in the WAL, the WAL is synced at checkpoints
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self.users = dict(self._connection.execute("SELECT id, user FROM userdata"))
+
+    async def start(self):
+        await self._run(self._connect)
+
+    def _write(self, rows: List[tuple]):
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(TIMESERIES_INSERT, rows)
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def add(self, rows: List[tuple]) -> asyncio.Future:
+        """Buffer the rows, the future is done once they are committed."""
+        if self._closed:
+            raise RuntimeError("The writer is closed")
+
+        waiter = asyncio.get_running_loop().create_future()
+        if self._oldest_pending is None:
+            self._oldest_pending = time.monotonic()
+        self._pending.extend(rows)
+        self._waiters.append(waiter)
+
+        self._arrived.set()
+        if len(self._pending) >= self.flush_rows:
+            self._full.set()
+        return waiter
+
+    async def _flush(self):
+        rows, waiters = self._pending, self._waiters
+        self._pending, self._waiters, self._oldest_pending = [], [], None
+        self._full.clear()
+
+        try:
+            await self._run(self._write, rows)
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self.rows_committed += len(rows)
+        self.posts_committed += len(waiters)
+        self.flushes += 1
+        self.largest_flush = max(self.largest_flush, len(rows))
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(len(rows))
+
+    async def run(self):
+        """Flush whenever the size or the time threshold is reached."""
+        while True:
+            if not self._waiters:
+                self._arrived.clear()
+                await self._arrived.wait()
+                continue
+
+            deadline = self._oldest_pending + self.flush_interval
+            if len(self._pending) < self.flush_rows:
+                await self._wait_full(deadline - time.monotonic())
+            await self._flush()
+
+    async def _wait_full(self, timeout: float):
+        if timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._full.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self):
+        """Commit what is still buffered, and close the connection."""
+        self._closed = True
+        if self._waiters:
+            await self._flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+        self._executor.shutdown()
+
+    async def username(self, user_id: int) -> Optional[str]:
+        if user_id not in self.users:
+            # The session may have been created by another endpoint
+            row = await self._run(
+                lambda: self._connection.execute(
+                    "SELECT user FROM userdata WHERE id=?", (user_id,)
+                ).fetchone()
+            )
+            if row is None:
+                return None
+            self.users[user_id] = row[0]
+        return self.users[user_id]
+
+    async def new_session(
+        self, user: str, perspective: str, ipaddr: str, timestamp: str, params: str
+    ) -> int:
+        user_id = await self._run(
+            lambda: self._connection.execute(
+                USERDATA_INSERT, (user, perspective, ipaddr, timestamp, params)
+            ).lastrowid
+        )
+        self.users[user_id] = user
+        return user_id
+
+    async def end_session(self, user_id: int, timestamp: str):
+        await self._run(self._connection.execute, USERDATA_END, (timestamp, user_id))
+
+    def as_json(self) -> bytes:
+        return json.dumps(
+            {
+                "rowsCommitted": self.rows_committed,
+                "postsCommitted": self.posts_committed,
+                "flushes": self.flushes,
+                "largestFlush": self.largest_flush,
+                "rowsPending": len(self._pending),
+            },
+            indent=4,
+        ).encode("utf-8")
+
+
+def _session_username(ipaddr: str) -> str:
+    # Same as the PHP endpoint: CRC32 of the hex IP address and the current time
+    octets = ipaddr.split(".")
+    if len(octets) == 4 and all(octet.isdigit() for octet in octets):
+        ipaddr = "".join(f"{int(octet):02x}" for octet in octets)
+    return f"{zlib.crc32(f'{ipaddr}{int(time.time())}'.encode('utf-8')):X}"
+
+
+async def _post_new_session(writer: TelemetryWriter, payload: dict, ipaddr: str):
+    # The conditions the PHP endpoint assigns to every session
+    style, patterns, direction = "NINJA", True, "A2B"
+    context = random.randint(1, 100) > 55
+    params = (
+        f"{style}_PAT:{str(patterns).lower()}_{direction}_TXT:{str(context).lower()}_"
+        f"{payload['parameters']}"
+    )
+
+    user = _session_username(ipaddr)
+    user_id = await writer.new_session(
+        user, payload["perspective"], ipaddr, str(payload["timestamp"]), params
+    )
+    return json.dumps(
+        {
+            "id": user_id,
+            "user": user,
+            "style": style,
+            "patterns": patterns,
+            "direction": direction,
+            "context": context,
+        }
+    )
+
+
+async def _post_timeseries(writer: TelemetryWriter, body: bytes, ndjson: bool) -> str:
+    session, rows = parse_timeseries(body, ndjson)
+
+    if session is not None:
+        username = await writer.username(int(session["id"]))
+        if username is None:
+            return REPLY_NO_USER
+        if username != session["user"]:
+            return REPLY_MISMATCH
+
+    for user_id in {row[0] for row in rows}:
+        if await writer.username(user_id) is None:
+            return REPLY_NO_USER
+
+    if rows:
+        await writer.add(rows)
+    return REPLY_POSTED
+
+
+async def _post_session_end(writer: TelemetryWriter, payload: dict) -> str:
+    user_id = int(payload["id"])
+    if await writer.username(user_id) != payload["user"]:
+        return REPLY_MISMATCH
+
+    await writer.end_session(user_id, str(payload["timestamp"]))
+    return REPLY_SESSION_END
+
+
+async def _respond(
+    writer: TelemetryWriter,
+    method: str,
+    path: str,
+    headers: Dict[str, str],
+    body: bytes,
+    ipaddr: str,
+) -> Tuple[str, str, bytes]:
+    """(status, content type, body) of a request."""
+    path = path.split("?", 1)[0]
+    if method == "OPTIONS":
+        return "204 No Content", "text/plain", b""
+    if method == "GET" and path in ("/", "/stats"):
+        return "200 OK", "application/json", writer.as_json()
+    if method != "POST":
+        return "404 Not Found", "application/json", b'{"error": "not found"}'
+
+    try:
+        if path == "/timeseries/post":
+            ndjson = "ndjson" in headers.get("content-type", "")
+            reply = await _post_timeseries(writer, body, ndjson)
+        elif path == "/session/postnew":
+            reply = await _post_new_session(writer, json.loads(body), ipaddr)
+        elif path == "/session/postend":
+            reply = await _post_session_end(writer, json.loads(body))
+        else:
+            # The PHP endpoint's "invalid class or method"
+            reply = "-1"
+    except (IngestError, json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        return "400 Bad Request", "text/plain", str(e).encode("utf-8")
+
+    return "200 OK", "text/plain", reply.encode("utf-8")
+
+
+async def _handle_connection(
+    telemetry: TelemetryWriter,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+):
+    ipaddr = (writer.get_extra_info("peername") or ("",))[0]
+    try:
+        # Connections are kept alive, the game and the load generator post repeatedly
+        while True:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) < 2:
+                break
+            method, path = request_line[0], request_line[1]
+
+            headers: Dict[str, str] = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                status, content_type, body = (
+                    "413 Payload Too Large",
+                    "text/plain",
+                    b"too large",
+                )
+                headers["connection"] = "close"
+            else:
+                status, content_type, body = await _respond(
+                    telemetry,
+                    method,
+                    path,
+                    headers,
+                    await reader.readexactly(length),
+                    ipaddr,
+                )
+
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Access-Control-Allow-Methods: GET, POST\r\n"
+                "Access-Control-Allow-Headers: Content-Type, "
+                "Access-Control-Allow-Headers, X-Requested-With\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode(
+                    "latin-1"
+                )
+                + body
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(telemetry: TelemetryWriter, host: str, port: int):
+    await telemetry.start()
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_connection(telemetry, reader, writer),
+        host,
+        port,
+    )
+    print(f"Ingesting telemetry on http://{host}:{port} into {telemetry.db_path}")
+
+    flusher = asyncio.create_task(telemetry.run())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        flusher.cancel()
+        await telemetry.close()
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--flush-rows",
+        type=int,
+        default=DEFAULT_FLUSH_ROWS,
+        help="commit as soon as this many rows are waiting",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=DEFAULT_FLUSH_INTERVAL_SECONDS,
+        help="seconds the oldest waiting row may wait for its commit",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = parse_args(argv)
+
+    telemetry = TelemetryWriter(
+        args.db, flush_rows=args.flush_rows, flush_interval=args.flush_interval
+    )
+    try:
+        asyncio.run(serve(telemetry, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import cProfile
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Number of allocation sites kept in a tracemalloc dump
+TRACEMALLOC_TOP = 25
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux (and bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mib() -> Optional[float]:
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+
+class PipelineReport:
+    """Timings, row counters and memory snapshots of a pipeline run.
+
+    A disabled report keeps the same interface but records nothing, so the pipeline
+    can be instrumented unconditionally.
+    """
+
+    def __init__(self, enabled: bool = True, verbose: bool = False):
+        self.enabled = enabled
+        self.verbose = verbose
+        self.stages: List[dict] = []
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(
+        self,
+        name: str,
+        profile_path: Optional[Path] = None,
+        tracemalloc_path: Optional[Path] = None,
+    ):
+        """Time a stage; optionally dump a cProfile and/or a tracemalloc snapshot of it."""
+        if not self.enabled:
+            yield
+            return
+
+        profiler = cProfile.Profile() if profile_path is not None else None
+        tracing = tracemalloc_path is not None and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+
+            record = {
+                "name": name,
+                "seconds": seconds,
+                "rss_mib": current_rss_mib(),
+                "peak_rss_mib": peak_rss_mib(),
+            }
+
+            if tracing:
+                traced_current, traced_peak = tracemalloc.get_traced_memory()
+                record["traced_mib"] = traced_current / (1024 * 1024)
+                record["traced_peak_mib"] = traced_peak / (1024 * 1024)
+                self._dump_tracemalloc(tracemalloc_path)
+                tracemalloc.stop()
+
+            self.stages.append(record)
+            if self.verbose:
+                print(
+                    f"{name:>24}: {seconds:8.3f}s  peak RSS {record['peak_rss_mib']:8.1f} MiB"
+                )
+
+    @staticmethod
+    def _dump_tracemalloc(path: Path):
+        statistics = tracemalloc.take_snapshot().statistics("lineno")
+        with open(path, "w", encoding="utf-8") as dump:
+            for statistic in statistics[:TRACEMALLOC_TOP]:
+                dump.write(f"{statistic}\n")
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def count_all(self, prefix: str, values: Dict[str, int]):
+        for name, value in values.items():
+            self.count(f"{prefix}.{name}", value)
+
+    def total_seconds(self) -> float:
+        return sum(stage["seconds"] for stage in self.stages)
+
+    def as_dict(self) -> dict:
+        return {
+            "stages": self.stages,
+            "total_seconds": self.total_seconds(),
+            "counters": self.counters,
+        }
+
+    def write(self, path: Path):
+        if not self.enabled:
+            return
+
+        with open(path, "w", encoding="utf-8") as report:
+            json.dump(self.as_dict(), report, indent=4)
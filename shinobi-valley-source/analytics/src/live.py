@@ -0,0 +1,457 @@
+"""Serve the global stats of a running study over HTTP, updated as new logs arrive.
+
+Usage: python src/live.py [--study studies/survey.toml] [--port 8765] [--interval 5] [--all-users]
+
+The timeseries table is polled for rows above a high-water mark, so every row is read
+(and parsed) exactly once, and only folded into running totals. GET /stats returns the
+current global stats as JSON.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Engine, create_engine, func, select
+from sqlalchemy.orm import Session
+
+from decoders import MISSING_TIMESTAMP, decode_timestamps
+from models import Timeseries, Userdata
+from process import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_DB_PATH,
+    parse_timeseries,
+    resolve_endtime,
+)
+from store import SessionStoreBuilder
+from study import DEFAULT_STUDY_PATH, Study, load_study
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_POLL_INTERVAL_SECONDS = 5.0
+
+
+@dataclass(slots=True)
+class LiveSession:
+    """What is kept of a user's session between polls: where its parsing stopped and
+    what it adds to the global stats."""
+
+    user: Userdata
+    last_position: Optional[np.ndarray] = None
+    last_log_timestamp: Optional[str] = None
+
+    banana_pickups: Counter = field(default_factory=Counter)
+    roi_names: Dict[str, None] = field(default_factory=dict)  # in first-visit order
+    # Exact, so that the published means are those of math.fsum
+    curiosity_sum: Fraction = Fraction(0)
+    curiosity_count: int = 0
+
+    # Play time in seconds (with the hours removed), and whether the session is long
+    # enough to be counted in the totals
+    duration: int = 0
+    included: bool = False
+
+
+class LiveStats:
+    """Global stats kept up to date from the rows added since the last poll.
+
+    Each poll only reads userdata and timeseries rows above the high-water marks, and
+    parses the new logs of every session where its previous run stopped. Only the
+    sessions that changed update the running totals (their previous contribution is
+    taken out and the new one added), and publishing divides the totals.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        study: Study,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.engine = engine
+        self.study = study
+        self.chunk_size = chunk_size
+
+        self.sessions: Dict[int, LiveSession] = {}
+        self.user_high_water_mark = 0
+        self.high_water_mark = 0
+        self.rows_processed = 0
+
+        # Running totals over the included sessions, keyed like the global stats
+        self.perspective_counts = Counter()
+        self.banana_pickup_counts: Dict[int, Counter] = {}
+        self.roi_visit_counts: Dict[str, Counter] = {}
+        # Only the first visit of an ROI by a username counts, even across sessions: the
+        # included sessions that visited it, the lowest id is the counted one
+        self.roi_visitors: Dict[Tuple[str, str], Dict[int, str]] = {}
+        self.curiosity_sums: Dict[str, Fraction] = {}
+        self.curiosity_counts = Counter()
+        self.duration_total = 0
+        self.pickup_total = 0
+
+        self.global_stats: dict = {"playerCount": 0}
+        self.updated: Optional[str] = None
+
+    def poll(self) -> int:
+        """Read and parse everything added since the previous poll; returns the row count."""
+        with Session(self.engine, expire_on_commit=False) as session:
+            # Sessions are created before their first log, so once the bound is taken
+            # every row up to it belongs to a user the next query can see
+            bound = session.execute(
+                select(func.coalesce(func.max(Timeseries.id), 0))
+            ).scalar_one()
+            self._poll_users(session)
+            rows = self._poll_timeseries(session, bound)
+
+        if rows > 0 or self.updated is None:
+            self.publish()
+
+        return rows
+
+    def _poll_users(self, session: Session):
+        user_bound = session.execute(
+            select(func.coalesce(func.max(Userdata.id), 0))
+        ).scalar_one()
+        users_query = self.study.users_query().where(
+            Userdata.id > self.user_high_water_mark, Userdata.id <= user_bound
+        )
+
+        for _user in session.execute(users_query).scalars():
+            self.sessions[_user.id] = LiveSession(_user)
+            self._update(self.sessions[_user.id])
+        self.user_high_water_mark = user_bound
+
+        # End times are recorded when a session finishes, only open sessions are checked
+        open_sessions = [
+            _user_id
+            for _user_id, live_session in self.sessions.items()
+            if live_session.user.endtime is None
+        ]
+        if open_sessions:
+            for _user_id, endtime in session.execute(
+                select(Userdata.id, Userdata.endtime).where(
+                    Userdata.id.in_(open_sessions), Userdata.endtime.is_not(None)
+                )
+            ):
+                self.sessions[_user_id].user.endtime = endtime
+                self._update(self.sessions[_user_id])
+
+    def _poll_timeseries(self, session: Session, bound: int) -> int:
+        rows = 0
+        while True:
+            chunk = session.execute(
+                select(
+                    Timeseries.id,
+                    Timeseries.userdata_id,
+                    Timeseries.timestamp,
+                    Timeseries.logtype,
+                    Timeseries.logline,
+                )
+                .where(Timeseries.id > self.high_water_mark, Timeseries.id <= bound)
+                .order_by(Timeseries.id)
+                .limit(self.chunk_size)
+            ).all()
+            if len(chunk) == 0:
+                return rows
+
+            ids, userdata_ids, log_timestamps, logtypes, loglines = (
+                np.array(column, dtype=object) for column in zip(*chunk)
+            )
+            self._parse_chunk(
+                userdata_ids.astype(np.int64), log_timestamps, logtypes, loglines
+            )
+
+            self.high_water_mark = int(ids[-1])
+            rows += len(chunk)
+            self.rows_processed += len(chunk)
+
+    def _parse_chunk(
+        self,
+        userdata_ids: np.ndarray,
+        log_timestamps: np.ndarray,
+        logtypes: np.ndarray,
+        loglines: np.ndarray,
+    ):
+        timestamps = decode_timestamps(log_timestamps)
+
+        # Every session's new rows are parsed in one run, in arrival (id) order
+        for _user_id in pd.unique(userdata_ids).tolist():
+            live_session = self.sessions.get(_user_id)
+            if live_session is None:
+                continue
+
+            rows = np.flatnonzero(userdata_ids == _user_id)
+            builder = SessionStoreBuilder()
+            user_index = builder.add_user(
+                _user_id, live_session.user.user, "", "", None
+            )
+            live_session.last_position = parse_timeseries(
+                builder,
+                user_index,
+                live_session.user.user,
+                timestamps[rows],
+                logtypes[rows],
+                pd.Series(loglines[rows], dtype=object),
+                live_session.last_position,
+                banana_index=self.study.banana_index,
+            )
+            live_session.last_log_timestamp = log_timestamps[rows[-1]]
+
+            self._update(live_session, builder.build().user_tables(user_index))
+
+    def _update(
+        self,
+        live_session: LiveSession,
+        parsed: Optional[Dict[str, Dict[str, np.ndarray]]] = None,
+    ):
+        """Fold a session's newly parsed events into it, and its new play time (it
+        grows with the logs and is fixed by the end time) into the totals."""
+        if live_session.included:
+            self._contribute(live_session, -1)
+
+        if parsed is not None:
+            live_session.banana_pickups.update(
+                parsed["banana_pickups"]["banana_id"].tolist()
+            )
+            live_session.roi_names.update(
+                dict.fromkeys(parsed["roi_visits"]["roi_name"].tolist())
+            )
+            curiosities = parsed["curiosity"]["curiosity"].tolist()
+            live_session.curiosity_sum += sum(map(Fraction, curiosities), Fraction(0))
+            live_session.curiosity_count += len(curiosities)
+
+        _user = live_session.user
+        starttime, endtime = decode_timestamps(
+            [
+                _user.starttime,
+                resolve_endtime(
+                    _user, self.study.endtime_overrides, live_session.last_log_timestamp
+                ),
+            ]
+        )
+        # The hours are removed since we know for a fact no-one played for over an hour
+        live_session.duration = int((endtime - starttime) % (60 * 60))
+        live_session.included = (
+            endtime != MISSING_TIMESTAMP
+            and live_session.duration >= self.study.minimum_duration_minutes * 60
+        )
+
+        if live_session.included:
+            self._contribute(live_session, 1)
+
+    def _contribute(self, live_session: LiveSession, sign: int):
+        """Add (sign 1) or take out (sign -1) an included session's share of the totals."""
+        _user = live_session.user
+        perspective = _user.perspective
+
+        _add(self.perspective_counts, perspective, sign)
+        self.duration_total += sign * live_session.duration
+
+        for banana_id, count in live_session.banana_pickups.items():
+            counts = self.banana_pickup_counts.setdefault(banana_id, Counter())
+            _add(counts, perspective, sign * count)
+            if not counts:
+                del self.banana_pickup_counts[banana_id]
+            self.pickup_total += sign * count
+
+        for roi_name in live_session.roi_names:
+            visitors = self.roi_visitors.setdefault((_user.user, roi_name), {})
+            counted = min(visitors) if visitors else None
+            if counted is not None:
+                self._count_roi_visit(roi_name, visitors[counted], -1)
+
+            if sign > 0:
+                visitors[_user.id] = perspective
+            else:
+                del visitors[_user.id]
+
+            if visitors:
+                self._count_roi_visit(roi_name, visitors[min(visitors)], 1)
+            else:
+                del self.roi_visitors[(_user.user, roi_name)]
+
+        if live_session.curiosity_count > 0:
+            curiosity_sum = (
+                self.curiosity_sums.get(perspective, Fraction(0))
+                + sign * live_session.curiosity_sum
+            )
+            _add(
+                self.curiosity_counts, perspective, sign * live_session.curiosity_count
+            )
+            if perspective in self.curiosity_counts:
+                self.curiosity_sums[perspective] = curiosity_sum
+            else:
+                del self.curiosity_sums[perspective]
+
+    def _count_roi_visit(self, roi_name: str, perspective: str, sign: int):
+        counts = self.roi_visit_counts.setdefault(roi_name, Counter())
+        _add(counts, perspective, sign)
+        if not counts:
+            del self.roi_visit_counts[roi_name]
+
+    def publish(self):
+        player_count = self.perspective_counts.total()
+        curiosity_count = self.curiosity_counts.total()
+
+        if player_count == 0 or curiosity_count == 0:
+            # Nobody has played long enough (or given any feedback) yet
+            self.global_stats = {"playerCount": player_count}
+        else:
+            self.global_stats = {
+                "playerCount": player_count,
+                "perspectiveCount": dict(self.perspective_counts),
+                "roiVisitCount": {
+                    roi_name: dict(c) for roi_name, c in self.roi_visit_counts.items()
+                },
+                "roiVisitRate": {
+                    roi_name: (c.total() / player_count)
+                    for roi_name, c in self.roi_visit_counts.items()
+                },
+                "bananaPickupCounts": {
+                    banana_id: dict(c)
+                    for banana_id, c in self.banana_pickup_counts.items()
+                },
+                "bananaPickupRate": {
+                    banana_id: (c.total() / player_count)
+                    for banana_id, c in self.banana_pickup_counts.items()
+                },
+                "averageCuriosityIndexPerPerspective": {
+                    perspective: float(curiosity_sum)
+                    / self.curiosity_counts[perspective]
+                    for perspective, curiosity_sum in self.curiosity_sums.items()
+                },
+                "globalCuriosityIndex": float(sum(self.curiosity_sums.values()))
+                / curiosity_count,
+                "averagePlayTimeSeconds": float(self.duration_total) / player_count,
+                "averageTotalBananasPicked": self.pickup_total / player_count,
+            }
+
+        self.updated = datetime.datetime.now().isoformat(timespec="seconds")
+
+    def as_json(self) -> bytes:
+        return json.dumps(
+            {
+                "updated": self.updated,
+                "rowsProcessed": self.rows_processed,
+                "highWaterMark": self.high_water_mark,
+                "globalStats": self.global_stats,
+            },
+            indent=4,
+        ).encode("utf-8")
+
+
+def _add(counter: Counter, key, count: int):
+    """Add to a counter, dropping the keys whose count falls to zero."""
+    counter[key] += count
+    if counter[key] == 0:
+        del counter[key]
+
+
+async def _handle_request(
+    live: LiveStats, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+):
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        # Headers are not needed, but must be read before answering
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        if len(request_line) >= 2 and request_line[0] == "GET":
+            path = request_line[1]
+        else:
+            path = None
+
+        if path in ("/", "/stats"):
+            status, body = "200 OK", live.as_json()
+        else:
+            status, body = "404 Not Found", b'{"error": "not found"}'
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _poll_forever(live: LiveStats, interval: float):
+    while True:
+        rows = await asyncio.to_thread(live.poll)
+        if rows > 0:
+            print(
+                f"Parsed {rows} new rows (up to id {live.high_water_mark}), "
+                f"{live.global_stats['playerCount']} players"
+            )
+        await asyncio.sleep(interval)
+
+
+async def serve(live: LiveStats, host: str, port: int, interval: float):
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_request(live, reader, writer), host, port
+    )
+    print(f"Serving live stats on http://{host}:{port}/stats")
+
+    async with server:
+        await asyncio.gather(server.serve_forever(), _poll_forever(live, interval))
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB_PATH)
+    parser.add_argument(
+        "--study",
+        type=Path,
+        default=DEFAULT_STUDY_PATH,
+        help="study definition whose sessions are followed",
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL_SECONDS,
+        help="seconds between two polls of the database",
+    )
+    parser.add_argument(
+        "--all-users",
+        action="store_true",
+        help="follow every session instead of only the study's cohort",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="number of timeseries rows read per round-trip",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = parse_args(argv)
+
+    study = load_study(args.study)
+    if args.all_users:
+        study = replace(study, cohort=None)
+
+    live = LiveStats(
+        create_engine(f"sqlite:///{args.db.resolve()}", echo=False),
+        study,
+        chunk_size=args.chunk_size,
+    )
+    try:
+        asyncio.run(serve(live, args.host, args.port, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+from density import grid_shape
+from store import ColumnTable
+
+# A sample that moved less than this since the previous one (in world units) is idle
+IDLE_DISTANCE = 0.05
+
+# Size of a map cell, in world units, when measuring how much of the map a user covered
+COVERAGE_CELL_SIZE = 5.0
+
+SPEED_PERCENTILES = {"speed_median": 50, "speed_p90": 90}
+
+
+def _grouped_percentile(
+    values: np.ndarray, groups: np.ndarray, group_count: int, q: float
+) -> np.ndarray:
+    """Linearly interpolated q-th percentile of the values of every group, NaN if empty."""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    percentiles = np.full(group_count, np.nan)
+    has_values = counts > 0
+    position = (counts[has_values] - 1) * (q / 100)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    start = starts[has_values]
+    percentiles[has_values] = values[start + lower] + (
+        values[start + upper] - values[start + lower]
+    ) * (position - lower)
+
+    return percentiles
+
+
+def trajectory_metrics(
+    positions: ColumnTable,
+    user_count: int,
+    extent: Sequence[float],
+    cell_size: float = COVERAGE_CELL_SIZE,
+) -> Dict[str, np.ndarray]:
+    """Movement metrics of every user at once, from the store's positions table.
+
+    Returns one array per metric, indexed by user index:
+    - total_distance: sum of the logged position deltas, in world units
+    - speed_median, speed_p90: world units per second between consecutive samples
+    - idle_fraction, running_fraction, jumping_fraction: fraction of the samples
+    - map_coverage: fraction of the `extent` grid cells the user logged a position in
+    """
+    user_indices = positions["user_index"]
+    sample_counts = np.bincount(user_indices, minlength=user_count).astype(np.float64)
+    # Users without positions get NaN fractions instead of a division warning
+    sample_counts[sample_counts == 0] = np.nan
+
+    def per_user_sum(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(user_indices, weights=weights, minlength=user_count)
+
+    pos_delta = positions["pos_delta"]
+    metrics = {
+        "total_distance": per_user_sum(pos_delta),
+        "idle_fraction": per_user_sum(pos_delta < IDLE_DISTANCE) / sample_counts,
+        "running_fraction": per_user_sum(positions["running"]) / sample_counts,
+        "jumping_fraction": per_user_sum(positions["jumping"]) / sample_counts,
+    }
+
+    # pos_delta is the distance since the previous sample, timestamps have a 1s resolution.
+    # A few logs are out of timestamp order, samples are put back in (stable) timestamp
+    # order so the speeds do not depend on how the rows were fetched
+    in_time_order = np.lexsort((positions["timestamp"], user_indices))
+    ordered_users = user_indices[in_time_order]
+    elapsed = np.diff(positions["timestamp"][in_time_order])
+    has_speed = (ordered_users[1:] == ordered_users[:-1]) & (elapsed > 0)
+    speeds = pos_delta[in_time_order][1:][has_speed] / elapsed[has_speed]
+    speed_users = ordered_users[1:][has_speed]
+    for name, q in SPEED_PERCENTILES.items():
+        metrics[name] = _grouped_percentile(speeds, speed_users, user_count, q)
+
+    x_min, x_max, z_min, z_max = extent
+    rows, columns = grid_shape(extent, cell_size)
+    x = positions["position"][:, 0]
+    z = positions["position"][:, 2]
+    on_map = (x >= x_min) & (x < x_max) & (z >= z_min) & (z < z_max)
+    cells = ((z[on_map] - z_min) // cell_size).astype(np.int64) * columns + (
+        (x[on_map] - x_min) // cell_size
+    ).astype(np.int64)
+    visited = np.unique(user_indices[on_map] * (rows * columns) + cells)
+    metrics["map_coverage"] = np.bincount(
+        visited // (rows * columns), minlength=user_count
+    ) / (rows * columns)
+
+    return metrics
@@ -0,0 +1,78 @@
+"""Add the analytics indexes to a Shinobi Valley database.
+
+Usage: python src/migrate.py [--db ../server-assets/db.db]
+
+The migration is idempotent: indexes are only created when missing, so it can be rerun
+whenever new sessions were collected. The poslog table earlier versions materialized is
+dropped, the analytics never read it.
+"""
+
+import argparse
+from pathlib import Path
+from typing import Optional, Sequence
+
+from sqlalchemy import Engine, create_engine, inspect, text
+
+from models import Timeseries, Userdata
+from process import DEFAULT_DB_PATH
+
+# Table of decoded POSLOG rows created by earlier versions of the migration
+LEGACY_POSLOG_TABLE = "poslog"
+
+
+def create_indexes(engine: Engine) -> int:
+    """Create the indexes declared on the models that the database is missing."""
+    created = 0
+    with engine.begin() as connection:
+        for table in (Userdata.__table__, Timeseries.__table__):
+            existing = {
+                index["name"]
+                for index in engine.dialect.get_indexes(connection, table.name)
+            }
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    created += 1
+
+    return created
+
+
+def drop_legacy_poslogs(engine: Engine) -> bool:
+    """Drop the poslog table of earlier versions, returns whether there was one."""
+    if not inspect(engine).has_table(LEGACY_POSLOG_TABLE):
+        return False
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE {LEGACY_POSLOG_TABLE}"))
+    return True
+
+
+def migrate(engine: Engine):
+    created = create_indexes(engine)
+    print(f"Created {created} missing indexes")
+
+    if drop_legacy_poslogs(engine):
+        print(f"Dropped the unused {LEGACY_POSLOG_TABLE} table")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=DEFAULT_DB_PATH,
+        help="SQLite database to migrate, in place",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = parse_args(argv)
+
+    if not args.db.exists():
+        raise SystemExit(f"No database at {args.db}")
+
+    migrate(create_engine(f"sqlite:///{args.db.resolve()}", echo=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,18 @@
 from typing import List, Optional
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, Text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
 class Base(DeclarativeBase):
-    pass
+    # Strings are TEXT columns, as in server-assets/schema.sql
+    type_annotation_map = {str: Text}
 
 
 class Userdata(Base):
 
     __tablename__ = "userdata"
+    __table_args__ = (Index("ix_userdata_user", "user"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
 
@@ -21,21 +23,33 @@ class Userdata(Base):
     endtime: Mapped[Optional[str]]
     params: Mapped[str]
 
+    # In log (id) order: without it, SQLite returns them in the order of the index
+    # it looks them up with, by logtype first
     timeseries_logs: Mapped[List["Timeseries"]] = relationship(
-        back_populates="userdata", cascade="all, delete-orphan"
+        back_populates="userdata",
+        cascade="all, delete-orphan",
+        order_by="Timeseries.id",
     )
 
 
 class Timeseries(Base):
 
     __tablename__ = "timeseries"
+    __table_args__ = (
+        Index(
+            "ix_timeseries_userdata_logtype_timestamp",
+            "userdata_id",
+            "logtype",
+            "timestamp",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
+    # TEXT as in server-assets/schema.sql, so SQLite returns the ids as strings
+    userdata_id: Mapped[str] = mapped_column(Text, ForeignKey("userdata.id"))
 
     timestamp: Mapped[str]
     logtype: Mapped[str]
     logline: Mapped[str]
 
-    userdata_id: Mapped[int] = mapped_column(ForeignKey("userdata.id"))
-
     userdata: Mapped["Userdata"] = relationship(back_populates="timeseries_logs")
@@ -1,298 +1,726 @@
 # process_logs.py
 
+import argparse
 import datetime
+import hashlib
 import math
-from abc import ABC
+import os
+import sys
 from collections import Counter
-from functools import reduce
-from itertools import combinations
-from operator import add
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 import json
-from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional, Sequence, Tuple
+from dataclasses import asdict, dataclass, replace
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
 
-import matplotlib
 import pandas as pd
-import seaborn as sns
 import numpy as np
-from scipy.stats import gaussian_kde
-
-# Use 'Agg' backend for non-interactive environments
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, func, select
 from sqlalchemy.orm import Session
 
+from cache import SessionCache
+from collectibles import BANANA_OFFSETS, Banana, BananaIndex, place_bananas
+from comparison import compare_groups
+from density import HEATMAP_GRID_MASK_FRACTION, grid_density
+from downsample import DEFAULT_BUCKET_SECONDS, DOWNSAMPLE_MODES, downsample_store
+from instrument import PipelineReport
+from metrics import trajectory_metrics
+from decoders import (
+    MISSING_TIMESTAMP,
+    USER_TIMESTAMP_FORMAT,
+    decode_timestamps,
+    format_timestamp,
+    group_logs,
+)
+from render import (
+    DEFAULT_WINDOW_MINUTES,
+    FIGURE_FORMATS,
+    FIGURE_KINDS,
+    heatmap_figures,
+    load_background,
+    pyplot,
+    render_figures,
+)
 from models import (  # Ensure models.py is in the same directory
     Timeseries,
     Userdata,
 )
+from store import SessionStore, SessionStoreBuilder, concat_stores, take_users
+from study import (
+    DEFAULT_MINIMUM_DURATION_MINUTES,
+    DEFAULT_STUDY_PATH,
+    Study,
+    load_studies,
+)
+from trajectory import TrajectoryFile, write_trajectories
 
-# Define the current working directory and database file path
-current_working_directory = Path.cwd()
-db_file_path = f"sqlite:///{str(current_working_directory.parent.joinpath('server-assets', 'db.db'))}"
+# The game's database, relative to the working directory (the analytics directory)
+DEFAULT_DB_PATH = Path("..", "server-assets", "db.db")
 
-# Create the SQLAlchemy engine
-sqlite_engine = create_engine(db_file_path, echo=False)
+# What a run computes: "stats" only needs the parsed sessions, "heatmap" draws them
+# and "export" writes them as columnar files, "all" does the stats and heatmaps (and
+# the export when --export is given)
+COMMANDS = ("stats", "heatmap", "export", "all")
+DEFAULT_COMMAND = "all"
 
-# Define the timestamp format
-USER_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
-PLAYTIME_MINIMUM_DURATION_MINUTES = 5
+# Map area covered by data/map.jpeg, in world coordinates (x_min, x_max, z_min, z_max).
+# These values were obtained by the power of friendship
+MAP_EXTENT = [-134, 131, -130, 134]
 
+HEATMAP_BACKENDS = ("kde", "grid")
 
-class TimeseriesLog(ABC):
-    def __init__(self, user_id: int, timestamp: str):
-        self.user_id = user_id
-        self.timestamp = timestamp
+# The perspectives whose metrics are compared by --bootstrap, as first - second
+COMPARED_PERSPECTIVES = ("FIRSTPERSON", "THIRDPERSON")
 
+# Number of timeseries rows fetched per round-trip when streaming
+DEFAULT_CHUNK_SIZE = 10_000
 
-class PositionLogging(TimeseriesLog):
-    def __init__(self, _user_id: int, timestamp: str, logline: str):
-        super().__init__(_user_id, timestamp)
-        self.process_logline(logline)
+# Number of user batches handed to each worker process when parsing in parallel
+WORKER_BATCHES_PER_WORKER = 4
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class UserStats:
+    # User specific metadata
+    user_id: int
+    user_username: str
+    perspective: str
+
+    # User session data
+    session_starttime: str
+    session_endtime: str
+    session_duration_seconds: int
+    session_duration_str: str
 
-    def process_logline(self, logline: str):
-        parts = logline.split("_")
+    banana_pickups: list
 
-        position = parts[0]
-        rotation = parts[1]
-        rotation_euler = parts[2]
-        pos_delta = parts[3]
-        rot_delta = parts[4]
-        path_distance = parts[5]
-        jumping = parts[6]
-        running = parts[7]
+    average_rate_seconds_per_banana: int
 
-        # Some of the logs have a ',' instead of a '.' for floating point values, fix it
-        def fix_floats(value):
-            return value.replace(",", ".")
+    average_curiosity_index: float
 
-        self.position = tuple(map(float, position[1:-1].split(", ")))
-        self.rotation = tuple(map(float, rotation[1:-1].split(", ")))
+    # Movement, see metrics.trajectory_metrics
+    total_distance: float
+    speed_median: float
+    speed_p90: float
+    idle_fraction: float
+    running_fraction: float
+    jumping_fraction: float
+    map_coverage: float
+
+
+def parse_timeseries(
+    builder: SessionStoreBuilder,
+    user_index: int,
+    username: str,
+    timestamps: np.ndarray,
+    logtypes: np.ndarray,
+    loglines: pd.Series,
+    last_position: Optional[np.ndarray] = None,
+    *,
+    banana_index: BananaIndex,
+) -> Optional[np.ndarray]:
+    """Decode a run of one user's logs (in log order) and append them to the store builder.
+
+    `timestamps` are the logs' epoch seconds, as returned by decode_timestamps. A user's
+    logs may be fed in several consecutive runs: `last_position` carries the last
+    position decoded in the previous run, and the last position of this run is returned.
+    Banana pickups are attributed to the bananas of `banana_index`.
+    """
+    # Group the logs by type once, every registered type is decoded in one batch
+    groups = group_logs(logtypes, loglines)
+
+    builder.count_logs({logtype: len(group.rows) for logtype, group in groups.items()})
+    for logtype, group in groups.items():
+        if group.batch is None:
+            continue
+
+        rejected = int(group.batch.rejected.sum())
+        builder.count_rejected(logtype, rejected)
+        if rejected > 0:
+            print(
+                f"Error processing {logtype} for user {username}: {rejected} malformed loglines"
+            )
 
-        rotation_euler_parts = rotation_euler.split(",")
-        if len(rotation_euler_parts) > 2:  # multiple commas
-            rotation_euler_parts = [
-                f"{rotation_euler_parts[0]}.{rotation_euler_parts[1]}",
-                f"{rotation_euler_parts[2]}.{rotation_euler_parts[3]}",
-            ]  # TODO: remove this if this might blow up
+    poslogs = groups["POSLOG"].batch
+    valid_poslog_rows = groups["POSLOG"].rows[~poslogs.rejected]
+    valid_poslogs = poslogs.select(~poslogs.rejected)
+    builder.append(
+        "positions",
+        user_index,
+        timestamp=timestamps[valid_poslog_rows],
+        position=valid_poslogs.position,
+        rotation=valid_poslogs.rotation,
+        rotation_euler=valid_poslogs.rotation_euler,
+        pos_delta=valid_poslogs.pos_delta,
+        rot_delta=valid_poslogs.rot_delta,
+        path_distance=valid_poslogs.path_distance,
+        jumping=valid_poslogs.jumping,
+        running=valid_poslogs.running,
+    )
 
-        self.rotation_euler = tuple(map(float, rotation_euler_parts))
+    # For every log, the row (in valid_poslogs) of the last position logged up to it
+    known_positions = valid_poslogs.position
+    if last_position is not None:
+        known_positions = np.vstack([last_position, known_positions])
+
+    first_position_row = len(known_positions) - len(valid_poslogs)
+    is_valid_poslog = np.zeros(len(logtypes), dtype=bool)
+    is_valid_poslog[valid_poslog_rows] = True
+    last_position_row = np.maximum.accumulate(
+        np.where(
+            is_valid_poslog,
+            np.cumsum(is_valid_poslog) - 1 + first_position_row,
+            first_position_row - 1,
+        )
+    )
 
-        self.pos_delta = float(fix_floats(pos_delta.split(":")[1]))
-        self.rot_delta = float(fix_floats(rot_delta.split(":")[1]))
-        self.path_distance = float(fix_floats(path_distance.split(":")[1]))
-        self.jumping = bool(int(jumping.split(":")[1]))
-        self.running = bool(int(running.split(":")[1]))
+    # A banana trigger can only be attributed once a position has been logged,
+    # otherwise it counts as a regular ROI visit
+    roi_triggers = groups["TRIGGER_ROI_ENTER"]
+    is_banana_trigger = (roi_triggers.batch.name == "Foraging_Banana") & (
+        last_position_row[roi_triggers.rows] >= 0
+    )
+    banana_trigger_rows = roi_triggers.rows[is_banana_trigger]
+    roi_visit_rows = roi_triggers.rows[~is_banana_trigger]
 
+    banana_ids = banana_index.close(
+        known_positions[last_position_row[banana_trigger_rows]]
+    )
+    picked = banana_ids >= 0
+    builder.append(
+        "banana_pickups",
+        user_index,
+        timestamp=timestamps[banana_trigger_rows][picked],
+        banana_id=banana_ids[picked],
+    )
 
-class BananaPickup(TimeseriesLog):
-    def __init__(self, user_id: int, timestamp: str, banana_id: int):
-        super().__init__(user_id, timestamp)
-        self.banana_id = banana_id
+    builder.append(
+        "roi_visits",
+        user_index,
+        timestamp=timestamps[roi_visit_rows],
+        roi_name=roi_triggers.batch.name[~is_banana_trigger],
+    )
 
+    feedback = groups["FEEDBACK"]
+    builder.append(
+        "curiosity",
+        user_index,
+        timestamp=timestamps[feedback.rows[~feedback.batch.rejected]],
+        curiosity=feedback.batch.curiosity[~feedback.batch.rejected],
+    )
 
-class ROIVisit(TimeseriesLog):
-    def __init__(self, user_id: int, timestamp: str, roi_name: int):
-        super().__init__(user_id, timestamp)
-        self.roi_name = roi_name
+    return known_positions[-1] if len(known_positions) > 0 else None
 
 
-class Curiosity(TimeseriesLog):
-    def __init__(self, user_id: int, timestamp: str, curiosity: float):
-        super().__init__(user_id, timestamp)
-        self.curiosity = curiosity
+def resolve_endtime(
+    _user: Userdata,
+    endtime_overrides: Mapping[str, datetime.datetime],
+    last_log_timestamp: Optional[str],
+) -> str:
+    if _user.endtime is not None:
+        return _user.endtime
 
+    possible_endtime = endtime_overrides.get(_user.user, None)
 
-class Banana:
+    # The rationale is that the noted down end times are more reliable than the logs' timestamps
+    # because we might have logs from when the users were already in an invalid game state
+    # but you gotta do what you gotta do
 
-    INDEX: int = 1
-    ALLOWED_DISTANCE_SQUARED: float = math.inf
+    if possible_endtime is not None:
+        return possible_endtime.strftime(USER_TIMESTAMP_FORMAT)
 
-    BASE_POSITION: tuple[float, float, float] = (-20.03064, 36.94436, -6.575068)
+    # heuristic to have a rough estimate of the total play-time, just use the last log's timestamp
+    if last_log_timestamp is not None:
+        return last_log_timestamp
 
-    def __init__(self, pos: tuple[float, float, float]):
-        self.index = Banana.INDEX
-        Banana.INDEX += 1
+    # use the start time. Since we filter play sessions whose duration is less than 5 minutes it is ok
+    return _user.starttime
 
-        self.pos = tuple(
-            map(lambda pair: add(pair[0], pair[1]), zip(Banana.BASE_POSITION, pos))
+
+def parse_userdata(_users: Sequence[Userdata], study: Study) -> SessionStore:
+    builder = SessionStoreBuilder()
+
+    for _user in _users:
+        timeseries_data: Sequence[Timeseries] = _user.timeseries_logs
+        user_index = builder.add_user(
+            _user.id, _user.user, _user.perspective, _user.starttime, _user.endtime
         )
 
-    def __str__(self):
-        return f"Banana {self.index} at {self.pos}"
+        builder.set_endtime(
+            user_index,
+            resolve_endtime(
+                _user,
+                study.endtime_overrides,
+                timeseries_data[-1].timestamp if len(timeseries_data) > 0 else None,
+            ),
+        )
 
-    def __repr__(self):
-        return f"Banana {self.index} at {self.pos}"
+        parse_timeseries(
+            builder,
+            user_index,
+            _user.user,
+            decode_timestamps([log.timestamp for log in timeseries_data]),
+            np.array([log.logtype for log in timeseries_data], dtype=object),
+            pd.Series([log.logline for log in timeseries_data], dtype=object),
+            banana_index=study.banana_index,
+        )
 
-    def dist_squared(self, other_pos: tuple[float, float, float]) -> float:
-        return reduce(
-            add,
-            map(
-                lambda coordPair: (coordPair[0] - coordPair[1]) ** 2,
-                zip(self.pos, other_pos),
+    return builder.build()
+
+
+def _stream_timeseries(
+    session: Session, user_ids: Sequence[int], chunk_size: int
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """The users' logs streamed in chunks, grouped by user then in timestamp order, as
+    runs of (user id, timestamp strings, epoch seconds, logtypes, loglines). A user's
+    logs are split over several consecutive runs when they span chunks.
+
+    The users come in the order of the userdata_id column, which depends on its type:
+    "10" comes before "2" in the TEXT column of schema.sql, not in an INTEGER one.
+    """
+    timeseries_query = (
+        select(
+            Timeseries.userdata_id,
+            Timeseries.timestamp,
+            Timeseries.logtype,
+            Timeseries.logline,
+        )
+        .where(Timeseries.userdata_id.in_(user_ids))
+        # The plain column, so that the rows come in index order and only each user's
+        # logs are sorted by timestamp
+        .order_by(Timeseries.userdata_id, Timeseries.timestamp, Timeseries.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    for partition in session.execute(timeseries_query).partitions():
+        userdata_ids, log_timestamps, logtypes, loglines = (
+            np.array(column, dtype=object) for column in zip(*partition)
+        )
+        userdata_ids = userdata_ids.astype(np.int64)
+        timestamps = decode_timestamps(log_timestamps)
+
+        # Feed each user's run of rows in this chunk to the parser separately
+        boundaries = np.flatnonzero(userdata_ids[1:] != userdata_ids[:-1]) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(userdata_ids)]])
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield (
+                int(userdata_ids[start]),
+                log_timestamps[start:end],
+                timestamps[start:end],
+                logtypes[start:end],
+                loglines[start:end],
+            )
+
+
+def stream_userdata(
+    session: Session,
+    _users: Sequence[Userdata],
+    study: Study,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> SessionStore:
+    """Same as parse_userdata, but streams the logs in chunks instead of loading each
+    user's whole relationship, so memory is bounded by the chunk size."""
+    builder = SessionStoreBuilder()
+    users_by_id = {_user.id: _user for _user in _users}
+
+    # Users are added as their logs come in, so that their rows are appended in user
+    # order whatever the order of the stream; users without logs are added last
+    user_indices: Dict[int, int] = {}
+
+    def add_user(_user: Userdata) -> int:
+        user_indices[_user.id] = builder.add_user(
+            _user.id, _user.user, _user.perspective, _user.starttime, _user.endtime
+        )
+        return user_indices[_user.id]
+
+    last_positions: Dict[int, Optional[np.ndarray]] = {}
+    last_log_timestamps: Dict[int, str] = {}
+
+    for _user_id, log_timestamps, timestamps, logtypes, loglines in _stream_timeseries(
+        session, sorted(users_by_id), chunk_size
+    ):
+        user_index = user_indices.get(_user_id)
+        if user_index is None:
+            user_index = add_user(users_by_id[_user_id])
+        last_positions[_user_id] = parse_timeseries(
+            builder,
+            user_index,
+            users_by_id[_user_id].user,
+            timestamps,
+            logtypes,
+            pd.Series(loglines, dtype=object),
+            last_positions.get(_user_id),
+            banana_index=study.banana_index,
+        )
+        last_log_timestamps[_user_id] = log_timestamps[-1]
+
+    for _user in _users:
+        if _user.id not in user_indices:
+            add_user(_user)
+        builder.set_endtime(
+            user_indices[_user.id],
+            resolve_endtime(
+                _user, study.endtime_overrides, last_log_timestamps.get(_user.id)
             ),
-            0,
         )
 
-    def close(self, other_pos: tuple[float, float, float]) -> bool:
-        _dist_squared = self.dist_squared(other_pos)
-        return _dist_squared <= Banana.ALLOWED_DISTANCE_SQUARED
+    # Back in the user id order of the other parsers
+    store = builder.build()
+    return take_users(store, np.argsort(store.user_id, kind="stable"))
+
+
+def parse_studies(
+    session: Session,
+    studies: Sequence[Study],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, SessionStore]:
+    """Parse the sessions of several studies with a single scan of the timeseries table.
+
+    Each study selects its users with its own (filtered) query, then the logs of all of
+    them are streamed once. A session is decoded once per distinct set of collectibles
+    among the studies covering it, and every study gets a store of its own users with
+    its own end times. The decoding counters of a study's store are those of the
+    decoding it shares.
+    """
+    study_users = {
+        study.name: session.execute(study.users_query()).scalars().all()
+        for study in studies
+    }
+    users_by_id = {
+        _user.id: _user for _users in study_users.values() for _user in _users
+    }
+
+    banana_indices: Dict[tuple, BananaIndex] = {}
+    collectible_user_ids: Dict[tuple, set] = {}
+    for study in studies:
+        banana_indices.setdefault(study.collectibles, study.banana_index)
+        collectible_user_ids.setdefault(study.collectibles, set()).update(
+            _user.id for _user in study_users[study.name]
+        )
 
+    # Users are added as their logs come in (see stream_userdata), every study looks
+    # its users up by id afterwards
+    builders = {collectibles: SessionStoreBuilder() for collectibles in banana_indices}
+    user_indices: Dict[tuple, Dict[int, int]] = {
+        collectibles: {} for collectibles in banana_indices
+    }
+
+    def add_user(_user: Userdata):
+        for collectibles, user_ids in collectible_user_ids.items():
+            if _user.id in user_ids:
+                user_indices[collectibles][_user.id] = builders[collectibles].add_user(
+                    _user.id, _user.user, _user.perspective, _user.starttime, None
+                )
 
-@dataclass(frozen=True, kw_only=True, slots=True)
-class UserStats:
-    # User specific metadata
-    user_id: int
-    user_username: str
-    perspective: str
+    last_positions: Dict[tuple, Dict[int, Optional[np.ndarray]]] = {
+        collectibles: {} for collectibles in banana_indices
+    }
+    last_log_timestamps: Dict[int, str] = {}
+
+    for _user_id, log_timestamps, timestamps, logtypes, loglines in _stream_timeseries(
+        session, sorted(users_by_id), chunk_size
+    ):
+        if _user_id not in last_log_timestamps:
+            add_user(users_by_id[_user_id])
+        loglines = pd.Series(loglines, dtype=object)
+        for collectibles, builder in builders.items():
+            user_index = user_indices[collectibles].get(_user_id)
+            if user_index is None:
+                continue
 
-    # User session data
-    session_starttime: str
-    session_endtime: str
-    session_duration_seconds: int
-    session_duration_str: str
+            last_positions[collectibles][_user_id] = parse_timeseries(
+                builder,
+                user_index,
+                users_by_id[_user_id].user,
+                timestamps,
+                logtypes,
+                loglines,
+                last_positions[collectibles].get(_user_id),
+                banana_index=banana_indices[collectibles],
+            )
+        last_log_timestamps[_user_id] = log_timestamps[-1]
+
+    for _user_id, _user in users_by_id.items():
+        if _user_id not in last_log_timestamps:
+            add_user(_user)
+
+    parsed = {
+        collectibles: builder.build() for collectibles, builder in builders.items()
+    }
+
+    stores = {}
+    for study in studies:
+        source = parsed[study.collectibles]
+        builder = SessionStoreBuilder()
+        for _user in study_users[study.name]:
+            user_index = builder.add_user(
+                _user.id,
+                _user.user,
+                _user.perspective,
+                _user.starttime,
+                resolve_endtime(
+                    _user, study.endtime_overrides, last_log_timestamps.get(_user.id)
+                ),
+            )
+            builder.append_user_tables(
+                user_index, source.user_tables(source.user_index(_user.id))
+            )
 
-    banana_pickups: list
+        stores[study.name] = replace(
+            builder.build(),
+            log_counts=source.log_counts,
+            rejected_counts=source.rejected_counts,
+        )
 
-    average_rate_seconds_per_banana: int
+    return stores
 
-    average_curiosity_index: float
 
+# Engine of a worker process, created by _init_worker
+_worker_engine = None
+
+
+def _init_worker(database_url: str):
+    # Every worker opens its own connections, nothing is shared with the parent process
+    global _worker_engine
+    _worker_engine = create_engine(database_url, echo=False)
 
-# Initialize bananas
-bananas: Dict[int, Banana] = {
-    banana.index: banana
-    for banana in [
-        Banana((87.01, -5.39, 43.25)),
-        Banana((50.45, 1.81, 18.4)),
-        Banana((46.93, 0.69, -90.28)),
-        Banana((102, 29, -20.21)),
-        Banana((27.65, -8.286, 79.57)),
-        Banana((-32.08, -1.49, 63.04)),
-        Banana((-20.13, -8.96, -0.81)),
-        Banana((-53.55, 34.85, 98.91)),
-        Banana((-66.786, -4.873, 23.983)),
-    ]
-}
 
-# Determine the minimum allowed distance squared between any two bananas
-for pair in combinations(bananas.values(), 2):
-    banana1, banana2 = pair
-    dist_squared = banana1.dist_squared(banana2.pos)
-    Banana.ALLOWED_DISTANCE_SQUARED = min(dist_squared, Banana.ALLOWED_DISTANCE_SQUARED)
+def _parse_user_batch(
+    user_ids: List[int],
+    study: Study,
+    stream: bool,
+    chunk_size: int,
+) -> SessionStore:
+    with Session(_worker_engine) as session:
+        _users = (
+            session.execute(
+                select(Userdata).where(Userdata.id.in_(user_ids)).order_by(Userdata.id)
+            )
+            .scalars()
+            .all()
+        )
+        # Only the store is sent back, the parent does not need anything else per user
+        if stream:
+            return stream_userdata(session, _users, study, chunk_size)
+        return parse_userdata(_users, study)
+
+
+def parse_sessions_parallel(
+    database_url: str,
+    _users: Sequence[Userdata],
+    study: Study,
+    workers: int,
+    stream: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> SessionStore:
+    """Split the users, in id order, over a process pool and concatenate the results back
+    in the same order, so the output does not depend on the number of workers."""
+    user_ids = sorted(_user.id for _user in _users)
+
+    # Several batches per worker so that a few long sessions do not stall the whole pool
+    batch_count = min(len(user_ids), workers * WORKER_BATCHES_PER_WORKER)
+    batches = [batch.tolist() for batch in np.array_split(user_ids, batch_count)]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(database_url,)
+    ) as executor:
+        results = list(
+            executor.map(
+                _parse_user_batch,
+                batches,
+                repeat(study),
+                repeat(stream),
+                repeat(chunk_size),
+            )
+        )
 
-# Equivalent to halving the "normal" distance, since we are always working with squared distances
-Banana.ALLOWED_DISTANCE_SQUARED *= 0.25
+    return concat_stores(results)
 
 
-def parse_userdata(
+def parse_sessions(
+    session: Session,
     _users: Sequence[Userdata],
-    usernames_with_endtimes: Dict[str, Optional[datetime.datetime]],
-) -> Dict[int, Tuple[Userdata, List[TimeseriesLog]]]:
-    _data: Dict[int, Tuple[Userdata, List[TimeseriesLog]]] = {}
+    study: Study,
+    stream: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = 1,
+) -> SessionStore:
+    """Parse the users' sessions with the selected ingestion mode."""
+    if workers > 1 and len(_users) > 1:
+        return parse_sessions_parallel(
+            session.get_bind().url.render_as_string(hide_password=False),
+            _users,
+            study,
+            workers,
+            stream=stream,
+            chunk_size=chunk_size,
+        )
 
-    for _user in _users:
-        timeseries_data: Sequence[Timeseries] = _user.timeseries_logs
-        _user_id = _user.id
-        timeseries_logs: List[TimeseriesLog] = []
-        last_position_log: Optional[PositionLogging] = None
-
-        if _user.endtime is None:
-            possible_endtime = usernames_with_endtimes.get(_user.user, None)
-
-            # The rationale is that the noted down end times are more reliable than the logs' timestamps
-            # because we might have logs from when the users were already in an invalid game state
-            # but you gotta do what you gotta do
-
-            if possible_endtime is not None:
-                _user.endtime = possible_endtime.strftime(USER_TIMESTAMP_FORMAT)
-            else:  # heuristic to have a rough estimate of the total play-time, just use the last log's timestamp
-                if len(timeseries_data) > 0:
-                    _user.endtime = timeseries_data[-1].timestamp
-                else:
-                    # use the start time. Since we filter play sessions whose duration is less than 5 minutes it is ok
-                    _user.endtime = _user.starttime
-
-        for timeseries_log in timeseries_data:
-            logtype = timeseries_log.logtype
-            logline = timeseries_log.logline
-            timestamp = timeseries_log.timestamp
-
-            try:
-                match logtype:
-                    case "POSLOG":
-                        _log = PositionLogging(_user_id, timestamp, logline)
-                        last_position_log = _log
-                        timeseries_logs.append(_log)
-                    case "TRIGGER_ROI_ENTER":
-                        if logline == "Foraging_Banana" and last_position_log:
-                            last_logged_position = last_position_log.position
-                            for banana in bananas.values():
-                                if banana.close(last_logged_position):
-                                    timeseries_logs.append(
-                                        BananaPickup(_user_id, timestamp, banana.index)
-                                    )
-                                    break
-                        else:
-                            timeseries_logs.append(
-                                ROIVisit(_user_id, timestamp, logline)
-                            )
-                    case "FEEDBACK":
-                        timeseries_logs.append(
-                            Curiosity(
-                                _user_id, timestamp, float(logline.replace(",", "."))
-                            )
-                        )
-
-            except ValueError as e:
-                print(f"Error processing {logtype} for user {_user.user}: {e}")
-
-        _data[_user_id] = (_user, timeseries_logs)
-
-    return _data
+    if stream:
+        return stream_userdata(session, _users, study, chunk_size)
+    return parse_userdata(_users, study)
 
 
-def associate_perspectives(
-    poslog_df: pd.DataFrame, userdata_df: pd.DataFrame
-) -> pd.DataFrame:
-    """Associate POSLOG entries with user perspectives."""
-    # Ensure 'id' in userdata_df is numeric
-    userdata_df["id"] = pd.to_numeric(userdata_df["id"], errors="coerce")
+def cache_fingerprint(study: Study) -> str:
+    """Hash of everything that changes the parsed sessions of every user at once."""
+    parameters = {
+        "bananas": [(banana.index, banana.pos) for banana in study.bananas.values()],
+        "playtime_minimum_duration_minutes": study.minimum_duration_minutes,
+    }
+    return hashlib.sha256(json.dumps(parameters).encode("utf-8")).hexdigest()
 
-    # Drop entries where 'id' could not be converted to int
-    initial_userdata_count = len(userdata_df)
-    userdata_df.dropna(subset=["id"], inplace=True)
-    final_userdata_count = len(userdata_df)
-    dropped_userdata = initial_userdata_count - final_userdata_count
-    if dropped_userdata > 0:
-        print(f"Dropped {dropped_userdata} userdata entries due to invalid id.")
 
-    userdata_df["id"] = userdata_df["id"].astype(int)
+def parse_userdata_incremental(
+    session: Session,
+    _users: Sequence[Userdata],
+    study: Study,
+    cache: SessionCache,
+    stream: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = 1,
+) -> SessionStore:
+    """Parse only the sessions that are not in the cache (or grew since they were cached)
+    and merge them with the cached ones, in user order."""
+    _users = sorted(_users, key=lambda _user: _user.id)
+
+    # userdata_id is stored as TEXT, it is converted here so that the index is used
+    max_timeseries_ids = {
+        int(_user_id): max_id
+        for _user_id, max_id in session.execute(
+            select(Timeseries.userdata_id, func.max(Timeseries.id))
+            .where(Timeseries.userdata_id.in_([_user.id for _user in _users]))
+            .group_by(Timeseries.userdata_id)
+        ).all()
+    }
+
+    def cache_key(_user: Userdata) -> list:
+        possible_endtime = study.endtime_overrides.get(_user.user, None)
+        return [
+            max_timeseries_ids.get(_user.id),
+            _user.endtime,
+            (
+                possible_endtime.strftime(USER_TIMESTAMP_FORMAT)
+                if possible_endtime is not None
+                else None
+            ),
+        ]
 
-    # Merge POSLOG with userdata on 'user_id' and 'id'
-    merged_df = poslog_df.merge(
-        userdata_df, left_on="user_id", right_on="id", how="left"
+    stale_users = [
+        _user for _user in _users if not cache.is_fresh(_user.id, cache_key(_user))
+    ]
+    print(
+        f"Parsing {len(stale_users)}/{len(_users)} sessions, {len(_users) - len(stale_users)} loaded from cache"
     )
 
-    # Drop entries without perspective
-    merged_df.dropna(subset=["perspective"], inplace=True)
+    parsed = parse_sessions(
+        session,
+        stale_users,
+        study,
+        stream=stream,
+        chunk_size=chunk_size,
+        workers=workers,
+    )
+    parsed_indices = {
+        _user_id: user_index
+        for user_index, _user_id in enumerate(parsed.user_id.tolist())
+    }
+
+    builder = SessionStoreBuilder()
+
+    for _user in _users:
+        if _user.id in parsed_indices:
+            parsed_index = parsed_indices[_user.id]
+            # The end time is resolved from the logs, so it is cached with them
+            endtime = format_timestamp(parsed.endtime[parsed_index])
+            tables = parsed.user_tables(parsed_index)
+            cache.store_user(_user.id, cache_key(_user), endtime, tables)
+        else:
+            endtime, tables = cache.load_user(_user.id)
+
+        user_index = builder.add_user(
+            _user.id, _user.user, _user.perspective, _user.starttime, endtime
+        )
+        builder.append_user_tables(user_index, tables)
 
-    # Ensure perspective column is uppercase
-    merged_df["perspective"] = merged_df["perspective"].str.upper()
+    cache.save()
 
-    return merged_df
+    # The decoding counters only cover what was actually parsed in this run
+    store = replace(
+        builder.build(),
+        log_counts=parsed.log_counts,
+        rejected_counts=parsed.rejected_counts,
+    )
+    return store
 
 
-def generate_heatmaps(merged_df: pd.DataFrame):
-    """Generate and save heatmaps for First Person and Third Person perspectives."""
+def associate_perspectives(
+    store: SessionStore, user_indices: Sequence[int], column: str = "position"
+) -> Dict[str, np.ndarray]:
+    """Associate the logged positions (or another column of the positions table, such
+    as the dwell of downsampled positions) of the given users with their perspectives.
+    """
+    positions = store.positions
+    rows = positions.rows_for_users(user_indices)
+
+    perspectives = pd.Series(
+        store.perspective[positions["user_index"][rows]], dtype=object
+    )
+
+    # Drop entries without perspective
+    has_perspective = perspectives.notna().to_numpy()
+    rows = rows[has_perspective]
+
+    # Ensure perspective is uppercase
+    perspectives = perspectives[has_perspective].str.upper().to_numpy()
+
+    return {
+        perspective: positions[column][rows[perspectives == perspective]]
+        for perspective in pd.unique(perspectives)
+    }
+
+
+def generate_heatmaps(
+    positions_per_perspective: Dict[str, np.ndarray],
+    backend: str = "kde",
+    background_path: Path = Path("data", "map.jpeg"),
+    output_path: Path = Path("data", "heatmaps_with_bananas.png"),
+    _bananas: Optional[Dict[int, Banana]] = None,
+    background_image: Optional[np.ndarray] = None,
+    dwell_per_perspective: Optional[Dict[str, np.ndarray]] = None,
+):
+    """Generate and save heatmaps for First Person and Third Person perspectives.
+
+    The "kde" backend colours every position by a gaussian KDE evaluated at that position
+    (quadratic in the number of positions), the "grid" backend draws the same kind of
+    density binned and smoothed on a grid over the map (linear in the number of positions).
+    The bananas placed in the game are drawn unless other `_bananas` are given, and
+    `background_path` is only read when no decoded `background_image` is given.
+    Downsampled positions are weighted by their `dwell_per_perspective` (see downsample.py).
+    """
+    if backend not in HEATMAP_BACKENDS:
+        raise ValueError(f"Unknown heatmap backend {backend!r}")
+
+    plt = pyplot()
+
+    no_positions = np.empty((0, 3), dtype=np.float64)
+
     # Filter for First Person and Third Person
-    first_person_df = merged_df[merged_df["perspective"] == "FIRSTPERSON"]
-    third_person_df = merged_df[merged_df["perspective"] == "THIRDPERSON"]
+    first_person_positions = positions_per_perspective.get("FIRSTPERSON", no_positions)
+    third_person_positions = positions_per_perspective.get("THIRDPERSON", no_positions)
+
+    first_person_dwell = third_person_dwell = None
+    if dwell_per_perspective is not None:
+        first_person_dwell = dwell_per_perspective.get("FIRSTPERSON")
+        third_person_dwell = dwell_per_perspective.get("THIRDPERSON")
+
+    if _bananas is None:
+        _bananas = place_bananas(BANANA_OFFSETS)
 
     banana_data = []
-    for banana in bananas.values():
+    for banana in _bananas.values():
         banana_data.append(
             {
                 "banana_id": banana.index,
@@ -303,33 +731,59 @@ def generate_heatmaps(merged_df: pd.DataFrame):
         )
     banana_df = pd.DataFrame(banana_data)
 
-    background_image = plt.imread("data/map.jpeg")
+    if background_image is None:
+        background_image = plt.imread(background_path)
 
     # Define a function to plot heatmap and overlay event markers and bananas
-    def plot_heatmap(df, title, ax, bananas=None):
-
-        x = df["x"]
-        y = df["z"]
-
-        # These values were obtained by the power of friendship
-        extent = [-134, 131, -130, 134]
+    def plot_heatmap(positions, title, ax, bananas=None, dwell=None):
 
-        xy = np.vstack([x, y])
-        z = gaussian_kde(xy)(xy)
+        x = positions[:, 0]
+        y = positions[:, 2]
 
         ax.imshow(
             background_image,
             origin="lower",
-            extent=extent,
+            extent=MAP_EXTENT,
         )
 
-        if df.empty:
+        if len(positions) == 0:
             ax.set_title(f"{title} (No Data)")
             ax.set_xlabel("X Coordinate")
             ax.set_ylabel("Z Coordinate")
             return
 
-        ax.scatter(x, y, c=z, cmap="Reds", s=5)
+        if backend == "grid":
+            density = grid_density(
+                np.column_stack([x, y]),
+                MAP_EXTENT,
+                weights=dwell,
+                frequency_weights=True,
+            )
+
+            # Leave the map visible where (almost) nobody went
+            ax.imshow(
+                np.ma.masked_less_equal(
+                    density, density.max() * HEATMAP_GRID_MASK_FRACTION
+                ),
+                origin="lower",
+                extent=MAP_EXTENT,
+                cmap="Reds",
+                alpha=0.75,
+                interpolation="bilinear",
+            )
+        else:
+            from scipy.stats import gaussian_kde
+
+            xy = np.vstack([x, y])
+            if dwell is None:
+                z = gaussian_kde(xy)(xy)
+            else:
+                # Scott's factor of the samples the downsampled positions stand for
+                z = gaussian_kde(
+                    xy, bw_method=dwell.sum() ** (-1.0 / 6), weights=dwell
+                )(xy)
+
+            ax.scatter(x, y, c=z, cmap="Reds", s=5)
 
         ax.set_title(title)
         ax.set_xlabel("X Coordinate")
@@ -353,231 +807,285 @@ def generate_heatmaps(merged_df: pd.DataFrame):
 
     # Plot First Person heatmap with events and bananas
     plot_heatmap(
-        first_person_df, "First Person Perspective", axes[0], bananas=banana_df
+        first_person_positions,
+        "First Person Perspective",
+        axes[0],
+        bananas=banana_df,
+        dwell=first_person_dwell,
     )
 
     # Plot Third Person heatmap with events and bananas
     plot_heatmap(
-        third_person_df, "Third Person Perspective", axes[1], bananas=banana_df
+        third_person_positions,
+        "Third Person Perspective",
+        axes[1],
+        bananas=banana_df,
+        dwell=third_person_dwell,
     )
 
     plt.tight_layout()
 
     # Save the figure
-    plt.savefig("data/heatmaps_with_bananas.png")
+    plt.savefig(output_path)
     plt.close()
     print("Heatmaps with banana locations have been saved.")
 
 
-def main():
-    # Create database tables if they don't exist (optional)
-    # Base.metadata.create_all(sqlite_engine)
+def _grouped_counts(keys: pd.DataFrame) -> Dict[object, Counter]:
+    """{first key: Counter(second key: count)}, both levels in order of first appearance."""
+    outer, inner = keys.columns
+    sizes = keys.groupby([outer, inner], sort=False).size()
 
-    # Create a new session
-    with Session(sqlite_engine) as session:
-        survey_usernames_with_endtimes = {
-            "4798594B": None,
-            "4BB5EA24": datetime.datetime(2024, 12, 8, 16, 29),
-            "2A9639A5": datetime.datetime(2024, 12, 8, 16, 29),
-            "696C2597": datetime.datetime(2024, 12, 8, 14, 47),
-            "D19BDA5A": datetime.datetime(2024, 12, 7, 11, 20),
-            "CCD8974B": None,
-            "4D68BDE": datetime.datetime(2024, 12, 6, 21, 10),
-            "7588E46C": datetime.datetime(2024, 12, 6, 21, 5),
-            "6503A955": datetime.datetime(2024, 12, 6, 21, 10),
-            "BF48A639": None,
-            "8E2BF216": None,
-            "3D5671FC": None,
-            "DCEE048E": None,
-            "A6CE844F": datetime.datetime(2024, 12, 5, 17, 46),
-            "452A633D": None,
-            "F2959E00": datetime.datetime(2024, 12, 5, 12, 7),
-            "8778A580": datetime.datetime(2024, 12, 5, 11, 52),
-            "EDAC146": datetime.datetime(2024, 12, 5, 11, 41),
-            "4DE88833": datetime.datetime(2024, 12, 5, 11, 35),
-            "F1555EEE": datetime.datetime(2024, 12, 5, 11, 38),
-            "275FC505": datetime.datetime(2024, 12, 5, 11, 36),
-            "B39628C": datetime.datetime(2024, 12, 5, 11, 34),
-            "8FB73E2": datetime.datetime(2024, 12, 5, 11, 17),
-            "850F2ABB": datetime.datetime(2024, 12, 5, 11, 24),
-            "E85F2688": datetime.datetime(2024, 12, 5, 11, 16),
-            "816CBFD0": datetime.datetime(2024, 12, 5, 11, 17),
-            "F0867DFE": datetime.datetime(2024, 12, 5, 11, 10),
-            "E53E0FF7": None,
-            "4B7ADA93": datetime.datetime(2024, 12, 4, 12, 1),
-            "778FC0DD": datetime.datetime(2024, 12, 3, 21, 53),
-            "C22A0327": None,
-            "7243788C": datetime.datetime(2024, 12, 3, 15, 18),
-            "7F281BBB": datetime.datetime(2024, 12, 5, 11, 19),
-            "C049FEDD": None,
-            "26BBE9F1": None,
-        }
+    counters: Dict[object, Counter] = {}
+    for (outer_key, inner_key), size in zip(sizes.index.tolist(), sizes.tolist()):
+        counters.setdefault(outer_key, Counter())[inner_key] = size
 
-        # Initialize an empty dictionary to hold user data
-        data: dict[int, tuple[Userdata, list[TimeseriesLog]]] = {}
+    return counters
 
-        # Fetch users whose usernames are in survey_usernames_with_endtimes
-        users_query = select(Userdata).where(
-            Userdata.user.in_(survey_usernames_with_endtimes)
-        )
-        # users_query = select(Userdata)
-        users_result = session.execute(users_query)
-        users = users_result.scalars().all()
 
-        # Parse userdata and associated logs
-        data = parse_userdata(users, survey_usernames_with_endtimes)
-        total_users = len(data)
-        print(f"Results for {total_users}/{len(survey_usernames_with_endtimes)} users:")
-
-        # Global data aggregators
-        banana_pickup_counter: dict[str, Counter] = {}
-        roi_visit_counter: dict[str, Counter] = {}
-        perspective_counter = Counter()
-        position_data = []
-        global_curiosity_feedback = []
-        user_ids_for_heatmap = []
-        user_stats: list[UserStats] = []
-        session_playtimes = []
-        total_bananas_picked = 0
-        curiosity_per_perspective = {}
-
-        user_roi_visits: set[tuple[str, str]] = set()
-
-        # Process each user's logs
-        for user_data in data.values():
-            user, user_logs = user_data
-
-            if user.endtime is None:
-                print(f"\n\tNo recorded end time for user {user.user}, skipping")
-                continue
+def session_durations(store: SessionStore) -> Tuple[np.ndarray, np.ndarray]:
+    """(play time of every session in seconds, whether the session has an end time).
 
-            play_session_duration = datetime.datetime.strptime(
-                user.endtime, USER_TIMESTAMP_FORMAT
-            ) - datetime.datetime.strptime(user.starttime, USER_TIMESTAMP_FORMAT)
-            play_session_duration_seconds = play_session_duration.total_seconds()
-            play_session_duration_seconds %= (
-                60 * 60
-            )  # remove hours since we know for a fact no-one played for over an hour
-            play_session_duration = datetime.timedelta(
-                seconds=play_session_duration_seconds
-            )
+    The hours are removed since we know for a fact no-one played for over an hour.
+    """
+    has_endtime = store.endtime != MISSING_TIMESTAMP
+    durations = np.where(
+        has_endtime, (store.endtime - store.starttime) % (60 * 60), 0
+    ).astype(np.float64)
+    return durations, has_endtime
 
-            if play_session_duration < datetime.timedelta(
-                minutes=PLAYTIME_MINIMUM_DURATION_MINUTES
-            ):
-                print(
-                    f"\n\tUser {user.user} didn't play for enough time ({play_session_duration}), skipping"
-                )
-                continue
 
-            perspective_counter[user.perspective] += 1
-            user_ids_for_heatmap.append(user.id)
-            session_playtimes.append(play_session_duration_seconds)
-
-            banana_pickups: list[int] = []
-            curiosity_feedback = []
-
-            for log in user_logs:
-
-                match log:
-                    case BananaPickup():
-                        banana_pickups.append(log.banana_id)
-
-                        if log.banana_id not in banana_pickup_counter:
-                            banana_pickup_counter[log.banana_id] = Counter()
-
-                        total_bananas_picked += 1
-                        banana_pickup_counter[log.banana_id][user.perspective] += 1
-                    case PositionLogging():
-                        position_data.append(
-                            {
-                                "timestamp": log.timestamp,
-                                "user_id": log.user_id,
-                                **dict(zip(("x", "y", "z"), log.position)),
-                            }
-                        )
-                    case ROIVisit():
-                        if log.roi_name not in roi_visit_counter:
-                            roi_visit_counter[log.roi_name] = Counter()
-
-                        if (user.user, log.roi_name) in user_roi_visits:
-                            continue
-
-                        roi_visit_counter[log.roi_name][user.perspective] += 1
-                        user_roi_visits.add((user.user, log.roi_name))
-                    case Curiosity():
-                        curiosity_value = log.curiosity
-
-                        curiosity_feedback.append(curiosity_value)
-                        global_curiosity_feedback.append(curiosity_value)
-
-                        if user.perspective not in curiosity_per_perspective:
-                            curiosity_per_perspective[user.perspective] = []
-
-                        curiosity_per_perspective[user.perspective].append(
-                            curiosity_value
-                        )
-
-            stats = UserStats(
-                user_id=user.id,
-                user_username=user.user,
-                perspective=user.perspective,
-                session_starttime=user.starttime,
-                session_endtime=user.endtime,
+def summarize_sessions(
+    store: SessionStore, user_indices: np.ndarray, durations: np.ndarray
+) -> dict:
+    """The global stats of the given (included) users, as grouped reductions over the
+    store's event tables."""
+    player_count = len(user_indices)
+    perspectives = store.perspective[user_indices]
+
+    perspective_counter = Counter(
+        dict(
+            pd.Series(perspectives, dtype=object)
+            .groupby(perspectives, sort=False)
+            .size()
+            .items()
+        )
+    )
+
+    # Event rows of the included users, in user order
+    pickup_rows = store.banana_pickups.rows_for_users(user_indices)
+    banana_pickup_counter = _grouped_counts(
+        pd.DataFrame(
+            {
+                "banana_id": store.banana_pickups["banana_id"][pickup_rows],
+                "perspective": store.perspective[
+                    store.banana_pickups["user_index"][pickup_rows]
+                ],
+            }
+        )
+    )
+    total_bananas_picked = len(pickup_rows)
+
+    # Only the first visit of an ROI by a username counts, even across sessions
+    visit_rows = store.roi_visits.rows_for_users(user_indices)
+    visit_user_indices = store.roi_visits["user_index"][visit_rows]
+    roi_visits = pd.DataFrame(
+        {
+            "roi_name": store.roi_visits["roi_name"][visit_rows],
+            "perspective": store.perspective[visit_user_indices],
+            "username": store.user[visit_user_indices],
+        }
+    ).drop_duplicates(["username", "roi_name"])
+    roi_visit_counter = _grouped_counts(roi_visits[["roi_name", "perspective"]])
+
+    curiosity_rows = store.curiosity.rows_for_users(user_indices)
+    curiosities = store.curiosity["curiosity"][curiosity_rows]
+    # Curiosity sums are exactly rounded (math.fsum, over whole arrays at a time),
+    # which is also what the builtin sum gives on Python 3.12+
+    curiosity_per_perspective = {
+        perspective: math.fsum(values) / len(values)
+        for perspective, values in pd.Series(curiosities).groupby(
+            store.perspective[store.curiosity["user_index"][curiosity_rows]],
+            sort=False,
+        )
+    }
+
+    return {
+        "playerCount": player_count,
+        "perspectiveCount": perspective_counter,
+        "roiVisitCount": roi_visit_counter,
+        "roiVisitRate": {
+            roi_name: (c.total() / player_count)
+            for (roi_name, c) in roi_visit_counter.items()
+        },
+        "bananaPickupCounts": banana_pickup_counter,
+        "bananaPickupRate": {
+            banana_id: (c.total() / player_count)
+            for (banana_id, c) in banana_pickup_counter.items()
+        },
+        "averageCuriosityIndexPerPerspective": curiosity_per_perspective,
+        "globalCuriosityIndex": math.fsum(curiosities) / len(curiosities),
+        "averagePlayTimeSeconds": float(durations[user_indices].sum()) / player_count,
+        "averageTotalBananasPicked": total_bananas_picked / player_count,
+    }
+
+
+def aggregate_sessions(
+    store: SessionStore,
+    metrics: Dict[str, np.ndarray],
+    report: Optional[PipelineReport] = None,
+    minimum_duration_minutes: float = DEFAULT_MINIMUM_DURATION_MINUTES,
+    report_prefix: str = "",
+) -> Tuple[dict, List[UserStats]]:
+    """Reduce the parsed sessions into the global stats and the user stats.
+
+    `metrics` are the per-user trajectory metrics of the store, see trajectory_metrics.
+    Only the (few) included users are iterated over, to build their UserStats.
+    """
+    durations, has_endtime = session_durations(store)
+    included = has_endtime & (durations >= minimum_duration_minutes * 60)
+
+    for user_index in np.flatnonzero(~included).tolist():
+        username = store.user[user_index]
+        if not has_endtime[user_index]:
+            print(f"\n\tNo recorded end time for user {username}, skipping")
+            if report is not None:
+                report.count(f"{report_prefix}users.skipped_no_endtime")
+        else:
+            play_session_duration = datetime.timedelta(seconds=durations[user_index])
+            print(
+                f"\n\tUser {username} didn't play for enough time ({play_session_duration}), skipping"
+            )
+            if report is not None:
+                report.count(f"{report_prefix}users.skipped_short_session")
+
+    user_indices = np.flatnonzero(included)
+
+    user_stats: list[UserStats] = []
+    # Kept as it always was: each user's curiosity is divided by the number of
+    # feedbacks given by every included user up to (and including) them
+    running_curiosity_counts = np.cumsum(store.curiosity.counts()[user_indices])
+    for player, user_index in enumerate(user_indices.tolist()):
+        play_session_duration = datetime.timedelta(seconds=durations[user_index])
+        banana_pickups = store.banana_pickups.for_user(user_index)["banana_id"].tolist()
+
+        user_stats.append(
+            UserStats(
+                user_id=int(store.user_id[user_index]),
+                user_username=store.user[user_index],
+                perspective=store.perspective[user_index],
+                session_starttime=format_timestamp(store.starttime[user_index]),
+                session_endtime=format_timestamp(store.endtime[user_index]),
                 session_duration_seconds=play_session_duration.total_seconds(),
                 session_duration_str=str(play_session_duration),
                 banana_pickups=banana_pickups,
                 average_rate_seconds_per_banana=(
                     datetime.timedelta(
-                        seconds=play_session_duration_seconds / len(banana_pickups)
+                        seconds=float(durations[user_index]) / len(banana_pickups)
                     ).total_seconds()
                     if len(banana_pickups) > 0
                     else -1
                 ),
-                average_curiosity_index=sum(curiosity_feedback)
-                / len(global_curiosity_feedback),
+                average_curiosity_index=math.fsum(
+                    store.curiosity.for_user(user_index)["curiosity"]
+                )
+                / int(running_curiosity_counts[player]),
+                **{name: float(values[user_index]) for name, values in metrics.items()},
             )
+        )
 
-            user_stats.append(stats)
-
-        # Extract event data for these user_ids
-        poslog_df = pd.DataFrame(position_data)
-        poslog_df["user_id"] = pd.to_numeric(poslog_df["user_id"], errors="coerce")
-
-        # Fetch all userdata for merging
-        userdata_query = select(Userdata).where(
-            Userdata.id.in_(user_ids_for_heatmap)
-        )  # Nuno - I don't really like this since we already have the data available but whatever
-        userdata_df = pd.read_sql(userdata_query, sqlite_engine)
-
-        # Associate perspectives with position logging
-        player_data_pos_df = associate_perspectives(poslog_df, userdata_df)
-
-        # Generate and save Heatmaps with Events and Bananas
-        generate_heatmaps(player_data_pos_df)
-
-        global_stats = {
-            "playerCount": len(user_stats),
-            "perspectiveCount": perspective_counter,
-            "roiVisitCount": roi_visit_counter,
-            "roiVisitRate": {
-                roi_name: (c.total() / len(user_stats))
-                for (roi_name, c) in roi_visit_counter.items()
-            },
-            "bananaPickupCounts": banana_pickup_counter,
-            "bananaPickupRate": {
-                banana_id: (c.total() / len(user_stats))
-                for (banana_id, c) in banana_pickup_counter.items()
-            },
-            "averageCuriosityIndexPerPerspective": {
-                perspective: sum(curiosities) / len(curiosities)
-                for (perspective, curiosities) in curiosity_per_perspective.items()
-            },
-            "globalCuriosityIndex": sum(global_curiosity_feedback)
-            / len(global_curiosity_feedback),
-            "averagePlayTimeSeconds": sum(session_playtimes) / len(session_playtimes),
-            "averageTotalBananasPicked": total_bananas_picked / len(user_stats),
-        }
+    return summarize_sessions(store, user_indices, durations), user_stats
+
+
+def perspective_metrics(
+    store: SessionStore,
+    user_indices: np.ndarray,
+    durations: np.ndarray,
+    metrics: Dict[str, np.ndarray],
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """(names, numerators, denominators) of the per-user metrics that are compared
+    between perspectives, each a ratio of per-user sums (see comparison.compare_groups).
+
+    The ratios over a perspective's users are the per-perspective versions of the
+    global stats: curiosity, pickups and ROI visits per player, and play time, plus
+    the mean trajectory metrics of user_stats.csv. An ROI counts once per session.
+    """
+    user_count = len(store)
+    ones = np.ones(len(user_indices))
+
+    def per_user(table, weights=None) -> np.ndarray:
+        return np.bincount(
+            table["user_index"], weights=weights, minlength=user_count
+        ).astype(np.float64)[user_indices]
+
+    curiosity = store.curiosity
+    columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+        "curiosityIndex": (
+            per_user(curiosity, curiosity["curiosity"]),
+            per_user(curiosity),
+        ),
+        "playTimeSeconds": (durations[user_indices], ones),
+        "bananasPickedPerPlayer": (per_user(store.banana_pickups), ones),
+    }
+
+    pickups = store.banana_pickups
+    for banana_id in np.unique(pickups["banana_id"]).tolist():
+        columns[f"bananaPickupRate.{banana_id}"] = (
+            per_user(pickups, pickups["banana_id"] == banana_id),
+            ones,
+        )
+
+    visits = store.roi_visits
+    for roi_name in pd.unique(visits["roi_name"]).tolist():
+        visited = per_user(visits, visits["roi_name"] == roi_name) > 0
+        columns[f"roiVisitRate.{roi_name}"] = (visited.astype(np.float64), ones)
+
+    for name, values in metrics.items():
+        columns[name] = (values[user_indices], ones)
+
+    numerators = np.column_stack([numerator for numerator, _ in columns.values()])
+    denominators = np.column_stack([denominator for _, denominator in columns.values()])
+    # Users without a value (e.g. no positions) are left out of that metric's mean
+    undefined = np.isnan(numerators)
+    numerators[undefined] = 0
+    denominators[undefined] = 0
+
+    return list(columns), numerators, denominators
+
+
+def compare_perspectives(
+    store: SessionStore,
+    user_indices: np.ndarray,
+    metrics: Dict[str, np.ndarray],
+    resamples: int,
+    seed: int = 0,
+    workers: int = 1,
+) -> dict:
+    """Bootstrap intervals of every per-perspective metric of the given (included)
+    users, and permutation tests of their differences between COMPARED_PERSPECTIVES."""
+    durations, _ = session_durations(store)
+    names, numerators, denominators = perspective_metrics(
+        store, user_indices, durations, metrics
+    )
+    return compare_groups(
+        names,
+        numerators,
+        denominators,
+        store.perspective[user_indices],
+        COMPARED_PERSPECTIVES,
+        resamples,
+        seed=seed,
+        workers=workers,
+    )
+
+
+def write_stats(
+    global_stats: dict,
+    user_stats: Sequence[UserStats],
+    output_directory: Path = Path("data"),
+    verbose: bool = True,
+):
+    if verbose:
         print(
             json.dumps(
                 global_stats,
@@ -585,17 +1093,520 @@ def main():
             )
         )
 
-        with open("data/stats.json", "w", encoding="utf-8") as stats:
-            stats.write(
-                json.dumps(
-                    global_stats,
-                    indent=4,
-                )
+    with open(output_directory / "stats.json", "w", encoding="utf-8") as stats:
+        stats.write(
+            json.dumps(
+                global_stats,
+                indent=4,
             )
+        )
 
-        user_stats_df = pd.DataFrame.from_records([asdict(stat) for stat in user_stats])
+    user_stats_df = pd.DataFrame.from_records([asdict(stat) for stat in user_stats])
+    if verbose:
         print(user_stats_df)
-        user_stats_df.to_csv("data/user_stats.csv", index=False)
+    user_stats_df.to_csv(output_directory / "user_stats.csv", index=False)
+
+
+def _add_session_options(parser: argparse.ArgumentParser):
+    """Where the sessions are read from and how they are parsed, for every command."""
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=DEFAULT_DB_PATH,
+        help="SQLite database of the game (default: ../server-assets/db.db)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("data"),
+        help="directory holding map.jpeg, where the stats, figures and reports are written",
+    )
+    parser.add_argument(
+        "--study",
+        type=Path,
+        action="append",
+        default=None,
+        help="study definition to analyse (default: studies/survey.toml); repeat it to "
+        "analyse several studies over a single scan of the logs, each written to "
+        "<output-dir>/<study name>",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the timeseries table in chunks instead of loading each user's logs at once",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="number of timeseries rows per chunk when streaming",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes the users are split over while parsing",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse the sessions parsed in previous runs, only parsing new or growing ones",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path("data", "cache"),
+        help="where parsed sessions are kept between incremental runs",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="write per-stage timings, row counters and memory usage to report.json",
+    )
+    parser.add_argument(
+        "--profile-parse",
+        action="store_true",
+        help="also dump a cProfile and a tracemalloc snapshot of the parse stage (implies --report)",
+    )
+
+
+def _add_comparison_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        metavar="RESAMPLES",
+        default=None,
+        help="add bootstrap intervals and permutation p-values of the per-perspective "
+        "metrics to stats.json, with this many resamples (e.g. 10000)",
+    )
+    parser.add_argument(
+        "--bootstrap-seed",
+        type=int,
+        default=0,
+        help="seed of the --bootstrap resamples",
+    )
+    parser.add_argument(
+        "--bootstrap-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of threads the --bootstrap resamples are reduced in",
+    )
+
+
+def _add_heatmap_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--heatmap-backend",
+        choices=HEATMAP_BACKENDS,
+        default="kde",
+        help="density estimate of the heatmaps: per-point KDE or binned grid (much faster)",
+    )
+    parser.add_argument(
+        "--trajectories",
+        action="store_true",
+        help="write the positions to a memory-mapped trajectories.bin and draw the heatmaps from it",
+    )
+    parser.add_argument(
+        "--figures",
+        nargs="+",
+        choices=FIGURE_KINDS,
+        default=None,
+        help="also render a heatmap per user, per banana and/or per time window "
+        "to <output-dir>/figures, skipping the ones whose data did not change",
+    )
+    parser.add_argument(
+        "--figure-format",
+        choices=FIGURE_FORMATS,
+        default="png",
+        help="format of the --figures (npy: raw RGBA array)",
+    )
+    parser.add_argument(
+        "--figure-window-minutes",
+        type=float,
+        default=DEFAULT_WINDOW_MINUTES,
+        help="length of the time windows of --figures window",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes the --figures are rendered in",
+    )
+
+
+def _add_downsample_options(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--downsample",
+        choices=DOWNSAMPLE_MODES,
+        default=None,
+        help="draw and export fewer positions, weighted by the time spent at them: "
+        "merge idle duplicates, keep one per time bucket or simplify the paths (RDP)",
+    )
+    parser.add_argument(
+        "--downsample-tolerance",
+        type=float,
+        default=None,
+        help="world units: distance under which idle positions are merged "
+        "(default 0.01), or largest distance to the simplified paths (default 1)",
+    )
+    parser.add_argument(
+        "--downsample-seconds",
+        type=float,
+        default=DEFAULT_BUCKET_SECONDS,
+        help="length of the time buckets of --downsample time",
+    )
+
+
+def _add_export_options(parser: argparse.ArgumentParser, default_format: Optional[str]):
+    # The formats are checked once parsed, so that pyarrow is only imported to export
+    parser.add_argument(
+        "--export",
+        metavar="{parquet,ipc}",
+        default=default_format,
+        help="export the parsed positions, events and user stats as columnar files "
+        "of this format",
+    )
+    parser.add_argument(
+        "--export-dir",
+        type=Path,
+        default=None,
+        help="where the export is written (default: <output-dir>/export)",
+    )
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Shinobi Valley analytics",
+        epilog=f"Without a command, {DEFAULT_COMMAND} is run.",
+    )
+    commands = parser.add_subparsers(
+        dest="command", metavar="{" + ",".join(COMMANDS) + "}"
+    )
+
+    stats_parser = commands.add_parser(
+        "stats", help="write stats.json and user_stats.csv, without any plotting"
+    )
+    _add_session_options(stats_parser)
+    _add_comparison_options(stats_parser)
+    stats_parser.set_defaults(export=None, export_dir=None, downsample=None)
+
+    heatmap_parser = commands.add_parser(
+        "heatmap", help="draw the heatmaps of the included users"
+    )
+    _add_session_options(heatmap_parser)
+    _add_heatmap_options(heatmap_parser)
+    _add_downsample_options(heatmap_parser)
+    heatmap_parser.set_defaults(export=None, export_dir=None, bootstrap=None)
+
+    export_parser = commands.add_parser(
+        "export", help="export the parsed sessions as columnar files"
+    )
+    _add_session_options(export_parser)
+    _add_export_options(export_parser, default_format="parquet")
+    _add_downsample_options(export_parser)
+    export_parser.set_defaults(bootstrap=None)
+
+    all_parser = commands.add_parser(
+        "all", help="stats and heatmaps, and the export with --export"
+    )
+    _add_session_options(all_parser)
+    _add_comparison_options(all_parser)
+    _add_heatmap_options(all_parser)
+    _add_export_options(all_parser, default_format=None)
+    _add_downsample_options(all_parser)
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in (*COMMANDS, "-h", "--help"):
+        argv.insert(0, DEFAULT_COMMAND)
+    args = parser.parse_args(argv)
+
+    if args.export is not None:
+        from export import EXPORT_FORMATS
+
+        if args.export not in EXPORT_FORMATS:
+            parser.error(
+                f"unknown export format {args.export!r}, choose from {EXPORT_FORMATS}"
+            )
+
+    if args.command in ("heatmap", "all") and args.figure_window_minutes <= 0:
+        parser.error("--figure-window-minutes must be positive")
+
+    if (
+        args.downsample is not None
+        and args.command in ("heatmap", "all")
+        and args.trajectories
+    ):
+        parser.error(
+            "--trajectories keeps every logged position, it cannot be downsampled"
+        )
+
+    if args.study is not None and len(args.study) > 1:
+        if args.incremental or args.workers > 1:
+            parser.error(
+                "several studies are parsed in one streamed scan, "
+                "without --incremental or --workers"
+            )
+
+    return args
+
+
+def analyse_study(
+    store: SessionStore,
+    study: Study,
+    args: argparse.Namespace,
+    output_directory: Path,
+    export_directory: Path,
+    background: Optional[Tuple[np.ndarray, str]],
+    report: PipelineReport,
+    prefix: str = "",
+):
+    """Metrics, stats, heatmaps and exports of a study's parsed sessions.
+
+    Only the stages of `args.command` are run. `background` is the decoded map and
+    its digest (see render.load_background), None when no heatmap is drawn.
+    `prefix` is prepended to the names of the report's stages and counters.
+    """
+    total_users = len(store)
+    if study.cohort is not None:
+        print(f"Results for {total_users}/{len(study.cohort)} users:")
+    else:
+        print(f"Results for {total_users} users:")
+
+    report.count(f"{prefix}users.selected", total_users)
+    report.count_all(f"{prefix}logs.read", store.log_counts)
+    report.count_all(f"{prefix}logs.rejected", store.rejected_counts)
+    report.count_all(
+        f"{prefix}rows",
+        {
+            "positions": len(store.positions),
+            "banana_pickups": len(store.banana_pickups),
+            "roi_visits": len(store.roi_visits),
+            "curiosity": len(store.curiosity),
+        },
+    )
+
+    with report.stage(f"{prefix}trajectory_metrics"):
+        metrics = trajectory_metrics(store.positions, len(store), MAP_EXTENT)
+
+    with report.stage(f"{prefix}aggregate"):
+        global_stats, user_stats = aggregate_sessions(
+            store,
+            metrics,
+            report,
+            minimum_duration_minutes=study.minimum_duration_minutes,
+            report_prefix=prefix,
+        )
+    report.count(f"{prefix}users.included", len(user_stats))
+    included_users = store.user_indices([stats.user_id for stats in user_stats])
+
+    if args.bootstrap is not None:
+        with report.stage(f"{prefix}compare_perspectives"):
+            global_stats["perspectiveComparison"] = compare_perspectives(
+                store,
+                included_users,
+                metrics,
+                args.bootstrap,
+                seed=args.bootstrap_seed,
+                workers=args.bootstrap_workers,
+            )
+
+    # Only what is drawn and exported is downsampled, the stats use every position
+    if args.downsample is not None:
+        with report.stage(f"{prefix}downsample"):
+            logged_positions = len(store.positions)
+            store = downsample_store(
+                store,
+                args.downsample,
+                tolerance=args.downsample_tolerance,
+                bucket_seconds=args.downsample_seconds,
+            )
+        print(
+            f"Downsampled {logged_positions} positions to {len(store.positions)} "
+            f"({args.downsample})"
+        )
+        report.count(f"{prefix}rows.positions_downsampled", len(store.positions))
+
+    if args.command in ("heatmap", "all"):
+        draw_heatmaps(
+            store,
+            included_users,
+            study,
+            args,
+            output_directory,
+            background,
+            report,
+            prefix,
+        )
+
+    if args.command in ("stats", "all"):
+        with report.stage(f"{prefix}write_stats"):
+            write_stats(global_stats, user_stats, output_directory)
+
+    if args.export is not None:
+        from export import export_sessions
+
+        with report.stage(f"{prefix}export"):
+            export_sessions(store, user_stats, export_directory, args.export)
+
+
+def draw_heatmaps(
+    store: SessionStore,
+    included_users: np.ndarray,
+    study: Study,
+    args: argparse.Namespace,
+    output_directory: Path,
+    background: Tuple[np.ndarray, str],
+    report: PipelineReport,
+    prefix: str = "",
+):
+    """The perspective heatmaps of the included users, and their --figures."""
+    if args.trajectories:
+        with report.stage(f"{prefix}write_trajectories"):
+            write_trajectories(store, output_directory / "trajectories.bin")
+
+    # Associate perspectives with position logging
+    with report.stage(f"{prefix}associate_perspectives"):
+        if args.trajectories:
+            positions_per_perspective = TrajectoryFile(
+                output_directory / "trajectories.bin"
+            ).positions_per_perspective(included_users)
+        else:
+            positions_per_perspective = associate_perspectives(store, included_users)
+
+        dwell_per_perspective = None
+        if "dwell" in store.positions.columns:
+            dwell_per_perspective = associate_perspectives(
+                store, included_users, column="dwell"
+            )
+
+    # Generate and save Heatmaps with Events and Bananas
+    with report.stage(f"{prefix}generate_heatmaps"):
+        generate_heatmaps(
+            positions_per_perspective,
+            backend=args.heatmap_backend,
+            background_path=args.output_dir / "map.jpeg",
+            output_path=output_directory / "heatmaps_with_bananas.png",
+            _bananas=study.bananas,
+            background_image=background[0],
+            dwell_per_perspective=dwell_per_perspective,
+        )
+
+    if args.figures is not None:
+        with report.stage(f"{prefix}render_figures"):
+            rendered, unchanged = render_figures(
+                heatmap_figures(
+                    store,
+                    included_users,
+                    args.figures,
+                    study.bananas,
+                    window_minutes=args.figure_window_minutes,
+                ),
+                output_directory / "figures",
+                *background,
+                MAP_EXTENT,
+                file_format=args.figure_format,
+                workers=args.render_workers,
+            )
+        print(f"Rendered {rendered} figures, {unchanged} unchanged since the last run")
+        report.count(f"{prefix}figures.rendered", rendered)
+        report.count(f"{prefix}figures.unchanged", unchanged)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = parse_args(argv)
+    studies = load_studies(args.study or [DEFAULT_STUDY_PATH])
+
+    if not args.db.exists():
+        raise SystemExit(f"No database at {args.db}")
+    engine = create_engine(f"sqlite:///{args.db.resolve()}", echo=False)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Create database tables if they don't exist (optional)
+    # Base.metadata.create_all(engine)
+
+    # Create a new session
+    with Session(engine) as session:
+        report = PipelineReport(enabled=args.report or args.profile_parse)
+        profile_path = (
+            args.output_dir / "parse_userdata.prof" if args.profile_parse else None
+        )
+        tracemalloc_path = (
+            args.output_dir / "parse_userdata_tracemalloc.txt"
+            if args.profile_parse
+            else None
+        )
+
+        # Decoded once, for every figure of every study
+        background = None
+        if args.command in ("heatmap", "all"):
+            with report.stage("load_background"):
+                background = load_background(args.output_dir / "map.jpeg")
+
+        if len(studies) > 1:
+            # One scan of the logs for every study, each study is then analysed alone
+            with report.stage("parse_studies", profile_path, tracemalloc_path):
+                stores = parse_studies(session, studies, chunk_size=args.chunk_size)
+
+            for study in studies:
+                output_directory = args.output_dir / study.name
+                output_directory.mkdir(parents=True, exist_ok=True)
+                analyse_study(
+                    stores[study.name],
+                    study,
+                    args,
+                    output_directory,
+                    (
+                        args.export_dir / study.name
+                        if args.export_dir is not None
+                        else output_directory / "export"
+                    ),
+                    background,
+                    report,
+                    prefix=f"{study.name}.",
+                )
+
+            report.write(args.output_dir / "report.json")
+            return
+
+        (study,) = studies
+
+        # Fetch the study's users, its filters are applied by the database
+        with report.stage("query"):
+            users = session.execute(study.users_query()).scalars().all()
+
+        # Parse userdata and associated logs
+        with report.stage("parse_userdata", profile_path, tracemalloc_path):
+            if args.incremental:
+                cache = SessionCache.load(args.cache_dir, cache_fingerprint(study))
+                store = parse_userdata_incremental(
+                    session,
+                    users,
+                    study,
+                    cache,
+                    stream=args.stream,
+                    chunk_size=args.chunk_size,
+                    workers=args.workers,
+                )
+            else:
+                store = parse_sessions(
+                    session,
+                    users,
+                    study,
+                    stream=args.stream,
+                    chunk_size=args.chunk_size,
+                    workers=args.workers,
+                )
+
+        analyse_study(
+            store,
+            study,
+            args,
+            args.output_dir,
+            args.export_dir or args.output_dir / "export",
+            background,
+            report,
+        )
+
+        report.write(args.output_dir / "report.json")
 
 
 if __name__ == "__main__":
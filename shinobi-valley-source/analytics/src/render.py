@@ -0,0 +1,374 @@
+"""Heatmaps of subsets of the positions (per user, per banana, per time window).
+
+Figures are described and their density grids computed in the parent process, then
+drawn in a process pool. The background is decoded once and handed to every worker when
+it starts. A figure is only rendered again when the digest of its inputs changed.
+matplotlib is only imported once something is drawn.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from collectibles import Banana
+from density import HEATMAP_GRID_MASK_FRACTION, grid_density, grid_shape
+from store import ColumnTable, SessionStore
+
+FIGURE_KINDS = ("user", "banana", "window")
+
+# "npy" is the rendered figure as a raw (height, width, 4) RGBA uint8 array
+FIGURE_FORMATS = ("png", "svg", "npy")
+
+# Bump whenever the drawing changes, so every cached figure is rendered again
+RENDER_VERSION = 2
+
+# Digest of every rendered figure, kept next to them
+MANIFEST_NAME = "manifest.json"
+
+FIGURE_SIZE = (10, 10)
+
+# Length of the time windows, in minutes since the start of the session
+DEFAULT_WINDOW_MINUTES = 5
+
+# A banana's heatmap shows where the players were in the seconds before picking it up
+BANANA_APPROACH_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class Figure:
+    """One heatmap: the (x, z) positions to draw, over the map, with the bananas."""
+
+    # Path of the figure in the figures directory, without extension (e.g. "user/12")
+    name: str
+    title: str
+    positions: np.ndarray  # (n, 2) x and z
+    markers: np.ndarray  # (m, 2) x and z of the bananas
+    # (n,) samples every position stands for, when downsampled (see downsample.py)
+    dwell: Optional[np.ndarray] = None
+
+    def digest(
+        self, background_digest: str, file_format: str, extent: Sequence[float]
+    ) -> str:
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps(
+                [
+                    RENDER_VERSION,
+                    self.name,
+                    self.title,
+                    file_format,
+                    background_digest,
+                    [float(bound) for bound in extent],
+                    grid_shape(extent),
+                ]
+            ).encode("utf-8")
+        )
+        for array in (self.positions, self.markers):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        if self.dwell is not None:
+            digest.update(np.ascontiguousarray(self.dwell, dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on first use."""
+    import matplotlib
+
+    # Use 'Agg' backend for non-interactive environments
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def load_background(path: Path) -> Tuple[np.ndarray, str]:
+    """The decoded background image, and the digest of its file."""
+    path = Path(path)
+    return pyplot().imread(path), hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _xz(positions: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(positions[:, [0, 2]], dtype=np.float64)
+
+
+def _dwell(positions: ColumnTable, rows) -> Optional[np.ndarray]:
+    return positions["dwell"][rows] if "dwell" in positions.columns else None
+
+
+def user_figures(
+    store: SessionStore, user_indices: Sequence[int], markers: np.ndarray
+) -> List[Figure]:
+    positions = store.positions
+    return [
+        Figure(
+            name=f"user/{store.user_id[user_index]}",
+            title=f"User {store.user[user_index]} ({store.perspective[user_index]})",
+            positions=_xz(positions["position"][positions.user_slice(user_index)]),
+            markers=markers,
+            dwell=_dwell(positions, positions.user_slice(user_index)),
+        )
+        for user_index in user_indices
+    ]
+
+
+def banana_figures(
+    store: SessionStore,
+    user_indices: Sequence[int],
+    _bananas: Dict[int, Banana],
+    markers: np.ndarray,
+    approach_seconds: int = BANANA_APPROACH_SECONDS,
+) -> List[Figure]:
+    """Where the players were in the `approach_seconds` before each pickup of a banana."""
+    positions = store.positions
+    pickups = store.banana_pickups
+    pickup_rows = pickups.rows_for_users(user_indices)
+
+    approaches: Dict[int, List[np.ndarray]] = {banana_id: [] for banana_id in _bananas}
+    for user_index, banana_id, timestamp in zip(
+        pickups["user_index"][pickup_rows].tolist(),
+        pickups["banana_id"][pickup_rows].tolist(),
+        pickups["timestamp"][pickup_rows].tolist(),
+    ):
+        user_rows = positions.user_slice(user_index)
+        timestamps = positions["timestamp"][user_rows]
+        approaching = (timestamps >= timestamp - approach_seconds) & (
+            timestamps <= timestamp
+        )
+        approaches[banana_id].append(
+            np.arange(user_rows.start, user_rows.stop)[approaching]
+        )
+
+    figures = []
+    for banana_id in _bananas:
+        rows = np.concatenate(approaches[banana_id] or [np.empty(0, dtype=np.int64)])
+        figures.append(
+            Figure(
+                name=f"banana/{banana_id}",
+                title=(
+                    f"Banana {banana_id}: {approach_seconds}s before each of its "
+                    f"{len(approaches[banana_id])} pickups"
+                ),
+                positions=_xz(positions["position"][rows]),
+                markers=markers,
+                dwell=_dwell(positions, rows),
+            )
+        )
+    return figures
+
+
+def window_figures(
+    store: SessionStore,
+    user_indices: Sequence[int],
+    markers: np.ndarray,
+    window_minutes: float = DEFAULT_WINDOW_MINUTES,
+) -> List[Figure]:
+    """Positions of every user grouped by time since the start of their session."""
+    if window_minutes <= 0:
+        raise ValueError(f"The windows must last a positive time, got {window_minutes}")
+
+    positions = store.positions
+    rows = positions.rows_for_users(user_indices)
+
+    elapsed = (
+        positions["timestamp"][rows] - store.starttime[positions["user_index"][rows]]
+    )
+    # Logs from before the recorded start (clock changes) have no window
+    rows = rows[elapsed >= 0]
+    # Windows need not last whole seconds, a window starts at any fraction of one
+    windows = np.floor_divide(elapsed[elapsed >= 0], window_minutes * 60).astype(
+        np.int64
+    )
+
+    return [
+        Figure(
+            name=f"window/{window:03d}",
+            title=(
+                f"Minutes {window * window_minutes:g} to "
+                f"{(window + 1) * window_minutes:g} of the sessions"
+            ),
+            positions=_xz(positions["position"][rows[windows == window]]),
+            markers=markers,
+            dwell=_dwell(positions, rows[windows == window]),
+        )
+        for window in np.unique(windows).tolist()
+    ]
+
+
+def heatmap_figures(
+    store: SessionStore,
+    user_indices: Sequence[int],
+    kinds: Sequence[str],
+    _bananas: Dict[int, Banana],
+    window_minutes: float = DEFAULT_WINDOW_MINUTES,
+) -> List[Figure]:
+    """The figures of the given kinds (see FIGURE_KINDS) for the given users."""
+    markers = np.array(
+        [(banana.pos[0], banana.pos[2]) for banana in _bananas.values()],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+
+    figures = []
+    for kind in kinds:
+        if kind == "user":
+            figures += user_figures(store, user_indices, markers)
+        elif kind == "banana":
+            figures += banana_figures(store, user_indices, _bananas, markers)
+        elif kind == "window":
+            figures += window_figures(store, user_indices, markers, window_minutes)
+        else:
+            raise ValueError(f"Unknown figure kind {kind!r}")
+
+    return figures
+
+
+# Background image of a rendering process, set by _init_renderer
+_background = None
+
+
+def _init_renderer(background: np.ndarray):
+    # The background is pickled once per process, instead of once per figure
+    global _background
+    _background = background
+
+
+def _figure_density(figure: Figure, extent: Sequence[float]) -> Optional[np.ndarray]:
+    """The density grid drawn over the map, None when the figure has no positions."""
+    if len(figure.positions) == 0:
+        return None
+    # float32 is plenty to draw, and halves what is held and sent to the workers
+    return grid_density(
+        figure.positions, extent, weights=figure.dwell, frequency_weights=True
+    ).astype(np.float32)
+
+
+def _render_figure(
+    title: str,
+    markers: np.ndarray,
+    density: Optional[np.ndarray],
+    path: Path,
+    file_format: str,
+    extent: Sequence[float],
+):
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE)
+    ax.imshow(_background, origin="lower", extent=extent)
+
+    if density is None:
+        ax.set_title(f"{title} (No Data)")
+    else:
+        # Leave the map visible where (almost) nobody went
+        ax.imshow(
+            np.ma.masked_less_equal(
+                density, density.max() * HEATMAP_GRID_MASK_FRACTION
+            ),
+            origin="lower",
+            extent=extent,
+            cmap="Reds",
+            alpha=0.75,
+            interpolation="bilinear",
+        )
+        ax.set_title(title)
+
+    if len(markers) > 0:
+        ax.scatter(
+            markers[:, 0],
+            markers[:, 1],
+            c="yellow",
+            marker="*",
+            s=200,
+            label="Banana",
+            edgecolors="black",
+        )
+        ax.legend()
+
+    ax.set_xlabel("X Coordinate")
+    ax.set_ylabel("Z Coordinate")
+
+    # Written next to the destination and renamed, so a figure is never half written
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(f"{path.name}.partial")
+    if file_format == "npy":
+        fig.canvas.draw()
+        with open(partial_path, "wb") as array_file:
+            np.save(array_file, np.asarray(fig.canvas.buffer_rgba()))
+    else:
+        fig.savefig(partial_path, format=file_format)
+    plt.close(fig)
+    os.replace(partial_path, path)
+
+
+def render_figures(
+    figures: Sequence[Figure],
+    output_directory: Path,
+    background: np.ndarray,
+    background_digest: str,
+    extent: Sequence[float],
+    file_format: str = "png",
+    workers: int = 1,
+) -> Tuple[int, int]:
+    """Render the figures whose inputs changed since they were last rendered.
+
+    Figures are written to `output_directory`/<figure name>.<file_format>; returns the
+    number of figures (rendered, unchanged).
+    """
+    if file_format not in FIGURE_FORMATS:
+        raise ValueError(f"Unknown figure format {file_format}")
+
+    output_directory = Path(output_directory)
+    manifest_path = output_directory / MANIFEST_NAME
+    manifest: Dict[str, str] = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+
+    stale: List[Figure] = []
+    paths: List[Path] = []
+    for figure in figures:
+        file_name = f"{figure.name}.{file_format}"
+        digest = figure.digest(background_digest, file_format, extent)
+        if (
+            manifest.get(file_name) == digest
+            and (output_directory / file_name).exists()
+        ):
+            continue
+
+        stale.append(figure)
+        paths.append(output_directory / file_name)
+        manifest[file_name] = digest
+
+    # Each grid is computed once, here: the workers only draw them
+    densities = [_figure_density(figure, extent) for figure in stale]
+    titles = [figure.title for figure in stale]
+    markers = [figure.markers for figure in stale]
+
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_renderer, initargs=(background,)
+        ) as executor:
+            list(
+                executor.map(
+                    _render_figure,
+                    titles,
+                    markers,
+                    densities,
+                    paths,
+                    repeat(file_format),
+                    repeat(extent),
+                    chunksize=max(len(stale) // (workers * 4), 1),
+                )
+            )
+    else:
+        _init_renderer(background)
+        for arguments in zip(titles, markers, densities, paths):
+            _render_figure(*arguments, file_format, extent)
+
+    output_directory.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(manifest, indent=4), encoding="utf-8")
+
+    return len(stale), len(figures) - len(stale)
@@ -0,0 +1,217 @@
+"""Spatiotemporal index over the parsed positions, for radius, box and time window queries.
+
+Positions are bucketed on a uniform grid over (x, z), with the rows of every cell stored
+contiguously, so an area query only reads the cells it overlaps. The rows of every user
+are also kept sorted by time, so a time window is two binary searches per user.
+
+    index = PositionIndex(store)
+    # Who passed within 10 units of banana 4 in the first 3 minutes of their session
+    rows = index.within(study.bananas[4].pos, 10, start=0, end=3 * 60, since_start=True)
+    store.user[index.users(rows)]
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+from store import SessionStore
+
+# Side of a grid cell, in world units. The map is about 265 units wide, so the
+# grid has a few thousand cells
+DEFAULT_CELL_SIZE = 4.0
+
+
+def _concatenate_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """np.concatenate([np.arange(start, end) for ...]) without the Python loop."""
+    lengths = np.maximum(ends - starts, 0)
+    total = int(lengths.sum())
+    run_ends = np.cumsum(lengths)
+    return np.repeat(starts - (run_ends - lengths), lengths) + np.arange(total)
+
+
+class PositionIndex:
+    """Grid over the (x, z) positions of a store, and per-user time order.
+
+    Queries return row numbers of `store.positions`, in increasing order. Time bounds
+    are epoch seconds, or seconds since the start of each session with
+    `since_start=True`; windows include `start` and exclude `end`.
+    """
+
+    def __init__(self, store: SessionStore, cell_size: float = DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError(f"The cell size must be positive, got {cell_size}")
+
+        positions = store.positions
+        self.cell_size = float(cell_size)
+        self.user_index = positions["user_index"]
+        self.timestamp = positions["timestamp"]
+        self.xz = np.ascontiguousarray(positions["position"][:, [0, 2]])
+        self.starttime = store.starttime
+
+        # Cells are numbered row-major over (x, z), so the cells of a box are a few
+        # contiguous runs: one per column of x
+        if len(self.xz) > 0:
+            self.origin = self.xz.min(axis=0)
+            self.shape = (self._cell_coordinates(self.xz.max(axis=0)) + 1).astype(
+                np.int64
+            )
+        else:
+            self.origin = np.zeros(2)
+            self.shape = np.ones(2, dtype=np.int64)
+
+        coordinates = self._cell_coordinates(self.xz)
+        cells = coordinates[:, 0] * self.shape[1] + coordinates[:, 1]
+        self.cell_rows = np.argsort(cells, kind="stable")
+        self.cell_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(cells, minlength=int(np.prod(self.shape))))]
+        ).astype(np.int64)
+
+        # Every user's rows, sorted by time (they usually already are). The sort keys
+        # number the seconds of every user after the previous user's, so the windows of
+        # all the users are found with a single binary search
+        self.user_offsets = positions.offsets
+        self.time_rows = np.lexsort((self.timestamp, self.user_index))
+        self.time_ordered = bool(
+            np.array_equal(self.time_rows, np.arange(len(self.time_rows)))
+        )
+        self.first_timestamp = int(self.timestamp.min()) if len(self.timestamp) else 0
+        self.timestamp_span = (
+            int(self.timestamp.max()) - self.first_timestamp + 2
+            if len(self.timestamp)
+            else 1
+        )
+        self.time_keys = self._time_keys(
+            self.user_index[self.time_rows], self.timestamp[self.time_rows]
+        )
+
+    def _cell_coordinates(self, xz: np.ndarray) -> np.ndarray:
+        return np.floor((np.asarray(xz) - self.origin) / self.cell_size).astype(
+            np.int64
+        )
+
+    def _time_keys(
+        self, user_indices: np.ndarray, timestamps: np.ndarray
+    ) -> np.ndarray:
+        # Times out of the logged range are clipped to just before or after it
+        seconds = np.clip(
+            np.asarray(timestamps) - self.first_timestamp, -1, self.timestamp_span - 1
+        )
+        return user_indices * (self.timestamp_span + 1) + seconds + 1
+
+    def _box_candidates(
+        self, x_min: float, x_max: float, z_min: float, z_max: float
+    ) -> np.ndarray:
+        # Clip the box to the grid, nothing was logged outside of it
+        low = np.maximum(self._cell_coordinates((x_min, z_min)), 0)
+        high = np.minimum(self._cell_coordinates((x_max, z_max)), self.shape - 1)
+        if np.any(low > high):
+            return np.empty(0, dtype=np.int64)
+
+        columns = np.arange(low[0], high[0] + 1) * self.shape[1]
+        return self.cell_rows[
+            _concatenate_ranges(
+                self.cell_offsets[columns + low[1]],
+                self.cell_offsets[columns + high[1] + 1],
+            )
+        ]
+
+    def _filter(
+        self,
+        rows: np.ndarray,
+        start: Optional[float],
+        end: Optional[float],
+        since_start: bool,
+        user_indices: Optional[Sequence[int]],
+    ) -> np.ndarray:
+        if start is not None or end is not None:
+            times = self.timestamp[rows]
+            if since_start:
+                times = times - self.starttime[self.user_index[rows]]
+            if start is not None:
+                rows = rows[times >= start]
+                times = times[times >= start]
+            if end is not None:
+                rows = rows[times < end]
+
+        if user_indices is not None:
+            rows = rows[np.isin(self.user_index[rows], user_indices)]
+
+        return np.sort(rows)
+
+    def in_box(
+        self,
+        x_min: float,
+        x_max: float,
+        z_min: float,
+        z_max: float,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        since_start: bool = False,
+        user_indices: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """Rows positioned in the box (bounds included), optionally in a time window."""
+        rows = self._box_candidates(x_min, x_max, z_min, z_max)
+        xz = self.xz[rows]
+        rows = rows[
+            (xz[:, 0] >= x_min)
+            & (xz[:, 0] <= x_max)
+            & (xz[:, 1] >= z_min)
+            & (xz[:, 1] <= z_max)
+        ]
+        return self._filter(rows, start, end, since_start, user_indices)
+
+    def within(
+        self,
+        center: Sequence[float],
+        radius: float,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        since_start: bool = False,
+        user_indices: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """Rows within `radius` (on the map, ignoring y) of `center`.
+
+        `center` is an (x, z) point, or an (x, y, z) position such as Banana.pos.
+        """
+        x, z = (center[0], center[2]) if len(center) == 3 else center
+        rows = self._box_candidates(x - radius, x + radius, z - radius, z + radius)
+
+        deltas = self.xz[rows] - (x, z)
+        rows = rows[
+            deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1] <= radius * radius
+        ]
+        return self._filter(rows, start, end, since_start, user_indices)
+
+    def during(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        since_start: bool = False,
+        user_indices: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """Rows logged in the time window, anywhere on the map."""
+        if user_indices is None:
+            user_indices = np.arange(len(self.user_offsets) - 1)
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+
+        shifts = self.starttime[user_indices] if since_start else 0
+        lows = self.user_offsets[user_indices]
+        highs = self.user_offsets[user_indices + 1]
+        if start is not None:
+            lows = np.searchsorted(
+                self.time_keys, self._time_keys(user_indices, shifts + start)
+            )
+        if end is not None:
+            highs = np.searchsorted(
+                self.time_keys, self._time_keys(user_indices, shifts + end)
+            )
+
+        rows = self.time_rows[_concatenate_ranges(lows, highs)]
+        if self.time_ordered and np.all(user_indices[1:] > user_indices[:-1]):
+            # Already in increasing order, as the time order is the row order
+            return rows
+        return np.sort(rows)
+
+    def users(self, rows: np.ndarray) -> np.ndarray:
+        """Store indices of the users the rows belong to, in store order."""
+        return np.unique(self.user_index[rows])
@@ -0,0 +1,319 @@
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from decoders import decode_timestamps
+
+# Column layout of every per-session table: name -> (dtype, trailing shape).
+# Every table additionally carries `user_index` (row in the store) and `user_id`.
+# Timestamps are int64 seconds since the epoch, see decoders.decode_timestamps.
+TABLE_SCHEMAS: Dict[str, Dict[str, tuple]] = {
+    "positions": {
+        "timestamp": (np.int64, ()),
+        "position": (np.float64, (3,)),
+        "rotation": (np.float64, (4,)),
+        "rotation_euler": (np.float64, (2,)),
+        "pos_delta": (np.float64, ()),
+        "rot_delta": (np.float64, ()),
+        "path_distance": (np.float64, ()),
+        "jumping": (np.bool_, ()),
+        "running": (np.bool_, ()),
+    },
+    "banana_pickups": {
+        "timestamp": (np.int64, ()),
+        "banana_id": (np.int64, ()),
+    },
+    "roi_visits": {
+        "timestamp": (np.int64, ()),
+        "roi_name": (object, ()),
+    },
+    "curiosity": {
+        "timestamp": (np.int64, ()),
+        "curiosity": (np.float64, ()),
+    },
+}
+
+# How multi-dimensional columns are flattened when converting to a DataFrame
+FLAT_COLUMN_NAMES: Dict[str, List[str]] = {
+    "position": ["x", "y", "z"],
+    "rotation": ["qx", "qy", "qz", "qw"],
+    "rotation_euler": ["euler_x", "euler_y"],
+}
+
+
+@dataclass(frozen=True, slots=True)
+class ColumnTable:
+    """Struct-of-arrays table whose rows are grouped by user.
+
+    The rows of the user stored at index `i` are `offsets[i]:offsets[i + 1]`.
+    """
+
+    columns: Dict[str, np.ndarray]
+    offsets: np.ndarray  # (n_users + 1,) int64
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def user_slice(self, user_index: int) -> slice:
+        return slice(int(self.offsets[user_index]), int(self.offsets[user_index + 1]))
+
+    def for_user(self, user_index: int) -> Dict[str, np.ndarray]:
+        rows = self.user_slice(user_index)
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def rows_for_users(self, user_indices: Sequence[int]) -> np.ndarray:
+        """Row numbers of the given users, in the order the users are given."""
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+        starts = self.offsets[user_indices]
+        lengths = self.offsets[user_indices + 1] - starts
+        ends = np.cumsum(lengths)
+        return np.repeat(starts - (ends - lengths), lengths) + np.arange(
+            ends[-1] if len(ends) else 0
+        )
+
+    def to_frame(self, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        data = {}
+        for name, column in self.columns.items():
+            if rows is not None:
+                column = column[rows]
+
+            if column.ndim == 2:
+                for i, flat_name in enumerate(FLAT_COLUMN_NAMES[name]):
+                    data[flat_name] = column[:, i]
+            else:
+                data[name] = column
+
+        return pd.DataFrame(data)
+
+
+@dataclass(frozen=True, slots=True)
+class SessionStore:
+    """Columnar container for the parsed sessions of a set of users."""
+
+    # Per-user metadata, one entry per user in store order
+    user_id: np.ndarray
+    user: np.ndarray
+    perspective: np.ndarray
+    starttime: np.ndarray  # int64 epoch seconds
+    endtime: np.ndarray  # int64 epoch seconds, MISSING_TIMESTAMP if unknown
+
+    positions: ColumnTable
+    banana_pickups: ColumnTable
+    roi_visits: ColumnTable
+    curiosity: ColumnTable
+
+    # Number of raw logs seen per logtype, and how many of them could not be decoded
+    log_counts: Dict[str, int] = field(default_factory=dict)
+    rejected_counts: Dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.user_id)
+
+    def user_index(self, user_id: int) -> int:
+        return int(np.flatnonzero(self.user_id == user_id)[0])
+
+    def user_tables(self, user_index: int) -> Dict[str, Dict[str, np.ndarray]]:
+        """The rows of one user in every table, without the user columns."""
+        return {
+            table: {
+                name: column
+                for name, column in getattr(self, table).for_user(user_index).items()
+                if name not in ("user_index", "user_id")
+            }
+            for table in TABLE_SCHEMAS
+        }
+
+    def user_indices(self, user_ids: Sequence[int]) -> np.ndarray:
+        lookup = {_user_id: i for i, _user_id in enumerate(self.user_id.tolist())}
+        return np.array([lookup[_user_id] for _user_id in user_ids], dtype=np.int64)
+
+
+class SessionStoreBuilder:
+    """Collects per-user column chunks and concatenates them once into a SessionStore.
+
+    Chunks must be appended in user order (all of a user's rows before the next user's).
+    """
+
+    def __init__(self):
+        self._users: List[tuple] = []
+        self._chunks: Dict[str, List[Dict[str, np.ndarray]]] = {
+            table: [] for table in TABLE_SCHEMAS
+        }
+        self._log_counts = Counter()
+        self._rejected_counts = Counter()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add_user(
+        self,
+        user_id: int,
+        user: str,
+        perspective: str,
+        starttime: str,
+        endtime: Optional[str],
+    ) -> int:
+        self._users.append((user_id, user, perspective, starttime, endtime))
+        return len(self._users) - 1
+
+    def set_endtime(self, user_index: int, endtime: str):
+        self._users[user_index] = (*self._users[user_index][:4], endtime)
+
+    def count_logs(self, counts: Dict[str, int]):
+        self._log_counts.update({logtype: n for logtype, n in counts.items() if n > 0})
+
+    def count_rejected(self, logtype: str, count: int):
+        if count > 0:
+            self._rejected_counts[logtype] += count
+
+    def append(self, table: str, user_index: int, **columns: np.ndarray):
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Columns of a {table} chunk differ in length: {lengths}")
+
+        (length,) = lengths
+        if length == 0:
+            return
+
+        user_id = self._users[user_index][0]
+        self._chunks[table].append(
+            {
+                "user_index": np.full(length, user_index, dtype=np.int64),
+                "user_id": np.full(length, user_id, dtype=np.int64),
+                **columns,
+            }
+        )
+
+    def append_user_tables(
+        self, user_index: int, tables: Dict[str, Dict[str, np.ndarray]]
+    ):
+        for table, columns in tables.items():
+            self.append(table, user_index, **columns)
+
+    def _build_table(self, table: str) -> ColumnTable:
+        schema = {
+            "user_index": (np.int64, ()),
+            "user_id": (np.int64, ()),
+            **TABLE_SCHEMAS[table],
+        }
+        chunks = self._chunks[table]
+
+        columns = {}
+        for name, (dtype, shape) in schema.items():
+            if chunks:
+                columns[name] = np.concatenate(
+                    [np.asarray(chunk[name], dtype=dtype) for chunk in chunks]
+                )
+            else:
+                columns[name] = np.empty((0, *shape), dtype=dtype)
+
+        user_index = columns["user_index"]
+        if np.any(user_index[1:] < user_index[:-1]):
+            raise ValueError(f"{table} chunks were not appended in user order")
+
+        counts = np.bincount(user_index, minlength=len(self._users))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return ColumnTable(columns=columns, offsets=offsets)
+
+    def build(self) -> SessionStore:
+        users = list(zip(*self._users)) if self._users else [()] * 5
+        user_id, user, perspective, starttime, endtime = users
+
+        return SessionStore(
+            user_id=np.array(user_id, dtype=np.int64),
+            user=np.array(user, dtype=object),
+            perspective=np.array(perspective, dtype=object),
+            # Session times are added as strings, and all decoded at once
+            starttime=decode_timestamps(starttime),
+            endtime=decode_timestamps(endtime),
+            **{table: self._build_table(table) for table in TABLE_SCHEMAS},
+            log_counts=dict(self._log_counts),
+            rejected_counts=dict(self._rejected_counts),
+        )
+
+
+def concat_stores(stores: Sequence[SessionStore]) -> SessionStore:
+    """Concatenate stores of disjoint users, keeping the given order of stores."""
+    if len(stores) == 0:
+        return SessionStoreBuilder().build()
+
+    user_shifts = np.cumsum([0] + [len(store) for store in stores[:-1]])
+
+    def concat_table(table: str) -> ColumnTable:
+        parts = [getattr(store, table) for store in stores]
+        row_shifts = np.cumsum([0] + [len(part) for part in parts[:-1]])
+
+        columns = {}
+        for name in parts[0].columns:
+            if name == "user_index":
+                columns[name] = np.concatenate(
+                    [
+                        part[name] + user_shift
+                        for part, user_shift in zip(parts, user_shifts)
+                    ]
+                )
+            else:
+                columns[name] = np.concatenate([part[name] for part in parts])
+
+        offsets = np.concatenate(
+            [[0]]
+            + [
+                part.offsets[1:] + row_shift
+                for part, row_shift in zip(parts, row_shifts)
+            ]
+        ).astype(np.int64)
+
+        return ColumnTable(columns=columns, offsets=offsets)
+
+    return SessionStore(
+        user_id=np.concatenate([store.user_id for store in stores]),
+        user=np.concatenate([store.user for store in stores]),
+        perspective=np.concatenate([store.perspective for store in stores]),
+        starttime=np.concatenate([store.starttime for store in stores]),
+        endtime=np.concatenate([store.endtime for store in stores]),
+        **{table: concat_table(table) for table in TABLE_SCHEMAS},
+        log_counts=dict(
+            sum((Counter(store.log_counts) for store in stores), Counter())
+        ),
+        rejected_counts=dict(
+            sum((Counter(store.rejected_counts) for store in stores), Counter())
+        ),
+    )
+
+
+def take_users(store: SessionStore, user_indices: Sequence[int]) -> SessionStore:
+    """The store with only the given users, in the order they are given."""
+    user_indices = np.asarray(user_indices, dtype=np.int64)
+    new_indices = np.empty(len(store), dtype=np.int64)
+    new_indices[user_indices] = np.arange(len(user_indices))
+
+    def take_table(table: str) -> ColumnTable:
+        part = getattr(store, table)
+        rows = part.rows_for_users(user_indices)
+        columns = {name: column[rows] for name, column in part.columns.items()}
+        columns["user_index"] = new_indices[columns["user_index"]]
+        counts = part.counts()[user_indices]
+        return ColumnTable(
+            columns=columns,
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        )
+
+    return replace(
+        store,
+        user_id=store.user_id[user_indices],
+        user=store.user[user_indices],
+        perspective=store.perspective[user_indices],
+        starttime=store.starttime[user_indices],
+        endtime=store.endtime[user_indices],
+        **{table: take_table(table) for table in TABLE_SCHEMAS},
+    )
@@ -0,0 +1,146 @@
+import datetime
+import tomllib
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import ColumnElement, Integer, Select, case, cast, func, or_, select
+
+from collectibles import BANANA_OFFSETS, Banana, BananaIndex, place_bananas
+from decoders import USER_TIMESTAMP_FORMAT
+from models import Userdata
+
+# The survey the analytics were written for, see studies/survey.toml
+DEFAULT_STUDY_PATH = Path(__file__).resolve().parent.parent / "studies" / "survey.toml"
+
+DEFAULT_MINIMUM_DURATION_MINUTES = 5
+
+STUDY_KEYS = (
+    "name",
+    "cohort",
+    "endtime_overrides",
+    "collectibles",
+    "minimum_duration_minutes",
+    "perspectives",
+)
+
+
+@dataclass(frozen=True)
+class Study:
+    """Which sessions a study covers, and the parameters its stats are computed with."""
+
+    name: str
+    # Usernames of the participants, None for every session in the database
+    cohort: Optional[Tuple[str, ...]] = None
+    # End times noted down for sessions without a recorded one
+    endtime_overrides: Mapping[str, datetime.datetime] = field(default_factory=dict)
+    # Offsets of the collectibles from Banana.BASE_POSITION
+    collectibles: Tuple[Tuple[float, float, float], ...] = BANANA_OFFSETS
+    minimum_duration_minutes: float = DEFAULT_MINIMUM_DURATION_MINUTES
+    # Uppercase perspectives kept, None for all of them
+    perspectives: Optional[Tuple[str, ...]] = None
+
+    @cached_property
+    def bananas(self) -> Dict[int, Banana]:
+        return place_bananas(self.collectibles)
+
+    @cached_property
+    def banana_index(self) -> BananaIndex:
+        return BananaIndex(self.bananas)
+
+    def user_filters(self) -> List[ColumnElement[bool]]:
+        """The study's cohort, perspective and duration filters as SQL conditions.
+
+        Sessions are only filtered on their duration when it is known without their logs
+        (a recorded or noted down end time). The others are kept and filtered once
+        parsed, so the result is the same as filtering everything after parsing.
+        """
+        filters = []
+        if self.cohort is not None:
+            filters.append(Userdata.user.in_(self.cohort))
+        if self.perspectives is not None:
+            filters.append(func.upper(Userdata.perspective).in_(self.perspectives))
+
+        endtime = Userdata.endtime
+        if self.endtime_overrides:
+            endtime = func.coalesce(
+                Userdata.endtime,
+                case(
+                    {
+                        username: override.strftime(USER_TIMESTAMP_FORMAT)
+                        for username, override in self.endtime_overrides.items()
+                    },
+                    value=Userdata.user,
+                ),
+            )
+
+        def seconds(timestamp: ColumnElement) -> ColumnElement[int]:
+            return cast(func.strftime("%s", timestamp), Integer)
+
+        # Same as session_durations: the hours are removed, and SQLite's modulo keeps
+        # the sign of the dividend, unlike Python's
+        hour = 60 * 60
+        duration = (
+            (seconds(endtime) - seconds(Userdata.starttime)) % hour + hour
+        ) % hour
+        filters.append(
+            or_(duration.is_(None), duration >= self.minimum_duration_minutes * 60)
+        )
+
+        return filters
+
+    def users_query(self) -> Select:
+        return select(Userdata).where(*self.user_filters()).order_by(Userdata.id)
+
+
+def _positions(value: Sequence[Sequence[float]], path: Path) -> tuple:
+    if any(len(position) != 3 for position in value):
+        raise ValueError(f"{path}: collectibles must be [x, y, z] offsets")
+    return tuple(
+        tuple(float(coordinate) for coordinate in position) for position in value
+    )
+
+
+def load_study(path: Path) -> Study:
+    """Read a study definition from a TOML file, see studies/survey.toml."""
+    path = Path(path)
+    with open(path, "rb") as study_file:
+        definition = tomllib.load(study_file)
+
+    unknown_keys = set(definition) - set(STUDY_KEYS)
+    if unknown_keys:
+        raise ValueError(f"{path}: unknown study keys {sorted(unknown_keys)}")
+
+    endtime_overrides = definition.get("endtime_overrides", {})
+    for username, endtime in endtime_overrides.items():
+        if not isinstance(endtime, datetime.datetime):
+            raise ValueError(f"{path}: end time of {username} is not a date-time")
+
+    cohort = definition.get("cohort")
+    perspectives = definition.get("perspectives")
+
+    return Study(
+        name=definition.get("name", path.stem),
+        cohort=tuple(cohort) if cohort is not None else None,
+        endtime_overrides=endtime_overrides,
+        collectibles=_positions(definition.get("collectibles", BANANA_OFFSETS), path),
+        minimum_duration_minutes=definition.get(
+            "minimum_duration_minutes", DEFAULT_MINIMUM_DURATION_MINUTES
+        ),
+        perspectives=(
+            tuple(perspective.upper() for perspective in perspectives)
+            if perspectives is not None
+            else None
+        ),
+    )
+
+
+def load_studies(paths: Sequence[Path]) -> List[Study]:
+    studies = [load_study(path) for path in paths]
+
+    names = [study.name for study in studies]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Study names must be unique, got {names}")
+
+    return studies
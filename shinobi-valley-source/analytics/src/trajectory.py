@@ -0,0 +1,210 @@
+import os
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from decoders import MISSING_TIMESTAMP
+from store import SessionStore
+
+# Layout of a trajectory file, all little-endian:
+#   header   HEADER_DTYPE, once
+#   users    USER_DTYPE, one per user in store order (the per-user offset index)
+#   samples  SAMPLE_DTYPE, one per logged position, grouped by user in store order
+TRAJECTORY_MAGIC = b"SVTRAJ"
+TRAJECTORY_VERSION = 2
+
+# time_offset of the samples logged without a (decodable) timestamp
+MISSING_TIME_OFFSET = np.iinfo(np.uint32).max
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S6"),
+        ("version", "<u2"),
+        ("user_count", "<u4"),
+        ("sample_count", "<u8"),
+    ]
+)
+
+USER_DTYPE = np.dtype(
+    [
+        ("user_id", "<i8"),
+        ("perspective", "S16"),
+        # Samples are timed in seconds since this epoch (the user's first sample)
+        ("epoch_seconds", "<i8"),
+        ("first_sample", "<u8"),
+        ("sample_count", "<u8"),
+    ]
+)
+
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("xyz", "<f4", (3,)),
+        ("user_index", "<u4"),
+        ("time_offset", "<u4"),
+    ]
+)
+
+
+def write_trajectories(store: SessionStore, path: Path):
+    """Write the logged positions of every user in the store to a trajectory file."""
+    positions = store.positions
+    user_indices = positions["user_index"]
+    counts = positions.counts()
+
+    seconds = positions["timestamp"]
+    missing = seconds == MISSING_TIMESTAMP
+    # Logs are not always in timestamp order, so offsets start at each user's earliest
+    # known timestamp (0 for the users without any)
+    known = np.where(missing, np.iinfo(np.int64).max, seconds)
+    epochs = np.zeros(len(store), dtype=np.int64)
+    has_samples = counts > 0
+    epochs[has_samples] = np.minimum.reduceat(
+        known, positions.offsets[:-1][has_samples]
+    )
+    epochs[epochs == np.iinfo(np.int64).max] = 0
+
+    sample_epochs = epochs[user_indices]
+    time_offsets = np.where(missing, sample_epochs, seconds) - sample_epochs
+    if np.any(time_offsets >= MISSING_TIME_OFFSET):
+        raise ValueError(
+            f"The positions of a user span more than {MISSING_TIME_OFFSET} seconds, "
+            "they cannot be written to a trajectory file"
+        )
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = TRAJECTORY_MAGIC
+    header["version"] = TRAJECTORY_VERSION
+    header["user_count"] = len(store)
+    header["sample_count"] = len(positions)
+
+    users = np.zeros(len(store), dtype=USER_DTYPE)
+    users["user_id"] = store.user_id
+    users["perspective"] = [
+        (perspective or "").encode("ascii") for perspective in store.perspective
+    ]
+    users["epoch_seconds"] = epochs
+    users["first_sample"] = positions.offsets[:-1]
+    users["sample_count"] = counts
+
+    samples = np.empty(len(positions), dtype=SAMPLE_DTYPE)
+    samples["xyz"] = positions["position"]
+    samples["user_index"] = user_indices
+    samples["time_offset"] = np.where(missing, MISSING_TIME_OFFSET, time_offsets)
+
+    # Written next to the destination and renamed, so readers never see a partial file
+    path = Path(path)
+    partial_path = path.with_name(f"{path.name}.partial")
+    with open(partial_path, "wb") as trajectory_file:
+        header.tofile(trajectory_file)
+        users.tofile(trajectory_file)
+        samples.tofile(trajectory_file)
+    os.replace(partial_path, path)
+
+
+class TrajectoryFile:
+    """Read-only, memory-mapped view of a trajectory file.
+
+    Only the header and the user index are read when opening; samples are paged in
+    by the OS as slices of them are accessed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+        header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)
+        if (
+            len(header) == 0
+            or header["magic"][0] != TRAJECTORY_MAGIC
+            or header["version"][0] != TRAJECTORY_VERSION
+        ):
+            raise ValueError(
+                f"{self.path} is not a version {TRAJECTORY_VERSION} trajectory file"
+            )
+
+        user_count = int(header["user_count"][0])
+        sample_count = int(header["sample_count"][0])
+
+        self.users = np.fromfile(
+            self.path,
+            dtype=USER_DTYPE,
+            count=user_count,
+            offset=HEADER_DTYPE.itemsize,
+        )
+        samples_offset = HEADER_DTYPE.itemsize + user_count * USER_DTYPE.itemsize
+        self.samples = (
+            np.memmap(
+                self.path,
+                dtype=SAMPLE_DTYPE,
+                mode="r",
+                offset=samples_offset,
+                shape=(sample_count,),
+            )
+            if sample_count > 0
+            else np.empty(0, dtype=SAMPLE_DTYPE)
+        )
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def user_slice(self, user_index: int) -> slice:
+        first = int(self.users["first_sample"][user_index])
+        return slice(first, first + int(self.users["sample_count"][user_index]))
+
+    def rows_for_users(self, user_indices: Sequence[int]) -> np.ndarray:
+        """Sample rows of the given users, in the order the users are given."""
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+        starts = self.users["first_sample"][user_indices].astype(np.int64)
+        lengths = self.users["sample_count"][user_indices].astype(np.int64)
+        ends = np.cumsum(lengths)
+        return np.repeat(starts - (ends - lengths), lengths) + np.arange(
+            ends[-1] if len(ends) else 0
+        )
+
+    def trajectory(self, user_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(timestamps, positions) of one user, in log order, e.g. for a replay.
+
+        Positions logged without a timestamp are timed NaT.
+        """
+        samples = self.samples[self.user_slice(user_index)]
+        time_offsets = samples["time_offset"]
+        timestamps = (
+            self.users["epoch_seconds"][user_index] + time_offsets.astype(np.int64)
+        ).astype("datetime64[s]")
+        timestamps[time_offsets == MISSING_TIME_OFFSET] = np.datetime64("NaT")
+        return timestamps, np.asarray(samples["xyz"])
+
+    def path_lengths(self) -> np.ndarray:
+        """Distance travelled by every user, summed over consecutive logged positions.
+
+        Read a user at a time from the mapped file, so only one user's positions are
+        held (as float64) at once.
+        """
+        lengths = np.zeros(len(self))
+        for user_index in range(len(self)):
+            xyz = np.asarray(
+                self.samples["xyz"][self.user_slice(user_index)], dtype=np.float64
+            )
+            lengths[user_index] = np.linalg.norm(np.diff(xyz, axis=0), axis=1).sum()
+        return lengths
+
+    def positions_per_perspective(
+        self, user_indices: Sequence[int]
+    ) -> Dict[str, np.ndarray]:
+        """The logged positions of the given users grouped by (uppercase) perspective,
+        like associate_perspectives does from an in-memory store."""
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+        perspectives = np.char.upper(
+            self.users["perspective"][user_indices].astype(str)
+        )
+
+        positions_per_perspective = {}
+        for perspective in dict.fromkeys(perspectives.tolist()):
+            if perspective == "":
+                continue
+            rows = self.rows_for_users(user_indices[perspectives == perspective])
+            positions_per_perspective[perspective] = np.asarray(
+                self.samples["xyz"][rows], dtype=np.float64
+            )
+
+        return positions_per_perspective
@@ -0,0 +1,40 @@
+"""Helpers shared by the tests: the source and benchmark directories are importable
+once this module is."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from models import Userdata  # noqa: E402
+from process import parse_sessions  # noqa: E402
+from store import TABLE_SCHEMAS, SessionStore  # noqa: E402
+from study import Study  # noqa: E402
+
+
+def parse(db_path: Path, stream: bool, chunk_size: int = 97) -> SessionStore:
+    """Every session of a database, with the bananas placed in the game."""
+    with Session(create_engine(f"sqlite:///{db_path}", echo=False)) as session:
+        users = session.execute(select(Userdata).order_by(Userdata.id)).scalars().all()
+        return parse_sessions(
+            session, users, Study(name="test"), stream=stream, chunk_size=chunk_size
+        )
+
+
+def assert_same_store(actual: SessionStore, expected: SessionStore):
+    np.testing.assert_array_equal(actual.user_id, expected.user_id)
+    np.testing.assert_array_equal(actual.endtime, expected.endtime)
+    for table in TABLE_SCHEMAS:
+        actual_table, expected_table = getattr(actual, table), getattr(expected, table)
+        np.testing.assert_array_equal(actual_table.offsets, expected_table.offsets)
+        for name, column in expected_table.columns.items():
+            np.testing.assert_array_equal(
+                actual_table[name], column, err_msg=f"{table}.{name}"
+            )
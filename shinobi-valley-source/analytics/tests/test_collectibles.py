@@ -0,0 +1,57 @@
+"""The KD-tree attributes positions to the same bananas as checking every banana."""
+
+import unittest
+
+import numpy as np
+
+import support  # noqa: F401
+from collectibles import (  # noqa: E402
+    BANANA_OFFSETS,
+    BananaIndex,
+    allowed_distance_squared,
+    place_bananas,
+)
+
+
+def first_close_banana(bananas: dict, position: tuple, max_distance_sq: float) -> int:
+    for banana_id, banana in bananas.items():
+        if banana.close(position, max_distance_sq):
+            return banana_id
+    return -1
+
+
+class BananaIndexTest(unittest.TestCase):
+    def test_matches_linear_scan(self):
+        bananas = place_bananas(BANANA_OFFSETS)
+        max_distance_sq = allowed_distance_squared(bananas)
+        rng = np.random.default_rng(0)
+
+        banana_positions = np.array([banana.pos for banana in bananas.values()])
+        positions = np.concatenate(
+            [
+                # Around the bananas, inside and outside of the allowed distance
+                np.repeat(banana_positions, 200, axis=0)
+                + rng.normal(0.0, np.sqrt(max_distance_sq), size=(1800, 3)),
+                # Exactly on the bananas, and anywhere on the map
+                banana_positions,
+                rng.uniform(-140.0, 140.0, size=(1000, 3)),
+            ]
+        )
+
+        expected = [
+            first_close_banana(bananas, tuple(position), max_distance_sq)
+            for position in positions.tolist()
+        ]
+        actual = BananaIndex(bananas).close(positions)
+
+        np.testing.assert_array_equal(actual, expected)
+        # Both outcomes are covered
+        self.assertTrue(np.any(actual == -1) and np.any(actual > 0))
+
+    def test_no_positions_or_bananas(self):
+        self.assertEqual(len(BananaIndex(place_bananas(BANANA_OFFSETS)).close([])), 0)
+        np.testing.assert_array_equal(BananaIndex({}).close(np.zeros((2, 3))), [-1, -1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""The chunked resampling gives the ratios of a resample-by-resample computation."""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import support  # noqa: F401
+import comparison  # noqa: E402
+from comparison import (  # noqa: E402
+    bootstrap_ratios,
+    compare_groups,
+    permutation_differences,
+)
+
+USERS = 37
+RESAMPLES = 50
+
+
+def metrics(seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    numerators = rng.gamma(2.0, 3.0, size=(USERS, 3))
+    denominators = np.column_stack(
+        [np.ones(USERS), rng.integers(1, 20, size=USERS), rng.integers(0, 2, USERS)]
+    ).astype(np.float64)
+    return numerators, denominators
+
+
+def chunk_rngs(seed: np.random.SeedSequence, sizes: list) -> list:
+    return [
+        (np.random.default_rng(stream), size)
+        for stream, size in zip(seed.spawn(len(sizes)), sizes)
+    ]
+
+
+# Small chunks, so the resamples are spread over several of them
+@mock.patch.object(comparison, "CHUNK_RESAMPLES", 16)
+class ResamplingTest(unittest.TestCase):
+    def test_bootstrap_matches_resample_by_resample(self):
+        numerators, denominators = metrics()
+        actual = bootstrap_ratios(
+            numerators, denominators, RESAMPLES, np.random.SeedSequence(1)
+        )
+
+        expected = []
+        for rng, size in chunk_rngs(np.random.SeedSequence(1), [16, 16, 16, 2]):
+            for users in rng.integers(0, USERS, size=(size, USERS)):
+                with np.errstate(invalid="ignore"):
+                    expected.append(
+                        numerators[users].sum(axis=0) / denominators[users].sum(axis=0)
+                    )
+
+        np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+    def test_permutation_matches_resample_by_resample(self):
+        numerators, denominators = metrics()
+        labels = np.arange(USERS) % 3 == 0
+        actual = permutation_differences(
+            numerators, denominators, labels, RESAMPLES, np.random.SeedSequence(2)
+        )
+
+        expected = []
+        for rng, size in chunk_rngs(np.random.SeedSequence(2), [16, 16, 16, 2]):
+            for first in rng.permuted(np.broadcast_to(labels, (size, USERS)), axis=1):
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    expected.append(
+                        numerators[first].sum(axis=0) / denominators[first].sum(axis=0)
+                        - numerators[~first].sum(axis=0)
+                        / denominators[~first].sum(axis=0)
+                    )
+
+        np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+    def test_workers_do_not_change_the_results(self):
+        numerators, denominators = metrics()
+        groups = np.where(np.arange(USERS) % 2 == 0, "FIRSTPERSON", "THIRDPERSON")
+        args = (["a", "b", "c"], numerators, denominators, groups)
+        compared = ("FIRSTPERSON", "THIRDPERSON")
+
+        self.assertEqual(
+            compare_groups(*args, compared, RESAMPLES, seed=3, workers=1),
+            compare_groups(*args, compared, RESAMPLES, seed=3, workers=3),
+        )
+
+
+class CompareGroupsTest(unittest.TestCase):
+    def test_estimates_and_p_values(self):
+        numerators, denominators = metrics()
+        groups = np.where(np.arange(USERS) < 20, "FIRSTPERSON", "THIRDPERSON")
+        result = compare_groups(
+            ["a", "b", "c"],
+            numerators,
+            denominators,
+            groups,
+            ("FIRSTPERSON", "THIRDPERSON"),
+            RESAMPLES,
+        )
+
+        self.assertEqual(result["groupSizes"], {"FIRSTPERSON": 20, "THIRDPERSON": 17})
+        for i, name in enumerate(["a", "b", "c"]):
+            first = numerators[:20, i].sum() / denominators[:20, i].sum()
+            second = numerators[20:, i].sum() / denominators[20:, i].sum()
+            metric = result["metrics"][name]
+            self.assertAlmostEqual(metric["FIRSTPERSON"]["value"], first)
+            self.assertAlmostEqual(metric["THIRDPERSON"]["value"], second)
+
+            difference = metric["FIRSTPERSON-THIRDPERSON"]
+            self.assertAlmostEqual(difference["value"], first - second)
+            low, high = difference["interval"]
+            self.assertLessEqual(low, high)
+            self.assertGreaterEqual(difference["pValue"], 1 / (RESAMPLES + 1))
+            self.assertLessEqual(difference["pValue"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
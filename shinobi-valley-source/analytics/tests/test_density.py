@@ -0,0 +1,99 @@
+"""The binned grid density matches the exact gaussian KDE it stands in for."""
+
+import unittest
+
+import numpy as np
+
+import support  # noqa: F401
+from density import grid_density, grid_shape, scott_bandwidth  # noqa: E402
+
+EXTENT = [-40.0, 40.0, -25.0, 25.0]
+
+
+def points(count: int = 200, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.normal([2.0, -1.0], [9.0, 6.0], size=(count, 2))
+
+
+def exact_density(
+    points: np.ndarray, bandwidth: np.ndarray, extent: list, weights=None
+) -> np.ndarray:
+    """The KDE (with a diagonal bandwidth) evaluated at the center of every cell."""
+    x_min, x_max, y_min, y_max = extent
+    rows, columns = grid_shape(extent)
+    x = x_min + (np.arange(columns) + 0.5) * (x_max - x_min) / columns
+    y = y_min + (np.arange(rows) + 0.5) * (y_max - y_min) / rows
+    if weights is None:
+        weights = np.ones(len(points))
+
+    density = np.zeros((rows, columns))
+    for (px, py), weight in zip(points, weights):
+        density += weight * np.outer(
+            np.exp(-0.5 * ((y - py) / bandwidth[1]) ** 2),
+            np.exp(-0.5 * ((x - px) / bandwidth[0]) ** 2),
+        )
+    return density / (weights.sum() * 2 * np.pi * bandwidth[0] * bandwidth[1])
+
+
+class ScottBandwidthTest(unittest.TestCase):
+    def test_matches_gaussian_kde(self):
+        from scipy.stats import gaussian_kde
+
+        samples = points()
+        weights = np.random.default_rng(1).uniform(0.5, 2.0, size=len(samples))
+        for sample_weights in (None, weights):
+            kde = gaussian_kde(samples.T, weights=sample_weights)
+            np.testing.assert_allclose(
+                scott_bandwidth(samples, sample_weights),
+                np.sqrt(np.diag(kde.covariance)),
+                rtol=1e-12,
+            )
+
+    def test_frequency_weights_repeat_points(self):
+        samples = points(50)
+        counts = np.random.default_rng(2).integers(1, 6, size=len(samples))
+        np.testing.assert_allclose(
+            scott_bandwidth(samples, counts.astype(np.float64), frequency_weights=True),
+            scott_bandwidth(np.repeat(samples, counts, axis=0)),
+            rtol=1e-12,
+        )
+
+
+class GridDensityTest(unittest.TestCase):
+    def test_matches_exact_kde(self):
+        samples = points()
+        bandwidth = scott_bandwidth(samples)
+        density = grid_density(samples, EXTENT)
+        expected = exact_density(samples, bandwidth, EXTENT)
+
+        self.assertEqual(density.shape, grid_shape(EXTENT))
+        # Binning moves each point by at most half a cell, a fraction of the bandwidth
+        self.assertLess(np.abs(density - expected).max(), 0.03 * expected.max())
+
+    def test_integrates_to_one(self):
+        density = grid_density(points(), EXTENT)
+        self.assertAlmostEqual(density.sum(), 1.0, places=2)
+
+    def test_frequency_weights_repeat_points(self):
+        samples = points(50)
+        counts = np.random.default_rng(2).integers(1, 6, size=len(samples))
+        np.testing.assert_allclose(
+            grid_density(
+                samples,
+                EXTENT,
+                weights=counts.astype(np.float64),
+                frequency_weights=True,
+            ),
+            grid_density(np.repeat(samples, counts, axis=0), EXTENT),
+            rtol=1e-9,
+            atol=1e-15,
+        )
+
+    def test_no_points(self):
+        np.testing.assert_array_equal(
+            grid_density(np.empty((0, 2)), EXTENT), np.zeros(grid_shape(EXTENT))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
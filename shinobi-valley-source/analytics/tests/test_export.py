@@ -0,0 +1,107 @@
+"""An export reads back as the parsed sessions and user stats it was written from."""
+
+import contextlib
+import io
+import tempfile
+import unittest
+from dataclasses import asdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from support import parse
+from export import EXPORT_FORMATS, export_sessions  # noqa: E402
+from metrics import trajectory_metrics  # noqa: E402
+from process import MAP_EXTENT, aggregate_sessions  # noqa: E402
+from store import TABLE_SCHEMAS  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+
+def read_back(path: Path, file_format: str) -> pd.DataFrame:
+    frame = ds.dataset(path, format=file_format, partitioning="hive").to_table()
+    frame = frame.to_pandas()
+    for name, column in frame.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            frame[name] = column.astype(str)
+        elif pd.api.types.is_datetime64_any_dtype(column):
+            frame[name] = column.astype("datetime64[s]").astype(np.int64)
+    return frame
+
+
+def in_row_order(frame: pd.DataFrame) -> pd.DataFrame:
+    # Partitions are read back one after the other
+    frame = frame[sorted(frame.columns)]
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+
+class ExportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.store = parse(
+            generate_database(
+                directory / "source.db",
+                users=10,
+                session_minutes=8,
+                missing_endtime_fraction=0.0,
+            ),
+            stream=False,
+        )
+        metrics = trajectory_metrics(
+            cls.store.positions, len(cls.store.user_id), MAP_EXTENT
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, cls.user_stats = aggregate_sessions(cls.store, metrics)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def export(self, file_format: str) -> Path:
+        path = Path(self.directory.name) / file_format
+        export_sessions(self.store, self.user_stats, path, file_format)
+        return path
+
+    def test_session_tables(self):
+        for file_format in EXPORT_FORMATS:
+            path = self.export(file_format)
+            for table in TABLE_SCHEMAS:
+                with self.subTest(file_format=file_format, table=table):
+                    expected = getattr(self.store, table).to_frame()
+                    user_indices = expected.pop("user_index").to_numpy()
+                    expected["user_id"] = self.store.user_id[user_indices]
+                    expected["perspective"] = self.store.perspective[user_indices]
+                    self.assertGreater(len(expected), 0)
+
+                    pd.testing.assert_frame_equal(
+                        in_row_order(read_back(path / table, file_format)),
+                        in_row_order(expected),
+                        check_dtype=False,
+                    )
+
+    def test_users_and_user_stats(self):
+        self.assertGreater(len(self.user_stats), 0)
+        for file_format in EXPORT_FORMATS:
+            with self.subTest(file_format=file_format):
+                path = self.export(file_format)
+
+                users = read_back(path / "users", file_format)
+                np.testing.assert_array_equal(users["user_id"], self.store.user_id)
+                np.testing.assert_array_equal(users["user"], self.store.user)
+
+                user_stats = ds.dataset(path / "user_stats", format=file_format)
+                rows = user_stats.to_table().to_pylist()
+                self.assertEqual(len(rows), len(self.user_stats))
+                for row, stats in zip(rows, self.user_stats):
+                    expected = asdict(stats)
+                    self.assertEqual(row["user_id"], expected["user_id"])
+                    self.assertEqual(
+                        row["banana_pickups"], list(expected["banana_pickups"])
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()
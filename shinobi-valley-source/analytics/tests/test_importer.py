@@ -0,0 +1,73 @@
+"""An imported dump has the production schema and parses like its source database."""
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from support import assert_same_store, parse
+from importer import import_rows, read_sql_dump  # noqa: E402
+from import_dump import tables_match, write_sql_dump  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+
+def column_types(db_path: Path, table: str) -> dict:
+    connection = sqlite3.connect(db_path)
+    try:
+        return {
+            name: column_type
+            for _, name, column_type, *_ in connection.execute(
+                f"PRAGMA table_info({table})"
+            )
+        }
+    finally:
+        connection.close()
+
+
+class ImporterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.source_db = generate_database(
+            directory / "source.db", users=12, session_minutes=3
+        )
+        write_sql_dump(cls.source_db, directory / "dump.sql")
+        cls.imported_db = directory / "imported.db"
+        import_rows(read_sql_dump(directory / "dump.sql"), cls.imported_db)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_schema_matches_production(self):
+        # server-assets/schema.sql, which the synthetic database is created from
+        for table in ("userdata", "timeseries"):
+            imported = column_types(self.imported_db, table)
+            source = column_types(self.source_db, table)
+            self.assertEqual(list(imported), list(source))
+            self.assertEqual(imported["id"], "INTEGER")
+        self.assertEqual(
+            column_types(self.imported_db, "timeseries")["userdata_id"], "TEXT"
+        )
+
+        connection = sqlite3.connect(self.imported_db)
+        try:
+            ((stored_type,),) = connection.execute(
+                "SELECT DISTINCT typeof(userdata_id) FROM timeseries"
+            ).fetchall()
+        finally:
+            connection.close()
+        self.assertEqual(stored_type, "text")
+
+    def test_rows_match(self):
+        self.assertTrue(tables_match(self.source_db, self.imported_db))
+
+    def test_sessions_match(self):
+        expected = parse(self.source_db, stream=False)
+        for stream in (False, True):
+            assert_same_store(parse(self.imported_db, stream=stream), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
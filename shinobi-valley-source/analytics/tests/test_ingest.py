@@ -0,0 +1,110 @@
+"""A database written by the ingest server has the production schema and parses."""
+
+import asyncio
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from support import ROOT, assert_same_store, parse
+from decoders import decode_timestamps  # noqa: E402
+from ingest import TelemetryWriter  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+SCHEMA_PATH = ROOT.parent / "server-assets" / "schema.sql"
+
+
+def column_types(connection: sqlite3.Connection, table: str) -> list:
+    return [
+        (name, column_type)
+        for _, name, column_type, *_ in connection.execute(
+            f"PRAGMA table_info({table})"
+        )
+    ]
+
+
+async def replay(source_db: Path, db_path: Path, flush_rows: int = 50):
+    """Post the sessions and logs of a database to an ingest writer, like the game."""
+    source = sqlite3.connect(source_db)
+    writer = TelemetryWriter(db_path, flush_rows=flush_rows, flush_interval=0.01)
+    await writer.start()
+    flusher = asyncio.create_task(writer.run())
+    try:
+        sessions = source.execute(
+            "SELECT id, user, perspective, starttime, endtime FROM userdata ORDER BY id"
+        ).fetchall()
+        for source_id, user, perspective, starttime, endtime in sessions:
+            user_id = await writer.new_session(
+                user,
+                perspective,
+                "127.0.0.1",
+                str(decode_timestamps([starttime])[0]),
+                "",
+            )
+            logs = source.execute(
+                "SELECT timestamp, logtype, logline FROM timeseries "
+                "WHERE userdata_id = ? ORDER BY id",
+                (str(source_id),),
+            ).fetchall()
+            seconds = decode_timestamps([timestamp for timestamp, _, _ in logs])
+            await writer.add(
+                [
+                    (user_id, str(timestamp), logtype, logline)
+                    for timestamp, (_, logtype, logline) in zip(seconds.tolist(), logs)
+                ]
+            )
+            if endtime is not None:
+                await writer.end_session(user_id, str(decode_timestamps([endtime])[0]))
+    finally:
+        flusher.cancel()
+        await writer.close()
+        source.close()
+
+
+class IngestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.source_db = generate_database(
+            directory / "source.db", users=12, session_minutes=3
+        )
+        cls.ingest_db = directory / "ingest.db"
+        asyncio.run(replay(cls.source_db, cls.ingest_db))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_schema_matches_production(self):
+        production = sqlite3.connect(":memory:")
+        production.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+        ingested = sqlite3.connect(self.ingest_db)
+        try:
+            for table in ("userdata", "timeseries"):
+                self.assertEqual(
+                    column_types(ingested, table), column_types(production, table)
+                )
+            ((stored_type,),) = ingested.execute(
+                "SELECT DISTINCT typeof(userdata_id) FROM timeseries"
+            ).fetchall()
+            self.assertEqual(stored_type, "text")
+        finally:
+            production.close()
+            ingested.close()
+
+    def test_sessions_parse(self):
+        source = parse(self.source_db, stream=False)
+        expected = parse(self.ingest_db, stream=False)
+        np.testing.assert_array_equal(expected.user_id, np.arange(1, 13))
+        np.testing.assert_array_equal(expected.endtime, source.endtime)
+        np.testing.assert_array_equal(
+            expected.positions["position"], source.positions["position"]
+        )
+        assert_same_store(parse(self.ingest_db, stream=True), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
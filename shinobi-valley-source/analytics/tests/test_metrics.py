@@ -0,0 +1,96 @@
+"""The vectorized trajectory metrics match a user-by-user computation."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from support import parse
+from metrics import (  # noqa: E402
+    COVERAGE_CELL_SIZE,
+    IDLE_DISTANCE,
+    _grouped_percentile,
+    trajectory_metrics,
+)
+from process import MAP_EXTENT  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+
+class GroupedPercentileTest(unittest.TestCase):
+    def test_matches_numpy_per_group(self):
+        rng = np.random.default_rng(0)
+        # Group 3 has no values, group 5 a single one
+        groups = np.concatenate([rng.choice([0, 1, 2, 4], size=500), [5]])
+        values = rng.normal(size=len(groups))
+        # Ties, which the ordering must not break
+        values[::7] = 0.25
+
+        for q in (0, 12.5, 50, 90, 100):
+            expected = [
+                np.percentile(values[groups == group], q) if group != 3 else np.nan
+                for group in range(6)
+            ]
+            np.testing.assert_allclose(
+                _grouped_percentile(values, groups, 6, q), expected, rtol=1e-12
+            )
+
+
+class TrajectoryMetricsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            cls.store = parse(
+                generate_database(
+                    Path(directory) / "source.db", users=8, session_minutes=3
+                ),
+                stream=False,
+            )
+
+    def test_matches_user_by_user(self):
+        positions = self.store.positions
+        user_count = len(self.store.user_id)
+        metrics = trajectory_metrics(positions, user_count, MAP_EXTENT)
+
+        x_min, x_max, z_min, z_max = MAP_EXTENT
+        cell_count = int(np.ceil((z_max - z_min) / COVERAGE_CELL_SIZE)) * int(
+            np.ceil((x_max - x_min) / COVERAGE_CELL_SIZE)
+        )
+        for user_index in range(user_count):
+            user = positions.for_user(user_index)
+            pos_delta = user["pos_delta"]
+            self.assertGreater(len(pos_delta), 1)
+
+            order = np.argsort(user["timestamp"], kind="stable")
+            speeds = [
+                pos_delta[current] / elapsed
+                for previous, current in zip(order[:-1], order[1:])
+                if (elapsed := user["timestamp"][current] - user["timestamp"][previous])
+                > 0
+            ]
+            cells = {
+                (
+                    int((z - z_min) // COVERAGE_CELL_SIZE),
+                    int((x - x_min) // COVERAGE_CELL_SIZE),
+                )
+                for x, _, z in user["position"].tolist()
+                if x_min <= x < x_max and z_min <= z < z_max
+            }
+            expected = {
+                "total_distance": pos_delta.sum(),
+                "idle_fraction": np.mean(pos_delta < IDLE_DISTANCE),
+                "running_fraction": np.mean(user["running"]),
+                "jumping_fraction": np.mean(user["jumping"]),
+                "speed_median": np.median(speeds),
+                "speed_p90": np.percentile(speeds, 90),
+                "map_coverage": len(cells) / cell_count,
+            }
+
+            for name, value in expected.items():
+                self.assertAlmostEqual(
+                    metrics[name][user_index], value, msg=f"{name} of {user_index}"
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""The migration indexes a database once, without changing how its sessions parse."""
+
+import contextlib
+import io
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from support import assert_same_store, parse
+from migrate import create_indexes, migrate  # noqa: E402
+from models import Timeseries, Userdata  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+
+def table_names(db_path: Path, kind: str) -> set:
+    connection = sqlite3.connect(db_path)
+    try:
+        return {
+            name
+            for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = ?", (kind,)
+            )
+        }
+    finally:
+        connection.close()
+
+
+class MigrateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.source_db = generate_database(
+            directory / "source.db", users=12, session_minutes=3
+        )
+        cls.migrated_db = directory / "migrated.db"
+        shutil.copy(cls.source_db, cls.migrated_db)
+
+        # The decoded positions table of earlier versions
+        connection = sqlite3.connect(cls.migrated_db)
+        with connection:
+            connection.execute("CREATE TABLE poslog (timeseries_id INTEGER)")
+        connection.close()
+
+        cls.engine = create_engine(f"sqlite:///{cls.migrated_db}", echo=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            migrate(cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.directory.cleanup()
+
+    def test_indexes_created_once(self):
+        expected = {
+            index.name
+            for table in (Userdata.__table__, Timeseries.__table__)
+            for index in table.indexes
+        }
+        self.assertLessEqual(expected, table_names(self.migrated_db, "index"))
+        self.assertEqual(create_indexes(self.engine), 0)
+
+    def test_legacy_poslog_dropped(self):
+        self.assertNotIn("poslog", table_names(self.migrated_db, "table"))
+
+    def test_sessions_match(self):
+        for stream in (False, True):
+            with self.subTest(stream=stream):
+                assert_same_store(
+                    parse(self.migrated_db, stream), parse(self.source_db, stream)
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Figures are rendered again when the area they cover changes, and only then."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+import support  # noqa: F401
+from render import Figure, render_figures  # noqa: E402
+
+EXTENT = [-20.0, 20.0, -10.0, 10.0]
+
+
+def figures() -> list:
+    rng = np.random.default_rng(0)
+    markers = np.array([[0.0, 0.0]])
+    return [
+        Figure("user/1", "User 1", rng.normal(0.0, 3.0, size=(50, 2)), markers),
+        Figure("user/2", "User 2", np.empty((0, 2)), markers),
+    ]
+
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = Path(self.directory.name)
+        self.background = np.zeros((4, 4, 3))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def render(self, extent) -> tuple:
+        return render_figures(
+            figures(), self.output, self.background, "background", extent, "npy"
+        )
+
+    def test_unchanged_figures_are_skipped(self):
+        self.assertEqual(self.render(EXTENT), (2, 0))
+        self.assertEqual(self.render(EXTENT), (0, 2))
+
+    def test_extent_changes_render_again(self):
+        self.render(EXTENT)
+        before = np.load(self.output / "user" / "1.npy")
+
+        # Same positions, over a larger area (and so a larger grid)
+        self.assertEqual(self.render([-40.0, 40.0, -10.0, 10.0]), (2, 0))
+        self.assertFalse(
+            np.array_equal(before, np.load(self.output / "user" / "1.npy"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""The streamed parsing gives the same sessions whatever the type of userdata_id."""
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from support import assert_same_store, parse
+from process import parse_studies  # noqa: E402
+from study import Study  # noqa: E402
+from synthetic import generate_database  # noqa: E402
+
+# More than 9 users, so that the text and numeric orders of the ids differ
+USERS = 12
+
+INTEGER_SCHEMA = """
+CREATE TABLE userdata (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user TEXT NOT NULL,
+    perspective TEXT NOT NULL,
+    ipaddr TEXT NOT NULL,
+    starttime TEXT NOT NULL,
+    endtime TEXT,
+    params TEXT NOT NULL
+);
+CREATE TABLE timeseries (
+    id INTEGER NOT NULL PRIMARY KEY,
+    userdata_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    logtype TEXT NOT NULL,
+    logline TEXT NOT NULL
+);
+"""
+
+
+def copy_with_integer_ids(source: Path, destination: Path) -> Path:
+    connection = sqlite3.connect(destination)
+    connection.executescript(INTEGER_SCHEMA)
+    connection.execute("ATTACH ? AS source", (str(source),))
+    connection.execute("INSERT INTO userdata SELECT * FROM source.userdata")
+    connection.execute(
+        "INSERT INTO timeseries SELECT id, CAST(userdata_id AS INTEGER), timestamp, "
+        "logtype, logline FROM source.timeseries"
+    )
+    connection.commit()
+    connection.close()
+    return destination
+
+
+def parse_two_studies(db_path: Path) -> dict:
+    with Session(create_engine(f"sqlite:///{db_path}", echo=False)) as session:
+        return parse_studies(
+            session,
+            [
+                Study(name="first", minimum_duration_minutes=0),
+                Study(name="second", minimum_duration_minutes=0),
+            ],
+            chunk_size=97,
+        )
+
+
+class StreamOrderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.text_db = generate_database(
+            directory / "text.db", users=USERS, session_minutes=3
+        )
+        cls.integer_db = copy_with_integer_ids(cls.text_db, directory / "integer.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_stream_matches_whole_sessions(self):
+        assert_same_store(parse(self.text_db, True), parse(self.text_db, False))
+
+    def test_integer_user_ids(self):
+        expected = parse(self.text_db, True)
+        np.testing.assert_array_equal(expected.user_id, np.arange(1, USERS + 1))
+        assert_same_store(parse(self.integer_db, True), expected)
+
+    def test_studies_with_integer_user_ids(self):
+        expected = parse_two_studies(self.text_db)
+        actual = parse_two_studies(self.integer_db)
+        self.assertEqual(list(actual), ["first", "second"])
+        np.testing.assert_array_equal(actual["first"].user_id, np.arange(1, USERS + 1))
+        for name in expected:
+            assert_same_store(actual[name], expected[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""A trajectory file gives back the positions of the store it was written from."""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from support import parse
+from synthetic import generate_database  # noqa: E402
+from trajectory import TrajectoryFile, write_trajectories  # noqa: E402
+
+
+class TrajectoryFileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        directory = Path(cls.directory.name)
+        cls.store = parse(
+            generate_database(directory / "source.db", users=12, session_minutes=3),
+            stream=True,
+        )
+        write_trajectories(cls.store, directory / "trajectories.bin")
+        cls.trajectories = TrajectoryFile(directory / "trajectories.bin")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_path_lengths(self):
+        positions = self.store.positions
+        expected = []
+        for user_index in range(len(self.store.user_id)):
+            # The file keeps the positions as float32
+            xyz = positions["position"][positions.user_slice(user_index)]
+            xyz = xyz.astype(np.float32).astype(np.float64)
+            expected.append(
+                sum(
+                    np.linalg.norm(xyz[row + 1] - xyz[row])
+                    for row in range(len(xyz) - 1)
+                )
+            )
+
+        self.assertEqual(len(self.trajectories), len(self.store.user_id))
+        np.testing.assert_allclose(self.trajectories.path_lengths(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()